@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Headless benchmark harness for the experiment trial loops.
+
+Runs full sessions of SentenceComprehensionExperiment,
+SentenceComprehensionExperimentTDT (both on the shared sentence_core
+path) and TutorialExperiment against the
+stand-in window, sound, keyboard and Synapse modules from headless_fakes,
+in virtual time, and reports per-stage wall-clock timings (load, mix,
+play, quiz render, save, trigger, ...). Needs the real numpy, scipy,
+pandas, soundfile, matplotlib and openpyxl packages, but no display,
+audio device or TDT rig.
+
+Usage:
+    python benchmarks/headless_bench.py
+    python benchmarks/headless_bench.py --only tdt --repeat 5 --json bench.json
+    python benchmarks/headless_bench.py --baseline bench.json --tolerance 0.25
+"""
+
+import argparse
+import functools
+import importlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import headless_fakes
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXPERIMENTS_DIR = os.path.join(ROOT, 'experiments')
+TUTORIAL_DIR = os.path.join(ROOT, 'tutorial')
+
+
+class StageTimer:
+    """Wraps callables and collects per-stage wall-clock samples."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self._patched = []
+
+    def wrap(self, owner, attr, stage):
+        original = getattr(owner, attr)
+        samples = self.samples[stage]
+
+        @functools.wraps(original)
+        def timed(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                samples.append(time.perf_counter() - t0)
+
+        setattr(owner, attr, timed)
+        self._patched.append((owner, attr, original))
+
+    def restore(self):
+        for owner, attr, original in reversed(self._patched):
+            setattr(owner, attr, original)
+        self._patched = []
+
+    def report(self):
+        out = {}
+        for stage, values in self.samples.items():
+            if not values:
+                continue
+            ordered = sorted(values)
+            out[stage] = {
+                'calls': len(values),
+                'total_ms': 1000.0 * sum(values),
+                'mean_ms': 1000.0 * sum(values) / len(values),
+                'p95_ms': 1000.0 * ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))],
+                'max_ms': 1000.0 * ordered[-1],
+            }
+        return out
+
+
+def _prepare_workdir():
+    """Temp working dir with the stimuli and spreadsheets the scripts expect."""
+    workdir = tempfile.mkdtemp(prefix='psychopy_bench_')
+    for name in ('stimuli', 'quiz.xlsx', 'trg_table.xlsx'):
+        src = os.path.join(ROOT, name)
+        dst = os.path.join(workdir, name)
+        if os.path.isdir(src):
+            shutil.copytree(src, dst)
+        elif os.path.exists(src):
+            shutil.copy2(src, dst)
+    return workdir
+
+
+def _prepare_tutorial_resources(workdir, tone_sec=0.5):
+    """Copy of the tutorial stimuli with short tones for missing main stimuli.
+
+    The main-block recordings are not in the repository, so each missing
+    file listed in main_stimuli.csv is written as a quiet 440 Hz tone in
+    the format of the ERP stimulus.
+    """
+    import numpy as np
+    import pandas as pd
+    import soundfile as sf
+
+    resource_dir = os.path.join(workdir, 'tutorial')
+    for folder in ('erp_stimuli', 'main_stimuli'):
+        shutil.copytree(os.path.join(TUTORIAL_DIR, folder), os.path.join(resource_dir, folder))
+    info = sf.info(os.path.join(resource_dir, 'erp_stimuli', 'erp_stimuli.wav'))
+    t = np.arange(int(tone_sec * info.samplerate)) / info.samplerate
+    tone = np.repeat((0.1 * np.sin(2 * np.pi * 440.0 * t))[:, None], info.channels, axis=1)
+    for fname in pd.read_csv(os.path.join(resource_dir, 'main_stimuli', 'main_stimuli.csv'))['fname']:
+        path = os.path.join(resource_dir, fname)
+        if not os.path.exists(path):
+            sf.write(path, tone, info.samplerate, subtype='PCM_16')
+    return resource_dir
+
+
+def _hold_for_scheduled_triggers():
+    """Keep virtual time at real-time speed while a scheduler has triggers queued.
+
+    The trigger helper thread waits on the stream clock; without the
+    hold, a flip could move the clock past a trigger's DAC time before
+    the helper wakes up. The helper also keeps its normal priority here:
+    the fake stream clock only moves while the main thread runs, so on
+    one core a real-time helper spinning on it holds the clock still
+    until STALL_TIMEOUT drops the trigger. A hardware clock runs on its
+    own.
+    """
+    import audio_triggers
+    audio_triggers.raise_thread_priority = lambda: False
+    cls = audio_triggers.SampleTriggerScheduler
+    if getattr(cls.__init__, '_holds', False):
+        return
+    original = cls.__init__
+
+    @functools.wraps(original)
+    def init(self, *args, **kwargs):
+        original(self, *args, **kwargs)
+        headless_fakes.hold_while(lambda: self.pending() > 0)
+
+    init._holds = True
+    cls.__init__ = init
+
+
+def _run_session(factory):
+    try:
+        factory().run()
+    except SystemExit:
+        pass
+
+
+def bench_sentence(timer, use_tdt, streaming=False):
+    """One sentence comprehension session (plain or TDT).
+
+    Both entry points run the shared sentence_core code path; only the
+    display and trigger backends differ. `streaming` (TDT only) streams
+    the stimuli block by block instead of preloading them.
+    """
+    core_mod = importlib.import_module('sentence_core')
+    if use_tdt:
+        mod = importlib.import_module('sentence_comprehension_TDT')
+        cls = mod.SentenceComprehensionExperimentTDT
+        timer.wrap(mod.TDTSynapseManager, 'send_trigger', 'trigger')
+        timer.wrap(mod.TDTSynapseManager, 'configure', 'tdt configure')
+        timer.wrap(mod.TDTTriggers, '_load_trigger_table', 'load')
+        if streaming:
+            cls = functools.partial(cls, streaming=True)
+    else:
+        mod = importlib.import_module('sentence_comprehension')
+        cls = mod.SentenceComprehensionExperiment
+
+    timer.wrap(core_mod.Display, 'open', 'window init')
+    timer.wrap(core_mod.StimulusBank, 'build', 'stimulus build')
+    base = core_mod.SentenceExperiment
+    for attr, stage in [('_load_quiz_data', 'load'), ('_get_audio_files', 'load'),
+                        ('load_stereo_audio', 'mix'), ('play_audio', 'play'),
+                        ('show_quiz', 'quiz render'), ('save_data', 'save'),
+                        ('plot_results', 'plot'), ('run_trial', 'trial')]:
+        timer.wrap(base, attr, stage)
+    timer.wrap(core_mod, 'export_session', 'export')
+
+    _run_session(cls)
+
+
+def bench_tutorial(timer, workdir):
+    """One tutorial session on a copy of its stimuli (see _prepare_tutorial_resources)."""
+    mod = importlib.import_module('tutorial_refac_win')
+    resource_dir = _prepare_tutorial_resources(workdir)
+    mod._detect_resource_dir = lambda: resource_dir
+    mod._detect_output_dir = lambda: workdir
+    cls = mod.TutorialExperiment
+    timer.wrap(mod.data, 'importConditions', 'load')
+    timer.wrap(cls, 'prepare_stimulus', 'play')
+    timer.wrap(cls, 'present_routine', 'render')
+    timer.wrap(cls, 'run_routine', 'render')
+    timer.wrap(mod.TDTManager, 'send_trigger', 'trigger')
+    timer.wrap(mod.TDTManager, 'configure', 'tdt configure')
+    timer.wrap(mod.data.ExperimentHandler, 'nextEntry', 'save')
+    timer.wrap(mod.data.ExperimentHandler, 'close', 'save')
+    _run_session(cls)
+
+
+EXPERIMENTS = {
+    'sentence': lambda timer, workdir: bench_sentence(timer, use_tdt=False),
+    'tdt': lambda timer, workdir: bench_sentence(timer, use_tdt=True),
+    'tdt-stream': lambda timer, workdir: bench_sentence(timer, use_tdt=True, streaming=True),
+    'tutorial': bench_tutorial,
+}
+
+
+def run_benchmarks(names, repeat=1, rpc_latency=0.0, response_delay=0.3, verbose=False):
+    """Run each named experiment `repeat` times; return {name: stage stats}."""
+    headless_fakes.install(rpc_latency=rpc_latency, response_delay=response_delay)
+    for path in (EXPERIMENTS_DIR, TUTORIAL_DIR):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    _hold_for_scheduled_triggers()
+
+    results = {}
+    errors = {}
+    cwd = os.getcwd()
+    for name in names:
+        timer = StageTimer()
+        workdir = _prepare_workdir()
+        try:
+            os.chdir(workdir)
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                try:
+                    with _quiet(not verbose):
+                        EXPERIMENTS[name](timer, workdir)
+                except Exception as e:
+                    # Keep the stages that did run; report the failure
+                    errors[name] = f"{type(e).__name__}: {e}"
+                    break
+                finally:
+                    timer.restore()
+                timer.samples['session'].append(time.perf_counter() - t0)
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(workdir, ignore_errors=True)
+        results[name] = timer.report()
+    return results, errors
+
+
+class _quiet:
+    """Silence the experiments' console output while benchmarking."""
+
+    def __init__(self, enabled):
+        self.enabled = enabled
+
+    def __enter__(self):
+        if self.enabled:
+            self._streams = sys.stdout, sys.stderr
+            sys.stdout = sys.stderr = open(os.devnull, 'w')
+
+    def __exit__(self, *exc):
+        if self.enabled:
+            sys.stdout.close()
+            sys.stdout, sys.stderr = self._streams
+
+
+def print_results(results):
+    for name, stages in results.items():
+        print(f"\n=== {name} ===")
+        print(f"{'stage':<16}{'calls':>7}{'mean ms':>11}{'p95 ms':>11}{'max ms':>11}{'total ms':>12}")
+        for stage, s in sorted(stages.items(), key=lambda item: -item[1]['total_ms']):
+            print(f"{stage:<16}{s['calls']:>7}{s['mean_ms']:>11.3f}{s['p95_ms']:>11.3f}"
+                  f"{s['max_ms']:>11.3f}{s['total_ms']:>12.1f}")
+
+
+def compare_to_baseline(results, baseline, tolerance, min_delta_ms=0.05):
+    """Return a list of (experiment, stage, baseline_ms, current_ms) regressions."""
+    regressions = []
+    for name, stages in results.items():
+        for stage, s in stages.items():
+            ref = baseline.get(name, {}).get(stage)
+            if ref is None:
+                continue
+            current, previous = s['mean_ms'], ref['mean_ms']
+            if current > previous * (1.0 + tolerance) and current - previous > min_delta_ms:
+                regressions.append((name, stage, previous, current))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--only', choices=sorted(EXPERIMENTS), action='append',
+                        help='experiment(s) to run (default: all)')
+    parser.add_argument('--repeat', type=int, default=1, help='sessions per experiment')
+    parser.add_argument('--rpc-latency-ms', type=float, default=0.0,
+                        help='simulated Synapse RPC latency per call')
+    parser.add_argument('--response-delay', type=float, default=0.3,
+                        help='scripted response time in virtual seconds')
+    parser.add_argument('--json', help='write results to this JSON file')
+    parser.add_argument('--baseline', help='compare mean stage times against this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative slowdown before a stage counts as regressed')
+    parser.add_argument('--verbose', action='store_true', help='show experiment output')
+    args = parser.parse_args(argv)
+
+    names = args.only or list(EXPERIMENTS)
+    results, errors = run_benchmarks(names, repeat=args.repeat,
+                                     rpc_latency=args.rpc_latency_ms / 1000.0,
+                                     response_delay=args.response_delay,
+                                     verbose=args.verbose)
+    print_results(results)
+    for name, error in errors.items():
+        print(f"\n⚠ {name} session aborted: {error}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n✓ Results saved: {args.json}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print("\n✗ Performance regressions:")
+            for name, stage, previous, current in regressions:
+                print(f"  {name}/{stage}: {previous:.3f} ms → {current:.3f} ms")
+            return 1
+        print("\n✓ No regressions against baseline")
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
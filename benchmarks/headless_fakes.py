@@ -0,0 +1,495 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Stand-in PsychoPy, sounddevice and tdt modules for headless benchmarking.
+
+`install()` registers fake `psychopy` (visual, core, event, gui, data,
+logging, sound, prefs, hardware.keyboard), `sounddevice` and `tdt`
+modules in sys.modules, so the experiment scripts can be imported and run
+without a display, audio device or TDT rig.
+
+Time is virtual: `win.flip()` advances the clock by one frame and
+`core.wait()` advances it by the requested amount without sleeping, so
+sessions run as fast as the Python code allows while all duration-based
+loops behave as in a real session. Key presses are scripted: a key is
+"pressed" once `response_delay` virtual seconds have passed since the
+last clearEvents() call.
+
+Fake audio streams run on the same clock: each advance delivers every
+callback block that falls due on the way, in time order, so no block
+is skipped however far the clock jumps. Code that waits on the stream
+clock from another thread (the trigger helper of
+audio_triggers.SampleTriggerScheduler) registers a `hold_while()`
+predicate; while one is true, virtual time runs at real-time speed
+instead of jumping, so the thread sees every instant it waits for.
+"""
+
+import csv
+import os
+import random
+import sys
+import threading
+import time
+import types
+from datetime import datetime
+
+
+class VirtualClockState:
+    """Shared virtual time and bookkeeping for all fakes."""
+
+    def __init__(self, frame_period=1.0 / 60.0, response_delay=0.3,
+                 rpc_latency=0.0, seed=0):
+        self.now = 0.0
+        self.frame_period = frame_period
+        self.response_delay = response_delay
+        self.rpc_latency = rpc_latency
+        self.rng = random.Random(seed)
+        self.lock = threading.RLock()
+        self.last_clear = 0.0
+        self.flips = 0
+        self.draws = 0
+        self.rpc_calls = 0
+        self.streams = []         # active fake OutputStreams
+        self.holds = []           # predicates that slow the clock to real time
+        self._follow = None       # (perf_counter, virtual time, limit) while held
+
+    def advance(self, secs):
+        """Move the clock forward, delivering the audio blocks due on the way."""
+        with self.lock:
+            target = self.now + max(0.0, secs)
+            while True:
+                stream = min(self.streams, key=OutputStream._due, default=None)
+                if stream is None or stream._due() > target:
+                    break
+                self._run_to(stream._due())
+                stream._deliver()
+            self._run_to(target)
+            return self.now
+
+    def _run_to(self, t):
+        # Jump, or follow perf_counter while a hold is active
+        while self.now < t:
+            if not any(held() for held in self.holds):
+                self.now = t
+                break
+            real = time.perf_counter()
+            if self._follow is None:
+                self._follow = (real, self.now, t)
+            self.now = min(t, self._follow[1] + real - self._follow[0])
+            if self.now < t:
+                time.sleep(0.0002)
+        self._follow = None
+
+    def stream_time(self):
+        """Current time as a waiting thread sees it (exact while held)."""
+        follow = self._follow
+        if follow is None:
+            return self.now
+        real, virtual, limit = follow
+        return min(limit, virtual + time.perf_counter() - real)
+
+
+STATE = VirtualClockState()
+
+
+def hold_while(predicate):
+    """Run virtual time at real-time speed while `predicate()` is true."""
+    STATE.holds.append(predicate)
+    return predicate
+
+
+# ----------------------------------------------------------------------
+# psychopy.core
+# ----------------------------------------------------------------------
+class Clock:
+    def __init__(self, format=None):
+        self._t0 = STATE.now
+
+    def getTime(self, format=None):
+        return STATE.now - self._t0
+
+    def reset(self, newT=0.0):
+        self._t0 = STATE.now - newT
+
+    def addTime(self, t):
+        self._t0 -= t
+
+
+def _core_wait(secs, hogCPUperiod=0.2):
+    STATE.advance(secs)
+
+
+def _core_quit():
+    raise SystemExit(0)
+
+
+# ----------------------------------------------------------------------
+# psychopy.visual
+# ----------------------------------------------------------------------
+class Window:
+    def __init__(self, size=(1920, 1080), color=None, units='pix', fullscr=False, **kwargs):
+        self.size = size
+        self.color = color
+        self.units = units
+        self.monitorFramePeriod = STATE.frame_period
+        self.mouseVisible = True
+        self._on_flip = []
+
+    def flip(self, clearBuffer=True):
+        now = STATE.advance(STATE.frame_period)
+        STATE.flips += 1
+        callbacks, self._on_flip = self._on_flip, []
+        for fn, args, kwargs in callbacks:
+            fn(*args, **kwargs)
+        return now
+
+    def callOnFlip(self, fn, *args, **kwargs):
+        self._on_flip.append((fn, args, kwargs))
+
+    def timeOnFlip(self, obj, attrib):
+        self.callOnFlip(lambda: setattr(obj, attrib, STATE.now))
+
+    def getFutureFlipTime(self, targetTime=0, clock=None):
+        t = STATE.now + STATE.frame_period
+        if clock is not None and hasattr(clock, '_t0'):
+            t -= clock._t0
+        return t
+
+    def close(self):
+        pass
+
+
+class _Stim:
+    status = None
+
+    def __init__(self, win=None, text='', **kwargs):
+        self.win = win
+        self.text = text
+        self.__dict__.update(kwargs)
+
+    def draw(self):
+        STATE.draws += 1
+
+    def setText(self, text):
+        self.text = text
+
+    def setAutoDraw(self, value):
+        pass
+
+
+# ----------------------------------------------------------------------
+# psychopy.event / psychopy.hardware.keyboard
+# ----------------------------------------------------------------------
+def _scripted_key(keyList):
+    """Return a scripted key once the response delay has elapsed."""
+    if STATE.now - STATE.last_clear < STATE.response_delay:
+        return None
+    candidates = [k for k in (keyList or ['space']) if k != 'escape']
+    if not candidates:
+        return None
+    STATE.last_clear = STATE.now
+    # Prefer navigation keys; answer quizzes at random
+    for key in ('space', '0', '9'):
+        if key in candidates:
+            return key
+    return STATE.rng.choice(candidates)
+
+
+def _event_get_keys(keyList=None, **kwargs):
+    key = _scripted_key(keyList)
+    return [key] if key else []
+
+
+def _clear_events(eventType=None):
+    STATE.last_clear = STATE.now
+
+
+class KeyPress:
+    def __init__(self, name, rt):
+        self.name = name
+        self.rt = rt
+        self.duration = None
+
+
+class Keyboard:
+    status = None
+
+    def __init__(self, *args, **kwargs):
+        self.clock = Clock()
+
+    def getKeys(self, keyList=None, waitRelease=False, **kwargs):
+        key = _scripted_key(keyList)
+        return [KeyPress(key, self.clock.getTime())] if key else []
+
+    def clearEvents(self, eventType=None):
+        _clear_events()
+
+
+# ----------------------------------------------------------------------
+# psychopy.gui / psychopy.data / psychopy.sound
+# ----------------------------------------------------------------------
+class DlgFromDict:
+    def __init__(self, dictionary=None, title='', **kwargs):
+        self.OK = True
+        self.dictionary = dictionary
+        self.data = list(dictionary.values()) if dictionary else []
+
+
+def _get_date_str(format='%Y-%m-%d_%Hh%M.%S.%f', **kwargs):
+    return datetime.now().strftime('%Y-%m-%d_%Hh%M.%S.%f')
+
+
+def _convert(value):
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except (TypeError, ValueError):
+            pass
+    return value
+
+
+def _import_conditions(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        return [{k: _convert(v) for k, v in row.items()} for row in csv.DictReader(f)]
+
+
+class ExperimentHandler:
+    def __init__(self, name='', version='', extraInfo=None, dataFileName='data', **kwargs):
+        self.dataFileName = dataFileName
+        self.entries = []
+        self._current = {}
+
+    def addData(self, name, value):
+        self._current[name] = value
+
+    def timestampOnFlip(self, win, name):
+        win.callOnFlip(lambda: self.addData(name, STATE.now))
+
+    def nextEntry(self):
+        self.entries.append(self._current)
+        self._current = {}
+
+    def close(self):
+        if self._current:
+            self.nextEntry()
+        columns = []
+        for row in self.entries:
+            columns.extend(k for k in row if k not in columns)
+        os.makedirs(os.path.dirname(self.dataFileName) or '.', exist_ok=True)
+        with open(self.dataFileName + '.csv', 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(self.entries)
+
+
+class _UnavailableSound:
+    backend = None
+
+    def __init__(self, *args, **kwargs):
+        raise RuntimeError("no PsychoPy audio backend in headless mode")
+
+
+# ----------------------------------------------------------------------
+# sounddevice
+# ----------------------------------------------------------------------
+class CallbackStop(Exception):
+    pass
+
+
+class PortAudioError(Exception):
+    pass
+
+
+class _TimeInfo:
+    def __init__(self, now, dac_time):
+        self.currentTime = now
+        self.outputBufferDacTime = dac_time
+
+
+class OutputStream:
+    """Audio callback driven by the virtual clock, block by block.
+
+    Each block is delivered one output latency before its DAC time, on
+    the thread that advances the clock.
+    """
+
+    def __init__(self, samplerate=44100, channels=2, dtype='float32', blocksize=256,
+                 latency='low', callback=None, finished_callback=None, **kwargs):
+        import numpy as np
+        self.samplerate = samplerate
+        self.channels = channels
+        self.blocksize = blocksize or 256
+        self.latency = 0.01
+        self.callback = callback
+        self.finished_callback = finished_callback
+        self._out = np.zeros((self.blocksize, channels), dtype='float32')
+        self._dac_time = None
+        self.active = False
+        self.closed = False
+
+    @property
+    def time(self):
+        if self.closed:
+            raise PortAudioError("Stream is closed")
+        return STATE.stream_time()
+
+    def _due(self):
+        return self._dac_time - self.latency
+
+    def start(self):
+        with STATE.lock:
+            self._dac_time = STATE.now + self.latency
+            self.active = True
+            STATE.streams.append(self)
+
+    def _deliver(self):
+        out = self._out
+        try:
+            self.callback(out, self.blocksize, _TimeInfo(STATE.now, self._dac_time), None)
+        except CallbackStop:
+            self._finish()
+            return
+        except Exception:
+            self._finish()
+            raise
+        self._dac_time += self.blocksize / float(self.samplerate)
+
+    def _finish(self):
+        with STATE.lock:
+            if not self.active:
+                return
+            self.active = False
+            STATE.streams.remove(self)
+        if self.finished_callback is not None:
+            self.finished_callback()
+
+    def stop(self):
+        self._finish()
+
+    abort = stop
+
+    def close(self):
+        self._finish()
+        self.closed = True
+
+
+def _sd_play(data, samplerate=None, blocking=False, **kwargs):
+    pass
+
+
+def _sd_wait():
+    pass
+
+
+# ----------------------------------------------------------------------
+# tdt
+# ----------------------------------------------------------------------
+class SynapseAPI:
+    """Fake Synapse RPC server with optional per-call latency."""
+
+    def __init__(self, server='localhost', port=24414):
+        self.mode = 0
+        self.state = {'user': '', 'experiment': '', 'subject': '', 'block': '', 'tank': 'FakeTank'}
+        self.subjects = []
+        self.params = {}
+
+    def _rpc(self):
+        STATE.rpc_calls += 1
+        if STATE.rpc_latency:
+            time.sleep(STATE.rpc_latency)
+
+    def getMode(self):
+        self._rpc()
+        return self.mode
+
+    def setMode(self, mode):
+        self._rpc()
+        self.mode = mode
+
+    def setParameterValue(self, gizmo, parameter, value):
+        self._rpc()
+        self.params[(gizmo, parameter)] = value
+        return True
+
+    def getParameterValue(self, gizmo, parameter):
+        self._rpc()
+        return self.params.get((gizmo, parameter), 0)
+
+    def createSubject(self, name, desc='', icon='mouse'):
+        self._rpc()
+        if name not in self.subjects:
+            self.subjects.append(name)
+
+    def getKnownSubjects(self):
+        self._rpc()
+        return list(self.subjects)
+
+    def getSystemStatus(self):
+        self._rpc()
+        return {'sysLoad': 0, 'uiLoad': 0, 'errorCount': 0}
+
+    def _setter(key):
+        def setter(self, value, *args):
+            self._rpc()
+            self.state[key] = value
+        return setter
+
+    def _getter(key):
+        def getter(self):
+            self._rpc()
+            return self.state[key]
+        return getter
+
+    setCurrentUser = _setter('user')
+    setCurrentExperiment = _setter('experiment')
+    setCurrentSubject = _setter('subject')
+    setCurrentBlock = _setter('block')
+    setCurrentTank = _setter('tank')
+    getCurrentUser = _getter('user')
+    getCurrentExperiment = _getter('experiment')
+    getCurrentSubject = _getter('subject')
+    getCurrentBlock = _getter('block')
+    getCurrentTank = _getter('tank')
+    del _setter, _getter
+
+
+# ----------------------------------------------------------------------
+# Registration
+# ----------------------------------------------------------------------
+def _module(name, **attrs):
+    mod = types.ModuleType(name)
+    mod.__dict__.update(attrs)
+    sys.modules[name] = mod
+    return mod
+
+
+def install(frame_period=1.0 / 60.0, response_delay=0.3, rpc_latency=0.0, seed=0):
+    """Register the fake modules and reset the shared virtual state."""
+    STATE.__init__(frame_period=frame_period, response_delay=response_delay,
+                   rpc_latency=rpc_latency, seed=seed)
+
+    core = _module('psychopy.core', Clock=Clock, wait=_core_wait, quit=_core_quit,
+                   getTime=lambda: STATE.now)
+    visual = _module('psychopy.visual', Window=Window, TextStim=_Stim, Line=_Stim,
+                     Circle=_Stim, Rect=_Stim)
+    event = _module('psychopy.event', getKeys=_event_get_keys, clearEvents=_clear_events)
+    gui = _module('psychopy.gui', DlgFromDict=DlgFromDict)
+    data = _module('psychopy.data', getDateStr=_get_date_str,
+                   importConditions=_import_conditions, ExperimentHandler=ExperimentHandler)
+    logging = _module('psychopy.logging', WARNING=30, INFO=20, DEBUG=10,
+                      console=types.SimpleNamespace(setLevel=lambda level: None),
+                      flush=lambda: None)
+    sound = _module('psychopy.sound', Sound=_UnavailableSound)
+    prefs = types.SimpleNamespace(hardware={}, general={}, piloting={})
+    keyboard = _module('psychopy.hardware.keyboard', Keyboard=Keyboard, KeyPress=KeyPress)
+    hardware = _module('psychopy.hardware', keyboard=keyboard)
+    _module('psychopy', core=core, visual=visual, event=event, gui=gui, data=data,
+            logging=logging, sound=sound, prefs=prefs, hardware=hardware,
+            __path__=[])
+
+    _module('sounddevice', play=_sd_play, wait=_sd_wait, stop=lambda: None,
+            OutputStream=OutputStream, CallbackStop=CallbackStop,
+            PortAudioError=PortAudioError,
+            query_devices=lambda *a, **k: [])
+    _module('tdt', SynapseAPI=SynapseAPI)
+    return STATE
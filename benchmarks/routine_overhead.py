@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Per-frame overhead of the routine engine against the Builder frame loop.
+
+Runs the tutorial's 'rest' routine (one text, one key response) both
+ways against the stand-in modules from headless_fakes: through
+tutorial/routine_engine.py, as tutorial_refac_win.py does, and through
+the frame loop Builder generates for it in tutorial_lastrun.py
+(transcribed below without the pause and Session branches, which never
+run here). Reports the Python time per frame spent outside win.flip().
+
+Builder draws its stimuli inside flip() (autoDraw), so the engine's
+numbers include the draw() calls and Builder's do not.
+
+Usage:
+    python benchmarks/routine_overhead.py
+    python benchmarks/routine_overhead.py --frames 600 --repeat 20
+"""
+
+import argparse
+import os
+import sys
+import time
+import types
+
+import headless_fakes
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TUTORIAL_DIR = os.path.join(ROOT, 'tutorial')
+
+NOT_STARTED, STARTED, FINISHED = 0, 1, -1
+
+
+def builder_rest(win, thisExp, rest_text, rest_key, defaultKeyboard, globalClock,
+                 routineTimer, frameTolerance=0.001):
+    """The 'rest' routine as generated in tutorial_lastrun.py.
+
+    Returns (overhead seconds, frames), like RoutineResult.
+    """
+    perf = time.perf_counter
+    overhead = 0.0
+    n_frames = 0
+    endExpNow = False
+
+    # --- Prepare to start Routine "rest" ---
+    rest = types.SimpleNamespace(name='rest', components=[rest_text, rest_key])
+    rest.status = NOT_STARTED
+    continueRoutine = True
+    rest_key.keys = []
+    rest_key.rt = []
+    _rest_key_allKeys = []
+    rest.tStartRefresh = win.getFutureFlipTime(clock=globalClock)
+    rest.tStart = globalClock.getTime(format='float')
+    rest.status = STARTED
+    thisExp.addData('rest.started', rest.tStart)
+    rest.maxDuration = None
+    for thisComponent in rest.components:
+        thisComponent.tStart = None
+        thisComponent.tStop = None
+        thisComponent.tStartRefresh = None
+        thisComponent.tStopRefresh = None
+        if hasattr(thisComponent, 'status'):
+            thisComponent.status = NOT_STARTED
+    t = 0
+    frameN = -1
+
+    # --- Run Routine "rest" ---
+    while continueRoutine:
+        frame_t0 = perf()
+        t = routineTimer.getTime()
+        tThisFlip = win.getFutureFlipTime(clock=routineTimer)
+        tThisFlipGlobal = win.getFutureFlipTime(clock=None)
+        frameN = frameN + 1
+
+        if rest_text.status == NOT_STARTED and tThisFlip >= 0.0-frameTolerance:
+            rest_text.frameNStart = frameN
+            rest_text.tStart = t
+            rest_text.tStartRefresh = tThisFlipGlobal
+            win.timeOnFlip(rest_text, 'tStartRefresh')
+            thisExp.timestampOnFlip(win, 'rest_text.started')
+            rest_text.status = STARTED
+            rest_text.setAutoDraw(True)
+        if rest_text.status == STARTED:
+            pass
+
+        waitOnFlip = False
+        if rest_key.status == NOT_STARTED and tThisFlip >= 0.0-frameTolerance:
+            rest_key.frameNStart = frameN
+            rest_key.tStart = t
+            rest_key.tStartRefresh = tThisFlipGlobal
+            win.timeOnFlip(rest_key, 'tStartRefresh')
+            thisExp.timestampOnFlip(win, 'rest_key.started')
+            rest_key.status = STARTED
+            waitOnFlip = True
+            win.callOnFlip(rest_key.clock.reset)
+            win.callOnFlip(rest_key.clearEvents, eventType='keyboard')
+        if rest_key.status == STARTED and not waitOnFlip:
+            theseKeys = rest_key.getKeys(keyList=['0'], ignoreKeys=["escape"], waitRelease=False)
+            _rest_key_allKeys.extend(theseKeys)
+            if len(_rest_key_allKeys):
+                rest_key.keys = _rest_key_allKeys[-1].name
+                rest_key.rt = _rest_key_allKeys[-1].rt
+                rest_key.duration = _rest_key_allKeys[-1].duration
+                continueRoutine = False
+
+        if defaultKeyboard.getKeys(keyList=["escape"]):
+            thisExp.status = FINISHED
+        if getattr(thisExp, 'status', None) == FINISHED or endExpNow:
+            break
+
+        if not continueRoutine:
+            rest.forceEnded = True
+            break
+        continueRoutine = False
+        for thisComponent in rest.components:
+            if hasattr(thisComponent, "status") and thisComponent.status != FINISHED:
+                continueRoutine = True
+                break
+
+        if continueRoutine:
+            overhead += perf() - frame_t0
+            win.flip()
+            n_frames += 1
+    return overhead, n_frames
+
+
+def run(frames=300, repeat=10):
+    """Mean frame overhead (µs) of both loops over `repeat` routines each."""
+    state = headless_fakes.install()
+    if TUTORIAL_DIR not in sys.path:
+        sys.path.insert(0, TUTORIAL_DIR)
+    from psychopy import core, data, visual
+    from psychopy.hardware import keyboard
+    from routine_engine import Component, Routine, RoutineEngine
+
+    # The key arrives after `frames` flips
+    state.response_delay = frames * state.frame_period
+    win = visual.Window()
+    this_exp = data.ExperimentHandler(dataFileName=os.devnull)
+    kb = keyboard.Keyboard()
+    text = visual.TextStim(win, text="Rest.\nPress '0' to continue.")
+
+    engine = RoutineEngine(win, kb)
+    routine = Routine('rest', [Component('rest_text', stim=text),
+                               Component('rest_key', keys=['0'])])
+    totals = {'builder': [0.0, 0], 'engine': [0.0, 0]}
+    for _ in range(repeat):
+        overhead, n = builder_rest(
+            win, this_exp, visual.TextStim(win, text=text.text), keyboard.Keyboard(),
+            keyboard.Keyboard(), core.Clock(), core.Clock())
+        totals['builder'][0] += overhead
+        totals['builder'][1] += n
+        result = engine.run(routine)
+        totals['engine'][0] += result.overhead
+        totals['engine'][1] += result.n_frames
+
+    return {name: {'frames': n, 'mean_us': 1e6 * overhead / max(n, 1)}
+            for name, (overhead, n) in totals.items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--frames', type=int, default=300, help='frames per routine')
+    parser.add_argument('--repeat', type=int, default=10, help='routines per loop')
+    args = parser.parse_args(argv)
+
+    results = run(args.frames, args.repeat)
+    print(f"{'loop':<10}{'frames':>8}{'mean µs':>10}")
+    for name, r in results.items():
+        print(f"{name:<10}{r['frames']:>8}{r['mean_us']:>10.2f}")
+    ratio = results['builder']['mean_us'] / max(results['engine']['mean_us'], 1e-9)
+    print(f"\nBuilder loop / engine: {ratio:.1f}x per-frame overhead")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Sample-accurate trigger scheduling tied to the audio output callback.
+
+Triggers are registered against a sample index of the buffer that is about
+to be played. The sounddevice output callback reports the DAC time of each
+block, so the exact time at which a scheduled sample reaches the converter
+is known in advance. A high-priority helper thread waits on the stream clock
+and fires the trigger at that moment, which keeps the EEG marker aligned to
+the sound instead of to the wall-clock time of a Python call.
+
+The output stream stays open for the whole session, so starting a stimulus
+only swaps the buffer the callback reads from. `ScheduledSound` wraps the
+scheduler in the interface of a Builder sound component, for scripts
+generated by PsychoPy Builder.
+
+Every fired trigger records its offset (fire time - DAC time) so the bound
+on marker misalignment can be reported after each block. Sends are made
+inside trigger_log.trigger_context, so the trigger log records the DAC
+time as the requested time of each scheduled code.
+"""
+
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+import soundfile as sf
+
+from critical_section import unpin_thread
+from session_log import get_logger
+from trigger_log import trigger_context
+
+try:
+    import sounddevice as sd
+except Exception:
+    sd = None
+
+
+# Below this remaining time the helper spins instead of sleeping
+SPIN_THRESHOLD = 0.002
+# How far past a trigger's DAC time (on perf_counter) the helper keeps
+# waiting for the stream clock before it treats the clock as stalled
+STALL_TIMEOUT = 0.05
+
+log = get_logger('audio_triggers')
+
+
+def raise_thread_priority():
+    """Raise the priority of the calling thread where the OS allows it.
+
+    On Linux this is the lowest real-time priority: enough to preempt the
+    frame loop, but below PortAudio's callback thread.
+    """
+    try:
+        if os.name == 'nt':
+            import ctypes
+            THREAD_PRIORITY_TIME_CRITICAL = 15
+            kernel32 = ctypes.windll.kernel32
+            kernel32.SetThreadPriority(kernel32.GetCurrentThread(), THREAD_PRIORITY_TIME_CRITICAL)
+        elif hasattr(os, 'sched_setscheduler'):
+            # On Linux pid 0 refers to the calling thread
+            os.sched_setscheduler(0, os.SCHED_FIFO,
+                                  os.sched_param(os.sched_get_priority_min(os.SCHED_FIFO)))
+        return True
+    except Exception:
+        return False
+
+
+class _Playback:
+    """One play() call: its audio, read position and pending triggers."""
+
+    __slots__ = ('generation', 'audio', 'pos', 'pending', 'done')
+
+    def __init__(self, generation, audio, pending):
+        self.generation = generation
+        self.audio = audio
+        self.pos = 0
+        self.pending = pending
+        self.done = False
+
+
+class SampleTriggerScheduler:
+    """Plays audio and fires triggers when scheduled samples reach the DAC.
+
+    One output stream is opened up front and kept running (silent between
+    stimuli), so play() only hands the next buffer to the callback and an
+    onset costs no stream setup. Each play() starts a new generation;
+    every trigger and end-of-playback event carries the generation it
+    belongs to, and the helper drops events of earlier generations, so a
+    stopped or replaced playback can neither fire late triggers nor mark
+    the next one finished.
+
+    Args:
+        send_trigger: Callable taking a trigger code. It is called from the
+            helper thread, so it must not touch the PsychoPy window.
+        samplerate: Output sample rate in Hz (play() reopens the stream
+            only when a stimulus needs another rate).
+        channels: Number of output channels.
+        blocksize: Frames per audio callback (0 lets PortAudio choose).
+        latency: Requested output latency passed to sounddevice.
+    """
+
+    def __init__(self, send_trigger, samplerate=44100, channels=2, blocksize=256, latency='low'):
+        if sd is None:
+            raise RuntimeError("sounddevice is not available")
+        self.send_trigger = send_trigger
+        self.samplerate = samplerate
+        self.channels = channels
+        self.blocksize = blocksize
+        self.latency = latency
+
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._playback = None
+        self._stream = None
+        self._events = queue.SimpleQueue()
+        # Written by the audio callback and the helper respectively
+        self._published = 0
+        self._handled = 0
+        self._finished = threading.Event()
+        self._finished.set()
+
+        # (code, sample_index, dac_time, fired_time, ack_time)
+        self.fired = []
+        self.late_count = 0
+        self.dropped_count = 0
+
+        self._open(samplerate)
+        self._helper = threading.Thread(target=self._helper_loop, name='trigger-helper', daemon=True)
+        self._helper.start()
+
+    # ------------------------------------------------------------------
+    # Stream
+    # ------------------------------------------------------------------
+    def _open(self, samplerate):
+        """(Re)open the output stream at `samplerate`."""
+        self._close_stream()
+
+        def callback(outdata, frames, time_info, status):
+            self._callback(stream, outdata, frames, time_info, status)
+
+        stream = sd.OutputStream(
+            samplerate=samplerate,
+            channels=self.channels,
+            dtype='float32',
+            blocksize=self.blocksize,
+            latency=self.latency,
+            callback=callback,
+        )
+        stream.start()
+        self._stream = stream
+        self.samplerate = samplerate
+
+    def _close_stream(self):
+        if self._stream is not None:
+            self._stream.abort()
+            self._stream.close()
+            self._stream = None
+
+    # ------------------------------------------------------------------
+    # Playback
+    # ------------------------------------------------------------------
+    def play(self, audio, triggers=(), samplerate=None):
+        """Start playback of `audio` with triggers at given sample indices.
+
+        Args:
+            audio: Array of shape (samples,) or (samples, channels), or a
+                streaming source with len() and read_into(outdata) such
+                as streaming_playback.StereoStream.
+            triggers: Iterable of (sample_index, code). An index equal to
+                len(audio) fires when the last sample has been played.
+            samplerate: Sample rate of `audio`; None keeps the stream's.
+        """
+        self.stop()
+
+        if self._stream is None or (samplerate is not None and samplerate != self.samplerate):
+            self._open(samplerate or self.samplerate)
+
+        if hasattr(audio, 'read_into'):
+            audio = audio.start()
+        else:
+            audio = np.asarray(audio, dtype=np.float32)
+            if audio.ndim == 1:
+                audio = np.repeat(audio[:, None], self.channels, axis=1)
+            audio = np.ascontiguousarray(audio)
+        pending = sorted((int(idx), code) for idx, code in triggers)
+
+        with self._lock:
+            self._generation += 1
+            self._finished.clear()
+            self._playback = _Playback(self._generation, audio, pending)
+
+    def _publish(self, event):
+        self._published += 1
+        self._events.put(event)
+
+    def _callback(self, stream, outdata, frames, time_info, status):
+        """Copy the next block and publish DAC times of due triggers."""
+        # The lock keeps stop() from closing a source this block still reads
+        with self._lock:
+            playback = self._playback
+            if playback is None or playback.done:
+                outdata.fill(0)
+                return
+
+            audio = playback.audio
+            pos = playback.pos
+            if isinstance(audio, np.ndarray):
+                n = max(0, min(frames, len(audio) - pos))
+                outdata[:n] = audio[pos:pos + n]
+                outdata[n:] = 0
+            else:
+                audio.read_into(outdata)
+
+            dac_time = time_info.outputBufferDacTime
+            if not dac_time:
+                # Some host APIs do not report DAC time; estimate it
+                dac_time = time_info.currentTime + stream.latency
+
+            generation = playback.generation
+            samplerate = stream.samplerate
+            pending = playback.pending
+            while pending and pending[0][0] < pos + frames:
+                idx, code = pending.pop(0)
+                self._publish((generation, stream, code, idx,
+                               dac_time + (max(idx, pos) - pos) / samplerate))
+
+            playback.pos = pos + frames
+            if playback.pos >= len(audio) and not pending:
+                playback.done = True
+                self._publish((generation, stream, None, None, None))
+
+    def _helper_loop(self):
+        """Fire queued triggers when the stream clock reaches their DAC time."""
+        unpin_thread()
+        raise_thread_priority()
+        while True:
+            event = self._events.get()
+            if event is None:
+                return
+            try:
+                self._dispatch(*event)
+            except Exception as e:
+                log.warning("⚠ Trigger helper: %s", e)
+            finally:
+                self._handled += 1
+
+    def _dispatch(self, generation, stream, code, idx, dac_time):
+        if generation != self._generation:
+            # Left over from a playback that was stopped or replaced
+            if code is not None:
+                self.dropped_count += 1
+            return
+        if code is None:
+            self._finished.set()
+            return
+
+        try:
+            fired_time = self._wait_for(stream, dac_time, generation)
+        except sd.PortAudioError:
+            # The stream was reopened at another rate under this trigger
+            fired_time = None
+        if fired_time is None or generation != self._generation:
+            self.dropped_count += 1
+            return
+        # DAC time on the perf_counter clock, for the trigger log
+        requested_t = time.perf_counter() - (fired_time - dac_time)
+        try:
+            with trigger_context(requested_t, audio_t=dac_time, source='scheduled'):
+                self.send_trigger(code)
+        except Exception as e:
+            log.warning("⚠ Scheduled trigger %s failed: %s", code, e)
+        self.fired.append((code, idx, dac_time, fired_time, stream.time))
+
+    def _wait_for(self, stream, dac_time, generation):
+        """Wait until the stream clock reaches `dac_time`; return the clock then.
+
+        Returns None if the playback is stopped meanwhile, or if the clock
+        has not got there STALL_TIMEOUT after it should have. The last
+        SPIN_THRESHOLD is spun with sleep(0), so the wait never holds the
+        CPU for longer than that.
+        """
+        now = stream.time
+        if now > dac_time:
+            self.late_count += 1
+            return now
+        deadline = time.perf_counter() + (dac_time - now) + STALL_TIMEOUT
+        while True:
+            remaining = dac_time - stream.time
+            if remaining <= 0:
+                return stream.time
+            if generation != self._generation:
+                return None
+            if time.perf_counter() > deadline:
+                log.warning("⚠ Stream clock stalled %.1f ms before a trigger's DAC time; "
+                            "trigger dropped", remaining * 1000.0)
+                return None
+            time.sleep(remaining - SPIN_THRESHOLD if remaining > SPIN_THRESHOLD else 0)
+
+    def pending(self):
+        """Triggers and end-of-playback events the helper has not handled yet."""
+        return self._published - self._handled
+
+    def is_finished(self):
+        """Return True once playback ended and all triggers have fired."""
+        return self._finished.is_set()
+
+    def wait(self, timeout=None):
+        """Block until playback and trigger dispatch have finished."""
+        return self._finished.wait(timeout)
+
+    def stop(self):
+        """Stop playback (the stream keeps running); pending triggers are dropped."""
+        with self._lock:
+            self._generation += 1
+            playback, self._playback = self._playback, None
+        if playback is not None and not isinstance(playback.audio, np.ndarray):
+            playback.audio.close()
+        self._finished.set()
+
+    def close(self):
+        """Stop playback, close the stream and end the helper thread."""
+        self.stop()
+        self._close_stream()
+        if self._helper.is_alive():
+            self._events.put(None)
+            self._helper.join(timeout=1.0)
+
+    # ------------------------------------------------------------------
+    # Reporting
+    # ------------------------------------------------------------------
+    def offset_report(self):
+        """Summarise trigger offsets (fire time - DAC time) in milliseconds."""
+        if not self.fired:
+            return {'count': 0}
+        rows = np.array([(f[3] - f[2], f[4] - f[2]) for f in self.fired]) * 1000.0
+        offsets, acks = rows[:, 0], rows[:, 1]
+        return {
+            'count': len(self.fired),
+            'late': self.late_count,
+            'dropped': self.dropped_count,
+            'mean_offset_ms': float(np.mean(offsets)),
+            'max_abs_offset_ms': float(np.max(np.abs(offsets))),
+            'p95_abs_offset_ms': float(np.percentile(np.abs(offsets), 95)),
+            'mean_ack_ms': float(np.mean(acks)),
+            'max_ack_ms': float(np.max(acks)),
+        }
+
+    def print_report(self, label='Scheduled triggers'):
+        report = self.offset_report()
+        if not report['count']:
+            return report
+        dropped = f", {report['dropped']} dropped" if report['dropped'] else ""
+        log.info(f"✓ {label}: {report['count']} fired, {report['late']} late{dropped} | "
+                 f"offset mean {report['mean_offset_ms']:.3f} ms, "
+                 f"max |{report['max_abs_offset_ms']:.3f}| ms, "
+                 f"ack max {report['max_ack_ms']:.2f} ms")
+        return report
+
+
+class ScheduledSound:
+    """Builder sound component played through a SampleTriggerScheduler.
+
+    Builder frame loops call play(when=win), check isFinished and call
+    stop(); this class keeps that interface but starts the stimulus on
+    the scheduler's stream, with `trigger` (if set) fired when sample 0
+    reaches the DAC. The trigger is cleared after each play().
+
+    Args:
+        scheduler: SampleTriggerScheduler to play on.
+        name: Component name.
+        ramp_ms: Onset/offset ramp applied by setSound(hamming=True).
+    """
+
+    def __init__(self, scheduler, name='sound', ramp_ms=10.0):
+        self.scheduler = scheduler
+        self.name = name
+        self.ramp_ms = ramp_ms
+        self.trigger = None
+        self.status = None
+        self.volume = 1.0
+        self._audio = None
+        self._samplerate = None
+        self._started = False
+        self._queued = False
+
+    def setSound(self, value, secs=-1, hamming=True, log=True):
+        audio, sr = sf.read(value, dtype='float32')
+        if hamming and self.ramp_ms:
+            from stimulus_bank import cosine_ramp
+            n = min(int(round(self.ramp_ms * sr / 1000.0)), len(audio) // 2)
+            ramp = cosine_ramp(n)
+            if audio.ndim > 1:
+                ramp = ramp[:, None]
+            audio[:n] *= ramp
+            audio[len(audio) - n:] *= ramp[::-1]
+        self._audio = audio
+        self._samplerate = sr
+
+    def setVolume(self, newVol, log=True):
+        self.volume = newVol
+
+    def seek(self, t):
+        pass
+
+    def getDuration(self):
+        return len(self._audio) / float(self._samplerate) if self._audio is not None else 0.0
+
+    def _start(self):
+        if not self._queued:
+            return  # stopped before the flip
+        self._queued = False
+        audio = self._audio if self.volume == 1.0 else self._audio * np.float32(self.volume)
+        triggers = [(0, self.trigger)] if self.trigger is not None else []
+        self.scheduler.play(audio, triggers=triggers, samplerate=self._samplerate)
+        self.trigger = None
+
+    def play(self, when=None, log=True):
+        """Start now, or on the next flip of `when` (a window)."""
+        self._started = self._queued = True
+        if when is not None and hasattr(when, 'callOnFlip'):
+            when.callOnFlip(self._start)
+        else:
+            self._start()
+
+    @property
+    def isFinished(self):
+        return self._started and not self._queued and self.scheduler.is_finished()
+
+    def stop(self, log=True):
+        self._queued = False
+        if self._started and not self.scheduler.is_finished():
+            self.scheduler.stop()
+        self._started = False
+
+    pause = stop
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Batch cohort report: figures for every recorded session.
+
+Collects the sentence sessions in data/ ({subject}_session{n}_{time}.csv)
+and the tutorial sessions in tutorial/data/; only primary data files
+count, not their backups or exports (patterns from session_export.py).
+It renders one figure per session, per subject and per stimulus in
+parallel worker processes (Agg backend, see result_plots.py).
+
+Builds are incremental. Every figure is keyed by a hash of exactly the
+rows or files it is drawn from, so a rerun only renders figures whose
+inputs changed or whose PNG is missing. Adding one session re-renders
+that session, its subject and the stimuli it played. The outputs are
+listed in index.json (the manifest for the next run) and index.html.
+
+Usage:
+    python experiments/cohort_report.py
+    python experiments/cohort_report.py --out data/report --workers 8
+    python experiments/cohort_report.py --force
+"""
+
+import argparse
+import hashlib
+import html
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from session_export import SESSION_RE, TUTORIAL_RE
+
+# Bump when figure layouts change so every figure is rebuilt once
+RENDER_VERSION = 1
+INDEX_JSON = 'index.json'
+INDEX_HTML = 'index.html'
+
+
+def _sha1(*parts):
+    h = hashlib.sha1(str(RENDER_VERSION).encode())
+    for part in parts:
+        h.update(part if isinstance(part, bytes) else str(part).encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def _safe(name):
+    return re.sub(r'[^\w.-]+', '_', str(name))
+
+
+def file_hash(path):
+    with open(path, 'rb') as f:
+        return _sha1(f.read())
+
+
+def find_sessions(data_dir, tutorial_dir):
+    """Return session dicts (kind, path, subject, label, hash) sorted by path."""
+    sessions = []
+    if os.path.isdir(data_dir):
+        for name in sorted(os.listdir(data_dir)):
+            m = SESSION_RE.match(name)
+            if m:
+                sessions.append({'kind': 'sentence', 'path': os.path.join(data_dir, name),
+                                 'subject': m['subject'], 'label': f"s{m['session']} {m['time']}"})
+    if os.path.isdir(tutorial_dir):
+        for name in sorted(os.listdir(tutorial_dir)):
+            if TUTORIAL_RE.match(name):
+                sessions.append({'kind': 'tutorial', 'path': os.path.join(tutorial_dir, name),
+                                 'subject': None, 'label': os.path.splitext(name)[0]})
+    for s in sessions:
+        s['hash'] = file_hash(s['path'])
+    return sessions
+
+
+def read_session(session):
+    """Load one session CSV (tutorial files carry a UTF-8 BOM)."""
+    df = pd.read_csv(session['path'], encoding='utf-8-sig')
+    if session['kind'] == 'tutorial':
+        df = df.loc[:, [c for c in df.columns if not c.startswith('Unnamed')]]
+        if session['subject'] is None and 'participant' in df and df['participant'].notna().any():
+            session['subject'] = str(df['participant'].dropna().iloc[0])
+    return df
+
+
+# ----------------------------------------------------------------------
+# Worker tasks (module level so they pickle)
+# ----------------------------------------------------------------------
+def render_session(session, path):
+    from result_plots import plot_session, plot_tutorial_session
+    df = read_session(session)
+    if session['kind'] == 'sentence':
+        plot_session(df, path)
+    else:
+        plot_tutorial_session(session['label'], df, path)
+    return path
+
+
+def render_subject(subject, sessions, path):
+    from result_plots import plot_subject
+    frames = []
+    for s in sessions:
+        df = read_session(s)
+        if s['kind'] == 'tutorial':
+            df = df[df['main_trigger'].notna()] if 'main_trigger' in df else df.iloc[:0]
+            df = df.assign(is_correct=pd.to_numeric(df.get('correct'), errors='coerce'))
+        frames.append((s['label'], df))
+    plot_subject(subject, frames, path)
+    return path
+
+
+def render_stimulus(stimulus, df, path):
+    from result_plots import plot_stimulus
+    plot_stimulus(stimulus, df, path)
+    return path
+
+
+# ----------------------------------------------------------------------
+# Planning
+# ----------------------------------------------------------------------
+def plan(sessions, out_dir, previous, force=False):
+    """Return (jobs, entries, sentence_digest) for the stale figures.
+
+    `previous` is load_previous()'s (figures, sentence_digest) pair.
+    """
+    previous, previous_digest = previous
+    jobs, entries = [], []
+
+    def add(kind, key, digest, filename, task, *args):
+        path = os.path.join(out_dir, filename)
+        entry = {'kind': kind, 'key': key, 'hash': digest, 'file': filename}
+        entries.append(entry)
+        old = previous.get(filename)
+        if force or old is None or old.get('hash') != digest or not os.path.exists(path):
+            jobs.append((entry, task, args + (path,)))
+
+    # Per session
+    for s in sessions:
+        prefix = 'session' if s['kind'] == 'sentence' else 'tutorial'
+        stem = os.path.splitext(os.path.basename(s['path']))[0]
+        add(s['kind'], stem, s['hash'], f"{prefix}_{_safe(stem)}.png", render_session, s)
+
+    # Per subject: tutorial subjects live in the CSV, so read those (small)
+    for s in sessions:
+        if s['subject'] is None:
+            read_session(s)
+    by_subject = {}
+    for s in sessions:
+        if s['subject'] is not None:
+            by_subject.setdefault(s['subject'], []).append(s)
+    for subject, group in sorted(by_subject.items()):
+        group = sorted(group, key=lambda s: (s['kind'], s['label']))
+        digest = _sha1(*[s['hash'] for s in group])
+        add('subject', subject, digest, f"subject_{_safe(subject)}.png", render_subject, subject, group)
+
+    # Per stimulus: hash only the rows that mention the stimulus
+    sentence = [s for s in sessions if s['kind'] == 'sentence']
+    sentence_digest = _sha1(*[s['hash'] for s in sentence])
+    reusable = [e for e in previous.values() if e['kind'] == 'stimulus']
+    if (not force and sentence_digest == previous_digest and reusable
+            and all(e['hash'] and os.path.exists(os.path.join(out_dir, e['file'])) for e in reusable)):
+        # No sentence session changed: skip reading the cohort
+        entries.extend(sorted(reusable, key=lambda e: e['file']))
+    elif sentence:
+        frames = []
+        for s in sentence:
+            df = read_session(s)
+            frames.append(df.assign(subject=s['subject']))
+        cohort = pd.concat(frames, ignore_index=True)
+        for stimulus, rows in cohort.groupby('right_file', sort=True):
+            rows = rows[['subject', 'is_correct', 'latency_sec']].reset_index(drop=True)
+            digest = _sha1(rows.to_csv(index=False))
+            add('stimulus', stimulus, digest, f"stimulus_{_safe(os.path.splitext(stimulus)[0])}.png",
+                render_stimulus, stimulus, rows)
+    return jobs, entries, sentence_digest
+
+
+def write_index(out_dir, entries, sentence_digest=None):
+    with open(os.path.join(out_dir, INDEX_JSON), 'w', encoding='utf-8') as f:
+        json.dump({'version': RENDER_VERSION, 'sentence_digest': sentence_digest, 'figures': entries},
+                  f, ensure_ascii=False, indent=1)
+    sections = []
+    for kind, title in [('subject', 'Subjects'), ('stimulus', 'Stimuli'),
+                        ('sentence', 'Sentence sessions'), ('tutorial', 'Tutorial sessions')]:
+        items = [e for e in entries if e['kind'] == kind]
+        if not items:
+            continue
+        figures = '\n'.join(
+            f'<figure><a href="{html.escape(e["file"])}"><img src="{html.escape(e["file"])}" width="480"></a>'
+            f'<figcaption>{html.escape(str(e["key"]))}</figcaption></figure>'
+            for e in items
+        )
+        sections.append(f'<h2>{title} ({len(items)})</h2>\n{figures}')
+    with open(os.path.join(out_dir, INDEX_HTML), 'w', encoding='utf-8') as f:
+        f.write('<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>Cohort report</title>'
+                '<style>figure{display:inline-block;margin:8px}</style></head><body>\n'
+                '<h1>Cohort report</h1>\n' + '\n'.join(sections) + '\n</body></html>\n')
+
+
+def load_previous(out_dir):
+    """Return ({file: entry}, sentence_digest) from the last run's index."""
+    try:
+        with open(os.path.join(out_dir, INDEX_JSON), encoding='utf-8') as f:
+            index = json.load(f)
+        if index.get('version') != RENDER_VERSION:
+            return {}, None
+        return {e['file']: e for e in index.get('figures', [])}, index.get('sentence_digest')
+    except Exception:
+        return {}, None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--data-dir', default='data')
+    parser.add_argument('--tutorial-dir', default=os.path.join('tutorial', 'data'))
+    parser.add_argument('--out', help='report folder (default: <data-dir>/report)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--force', action='store_true', help='render every figure again')
+    args = parser.parse_args(argv)
+
+    out_dir = args.out or os.path.join(args.data_dir, 'report')
+    os.makedirs(out_dir, exist_ok=True)
+
+    t_start = time.perf_counter()
+    sessions = find_sessions(args.data_dir, args.tutorial_dir)
+    if not sessions:
+        print(f"✗ No sessions in {args.data_dir} or {args.tutorial_dir}")
+        return 1
+    jobs, entries, sentence_digest = plan(sessions, out_dir, load_previous(out_dir), args.force)
+    t_planned = time.perf_counter()
+    print(f"Cohort report: {len(sessions)} sessions, {len(entries)} figures, "
+          f"{len(jobs)} to render ({len(entries) - len(jobs)} up to date)")
+
+    failed = 0
+    if jobs:
+        workers = max(1, min(args.workers, len(jobs)))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(task, *task_args): entry for entry, task, task_args in jobs}
+            for i, future in enumerate(as_completed(futures), 1):
+                entry = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    failed += 1
+                    entry['hash'] = None  # retry next run
+                    print(f"✗ {entry['file']}: {e}")
+                else:
+                    print(f"  [{i}/{len(jobs)}] {entry['file']}")
+    write_index(out_dir, entries, None if failed else sentence_digest)
+    t_done = time.perf_counter()
+
+    print(f"✓ Report index: {os.path.join(out_dir, INDEX_HTML)}")
+    print(f"  Planning {t_planned - t_start:.2f} s, rendering {t_done - t_planned:.2f} s"
+          + (f", {failed} failed" if failed else ""))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Timing-critical sections: GC control, process priority and CPU affinity.
+
+Garbage collections start whenever enough objects have been allocated,
+so a stimulus load, a new TextStim or a pandas append can make one land
+in the middle of playback, a trigger send or a response window. Inside
+`critical()` the cyclic collector is disabled; `CRITICAL.idle()` collects
+at the places where a pause costs nothing (ITIs, rest and instruction
+screens). With gc_mode='freeze' every idle collection is followed by
+gc.freeze(), so the long-lived heap (stimulus bank, PsychoPy objects)
+is never scanned again and collections outside the sections stay short.
+gc_mode='off' changes nothing and only measures, which gives the
+"before" numbers to compare against.
+
+`CRITICAL.start()` also raises the process priority where the OS allows
+it and can pin the main thread to one core. On Linux threads inherit
+the affinity of the thread that starts them, so worker threads that
+should not share that core (the trigger helper, the stream producer)
+call `unpin_thread()` first.
+
+Every collection is timed through gc.callbacks and counted as
+'critical' (inside a section), 'idle' (requested by idle()) or 'other';
+each one is also a 'gc' span in the session trace. close() restores GC,
+priority and affinity and prints the counts.
+
+Example:
+    from critical_section import CRITICAL, critical
+
+    CRITICAL.start(gc_mode='disable', cpu=2)
+    for trial in trials:
+        CRITICAL.idle()                 # rest screen
+        with critical('playback'):
+            play()
+        with critical('response'):
+            collect_response()
+    CRITICAL.close()
+"""
+
+import gc
+import os
+import time
+
+from session_log import get_logger
+from session_trace import TRACE, span
+
+GC_MODES = ('disable', 'freeze', 'off')
+KINDS = ('critical', 'idle', 'other')
+
+log = get_logger('critical_section')
+
+
+# ----------------------------------------------------------------------
+# Priority and affinity
+# ----------------------------------------------------------------------
+def raise_process_priority():
+    """Raise the process priority where the OS allows it.
+
+    Returns:
+        The previous priority (to pass to restore_process_priority), or
+        None if it could not be changed.
+    """
+    try:
+        if os.name == 'nt':
+            import ctypes
+            HIGH_PRIORITY_CLASS = 0x80
+            kernel32 = ctypes.windll.kernel32
+            process = kernel32.GetCurrentProcess()
+            previous = kernel32.GetPriorityClass(process)
+            if not kernel32.SetPriorityClass(process, HIGH_PRIORITY_CLASS):
+                return None
+            return previous
+        previous = os.getpriority(os.PRIO_PROCESS, 0)
+        # Lowering the nice value needs CAP_SYS_NICE (or root) on Linux
+        os.setpriority(os.PRIO_PROCESS, 0, max(-10, previous - 10))
+        return previous
+    except Exception:
+        return None
+
+
+def restore_process_priority(previous):
+    """Undo raise_process_priority()."""
+    if previous is None:
+        return
+    try:
+        if os.name == 'nt':
+            import ctypes
+            kernel32 = ctypes.windll.kernel32
+            kernel32.SetPriorityClass(kernel32.GetCurrentProcess(), previous)
+        else:
+            os.setpriority(os.PRIO_PROCESS, 0, previous)
+    except Exception:
+        pass
+
+
+def _kernel32():
+    import ctypes
+    kernel32 = ctypes.windll.kernel32
+    kernel32.GetCurrentThread.restype = ctypes.c_void_p
+    kernel32.SetThreadAffinityMask.restype = ctypes.c_size_t
+    kernel32.SetThreadAffinityMask.argtypes = (ctypes.c_void_p, ctypes.c_size_t)
+    return kernel32
+
+
+def pin_thread(cpu):
+    """Pin the calling thread to core `cpu`.
+
+    Returns:
+        The previous affinity (a set of cores on Linux, a mask on
+        Windows), or None where thread affinity is not available.
+    """
+    try:
+        if os.name == 'nt':
+            kernel32 = _kernel32()
+            previous = kernel32.SetThreadAffinityMask(kernel32.GetCurrentThread(), 1 << cpu)
+            return previous or None
+        if hasattr(os, 'sched_setaffinity'):
+            # On Linux pid 0 refers to the calling thread
+            previous = os.sched_getaffinity(0)
+            os.sched_setaffinity(0, {cpu})
+            return previous
+    except Exception:
+        pass
+    return None
+
+
+def restore_thread_affinity(previous):
+    """Undo pin_thread() on the calling thread."""
+    if previous is None:
+        return
+    try:
+        if os.name == 'nt':
+            kernel32 = _kernel32()
+            kernel32.SetThreadAffinityMask(kernel32.GetCurrentThread(), previous)
+        else:
+            os.sched_setaffinity(0, previous)
+    except Exception:
+        pass
+
+
+def unpin_thread():
+    """Move the calling thread off the core the main thread is pinned to.
+
+    Only Linux needs this (threads inherit their creator's affinity); it
+    does nothing when no core is pinned.
+    """
+    cpu, allowed = CRITICAL.cpu, CRITICAL._affinity
+    if cpu is None or not isinstance(allowed, set) or len(allowed) < 2:
+        return
+    try:
+        os.sched_setaffinity(0, allowed - {cpu})
+    except Exception:
+        pass
+
+
+# ----------------------------------------------------------------------
+# Critical sections
+# ----------------------------------------------------------------------
+class _Section:
+    """Context manager for one critical window (sections may nest)."""
+
+    __slots__ = ('owner', 'name', 'span')
+
+    def __init__(self, owner, name):
+        self.owner = owner
+        self.name = name
+
+    def __enter__(self):
+        self.span = span(self.name, cat='critical')
+        self.span.__enter__()
+        self.owner._enter(self.name)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.owner._exit()
+        self.span.__exit__(exc_type, exc, tb)
+        return False
+
+
+class CriticalSections:
+    """Keeps garbage collection out of timing-critical windows.
+
+    Sections are tracked process-wide: the collector is one per process,
+    so a collection started by any thread counts as 'critical' while the
+    main thread is inside a section.
+    """
+
+    def __init__(self):
+        self.gc_mode = 'off'
+        self.cpu = None
+        self.started = False
+        self.windows = 0
+        self.window_sec = 0.0
+        self.pauses = []          # (kind, section, generation, duration ms)
+        self._depth = 0
+        self._name = None
+        self._t_enter = 0.0
+        self._reenable = False
+        self._idle = False
+        self._gc_t0 = 0
+        self._gc_kind = None
+        self._gc_span = None
+        self._priority = None
+        self._affinity = None
+
+    def start(self, gc_mode='disable', priority=True, cpu=None):
+        """Apply the session's settings and start timing collections.
+
+        Args:
+            gc_mode: 'disable' (no GC inside sections), 'freeze' (also
+                gc.freeze() after each idle collection) or 'off' (measure
+                only).
+            priority: Raise the process priority.
+            cpu: Core to pin the calling (main) thread to; None leaves
+                the affinity alone.
+        """
+        if gc_mode not in GC_MODES:
+            raise ValueError(f"gc_mode must be one of {GC_MODES}, not {gc_mode!r}")
+        if self.started:
+            self.close()
+        self.gc_mode = gc_mode
+        self.windows = 0
+        self.window_sec = 0.0
+        self.pauses = []
+        gc.callbacks.append(self._on_gc)
+        self.started = True
+
+        notes = [f"GC {gc_mode}"]
+        if priority:
+            self._priority = raise_process_priority()
+            notes.append("high priority" if self._priority is not None else "priority unchanged")
+        if cpu is not None:
+            self._affinity = pin_thread(cpu)
+            if self._affinity is not None:
+                self.cpu = cpu
+                notes.append(f"main thread on core {cpu}")
+            else:
+                notes.append(f"core {cpu} not pinned")
+        # What was loaded so far lives for the whole session
+        self.idle()
+        log.info("✓ Critical sections: %s", ', '.join(notes))
+
+    def section(self, name='critical'):
+        """Return a context manager marking a timing-critical window."""
+        return _Section(self, name)
+
+    def _enter(self, name):
+        self._depth += 1
+        if self._depth > 1:
+            return
+        self._name = name
+        self._t_enter = time.perf_counter()
+        if self.gc_mode != 'off' and gc.isenabled():
+            gc.disable()
+            self._reenable = True
+
+    def _exit(self):
+        self._depth -= 1
+        if self._depth > 0:
+            return
+        self.windows += 1
+        self.window_sec += time.perf_counter() - self._t_enter
+        self._name = None
+        if self._reenable:
+            self._reenable = False
+            gc.enable()
+
+    def idle(self, generation=2):
+        """Collect now, where a pause does no harm (ITIs, rest screens).
+
+        Does nothing inside a section or in 'off' mode.
+        """
+        if self.gc_mode == 'off' or self._depth:
+            return
+        self._idle = True
+        try:
+            gc.collect(generation)
+            if self.gc_mode == 'freeze':
+                gc.freeze()
+        finally:
+            self._idle = False
+
+    def _on_gc(self, phase, info):
+        if phase == 'start':
+            self._gc_kind = 'idle' if self._idle else 'critical' if self._depth else 'other'
+            self._gc_span = span('gc', cat='gc', kind=self._gc_kind,
+                                 generation=info['generation'], section=self._name)
+            self._gc_span.__enter__()
+            self._gc_t0 = time.perf_counter_ns()
+            return
+        ms = (time.perf_counter_ns() - self._gc_t0) / 1e6
+        self.pauses.append((self._gc_kind, self._name, info['generation'], ms))
+        if self._gc_span is not None:
+            self._gc_span.__exit__(None, None, None)
+            self._gc_span = None
+
+    def summary(self):
+        """Count, total and max duration (ms) of the collections per kind."""
+        out = {'gc_mode': self.gc_mode, 'windows': self.windows,
+               'window_sec': self.window_sec}
+        for kind in KINDS:
+            ms = [p[3] for p in self.pauses if p[0] == kind]
+            out[kind] = {'count': len(ms), 'total_ms': sum(ms), 'max_ms': max(ms, default=0.0)}
+        return out
+
+    def print_summary(self):
+        s = self.summary()
+        log.info(f"GC pauses (mode {s['gc_mode']}): {s['windows']} critical windows, "
+                 f"{s['window_sec']:.1f} s")
+        for kind in KINDS:
+            k = s[kind]
+            mark = '⚠' if kind == 'critical' and k['count'] else ' '
+            log.info(f"  {mark} {kind:<9}{k['count']:>6} pauses, total {k['total_ms']:8.1f} ms, "
+                     f"max {k['max_ms']:6.2f} ms")
+        return s
+
+    def close(self):
+        """Restore GC, priority and affinity and print the pause counts."""
+        if not self.started:
+            return None
+        self.started = False
+        if self._on_gc in gc.callbacks:
+            gc.callbacks.remove(self._on_gc)
+        if self._reenable:
+            gc.enable()
+        self._depth = 0
+        self._reenable = False
+        if self.gc_mode == 'freeze':
+            gc.unfreeze()
+        restore_thread_affinity(self._affinity)
+        restore_process_priority(self._priority)
+        self._affinity = self._priority = None
+        self.cpu = None
+        summary = self.print_summary()
+        TRACE.instant('gc summary', cat='gc', **{
+            f"{kind}_{key}": value for kind in KINDS for key, value in summary[kind].items()})
+        return summary
+
+
+# One per process, like the collector it controls
+CRITICAL = CriticalSections()
+
+
+def critical(name='critical'):
+    """Mark a timing-critical window on the process-wide sections."""
+    return CRITICAL.section(name)
@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Chunked ERP epoching of recorded blocks.
+
+Turns a recording into per-code average ERPs without loading it whole.
+The EEG store is read in chunks of --chunk-sec seconds: from a TDT block
+through tdt.read_block time windows, or from an export folder (see
+`export_block`) whose eeg.npy is memory-mapped. For every chunk the
+epochs that start in it are cut with one fancy index, baseline-corrected
+and optionally rejected on peak-to-peak amplitude, then added to running
+per-code sums (`ErpAverage`). Memory is one chunk plus its epochs
+however long the recording is; chunks without events are not read.
+
+Several blocks are processed in parallel worker processes, and their
+averages are merged into a grand average weighted by epoch counts.
+
+Event onsets come from the block's epoc store (verify_triggers.
+load_recorded) or the export's events.csv. `make_synthetic_export`
+writes a fixture with known ERP waveforms for testing the pipeline
+without a rig.
+
+Usage:
+    python experiments/erp_epochs.py path/to/Block-1 path/to/Block-2 --store EEG1 --codes 8001-8010
+    python experiments/erp_epochs.py data/export/Block-1 --tmin -0.1 --tmax 0.6 --reject 100e-6
+    python experiments/erp_epochs.py --synthetic data/erp_fixture --duration 600
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from verify_triggers import load_recorded
+
+try:
+    import tdt
+except ImportError:
+    tdt = None
+
+META_FILE = 'meta.json'
+EEG_FILE = 'eeg.npy'
+EVENTS_FILE = 'events.csv'
+
+
+# ----------------------------------------------------------------------
+# Sources
+# ----------------------------------------------------------------------
+class ExportSource:
+    """Export folder: eeg.npy (channels x samples, memory-mapped), events.csv, meta.json."""
+
+    def __init__(self, folder):
+        with open(os.path.join(folder, META_FILE), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.folder = folder
+        self.name = os.path.basename(os.path.normpath(folder))
+        self.fs = float(self.meta['fs'])
+        self.path = os.path.join(folder, EEG_FILE)
+        self.n_channels, self.n_samples = np.load(self.path, mmap_mode='r').shape
+
+    def events(self):
+        codes, onsets, _ = load_recorded(os.path.join(self.folder, EVENTS_FILE))
+        return codes, onsets
+
+    def read(self, s0, s1):
+        # A map per chunk: pages of earlier chunks are released with it
+        # instead of staying resident for the whole recording
+        eeg = np.load(self.path, mmap_mode='r')
+        data = np.array(eeg[:, s0:s1])
+        del eeg
+        return data
+
+
+class BlockSource:
+    """TDT block read through tdt.read_block time windows.
+
+    Args:
+        block_path: Block folder.
+        store: EEG stream store name.
+        epoc_store: Epoc store with the trigger codes (default: see
+            verify_triggers.load_recorded).
+    """
+
+    def __init__(self, block_path, store, epoc_store=None):
+        if tdt is None:
+            raise ImportError("Reading TDT blocks needs the tdt package (pip install tdt)")
+        self.block_path = block_path
+        self.name = os.path.basename(os.path.normpath(block_path))
+        self.store = store
+        self.epoc_store = epoc_store
+        probe = tdt.read_block(block_path, store=store, t1=0, t2=1.0)
+        stream = probe.streams[store]
+        self.fs = float(stream.fs)
+        self.n_channels = 1 if np.ndim(stream.data) == 1 else len(stream.data)
+        self.n_samples = int(probe.info.duration.total_seconds() * self.fs)
+
+    def events(self):
+        codes, onsets, _ = load_recorded(self.block_path, self.epoc_store)
+        return codes, onsets
+
+    def read(self, s0, s1):
+        stream = tdt.read_block(self.block_path, store=self.store,
+                                t1=s0 / self.fs, t2=s1 / self.fs).streams[self.store]
+        data = np.atleast_2d(np.asarray(stream.data))
+        # The first sample returned can sit a little before t1
+        first = int(round(getattr(stream, 'start_time', s0 / self.fs) * self.fs))
+        data = data[:, max(0, s0 - first):]
+        if data.shape[1] < s1 - s0:
+            data = np.pad(data, ((0, 0), (0, s1 - s0 - data.shape[1])), mode='edge')
+        return data[:, :s1 - s0]
+
+
+def open_source(path, store=None, epoc_store=None):
+    """ExportSource for export folders, BlockSource for TDT blocks."""
+    if os.path.exists(os.path.join(path, META_FILE)):
+        return ExportSource(path)
+    if store is None:
+        raise ValueError(f"{path} is a TDT block; pass the EEG store name (--store)")
+    return BlockSource(path, store, epoc_store)
+
+
+# ----------------------------------------------------------------------
+# Running averages
+# ----------------------------------------------------------------------
+class ErpAverage:
+    """Running per-code sums of baseline-corrected epochs.
+
+    Args:
+        times: Epoch time axis in seconds.
+        n_channels: Channels per epoch.
+    """
+
+    def __init__(self, times, n_channels):
+        self.times = np.asarray(times, dtype=float)
+        self.n_channels = n_channels
+        self.sums = {}
+        self.sumsq = {}
+        self.counts = {}
+        self.rejected = {}
+
+    def add(self, codes, epochs, rejected=None):
+        """Add epochs (n_epochs x channels x times) with their codes."""
+        if rejected is not None:
+            for code, n in zip(*np.unique(codes[rejected], return_counts=True)):
+                self.rejected[int(code)] = self.rejected.get(int(code), 0) + int(n)
+            codes, epochs = codes[~rejected], epochs[~rejected]
+        if not len(codes):
+            return
+        order = np.argsort(codes, kind='stable')
+        codes, epochs = codes[order], epochs[order]
+        unique, starts, counts = np.unique(codes, return_index=True, return_counts=True)
+        sums = np.add.reduceat(epochs, starts, axis=0)
+        sumsq = np.add.reduceat(epochs * epochs, starts, axis=0)
+        for code, total, square, n in zip(unique.tolist(), sums, sumsq, counts.tolist()):
+            if code in self.sums:
+                self.sums[code] += total
+                self.sumsq[code] += square
+                self.counts[code] += n
+            else:
+                self.sums[code], self.sumsq[code], self.counts[code] = total, square, n
+
+    def merge(self, other):
+        """Add another average's sums (e.g. another block) to this one."""
+        for code, n in other.counts.items():
+            if code in self.sums:
+                self.sums[code] = self.sums[code] + other.sums[code]
+                self.sumsq[code] = self.sumsq[code] + other.sumsq[code]
+                self.counts[code] += n
+            else:
+                self.sums[code], self.sumsq[code] = other.sums[code].copy(), other.sumsq[code].copy()
+                self.counts[code] = n
+        for code, n in other.rejected.items():
+            self.rejected[code] = self.rejected.get(code, 0) + n
+        return self
+
+    @property
+    def codes(self):
+        return sorted(self.counts)
+
+    def mean(self, code):
+        return self.sums[code] / self.counts[code]
+
+    def sem(self, code):
+        n = self.counts[code]
+        if n < 2:
+            return np.full_like(self.sums[code], np.nan)
+        var = (self.sumsq[code] - self.sums[code] ** 2 / n) / (n - 1)
+        return np.sqrt(np.maximum(var, 0.0) / n)
+
+    def save(self, path):
+        """Write times, codes, counts, means and SEMs to an .npz file."""
+        codes = self.codes
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        np.savez(
+            path, times=self.times, codes=np.array(codes, dtype=np.int64),
+            counts=np.array([self.counts[c] for c in codes], dtype=np.int64),
+            rejected=np.array([self.rejected.get(c, 0) for c in codes], dtype=np.int64),
+            mean=np.array([self.mean(c) for c in codes]).reshape(len(codes), self.n_channels, -1),
+            sem=np.array([self.sem(c) for c in codes]).reshape(len(codes), self.n_channels, -1),
+        )
+        return path
+
+
+# ----------------------------------------------------------------------
+# Epoching
+# ----------------------------------------------------------------------
+def epoch_source(source, codes=None, tmin=-0.2, tmax=0.8, baseline=(None, 0.0),
+                 chunk_sec=60.0, reject=None):
+    """Average the epochs of one source chunk by chunk.
+
+    Args:
+        source: ExportSource or BlockSource.
+        codes: Trigger codes to epoch (default: every code in the block).
+        tmin, tmax: Epoch window around each onset in seconds.
+        baseline: (start, end) in seconds subtracted per epoch and
+            channel; None ends mean the epoch start / onset. Pass None to
+            skip baseline correction.
+        chunk_sec: Seconds of EEG read at a time.
+        reject: Peak-to-peak limit (source units); epochs exceeding it
+            on any channel are counted as rejected and left out.
+
+    Returns:
+        ErpAverage.
+    """
+    fs = source.fs
+    first = int(round(tmin * fs))
+    n_times = int(round(tmax * fs)) - first
+    times = (first + np.arange(n_times)) / fs
+    average = ErpAverage(times, source.n_channels)
+
+    ev_codes, onsets = source.events()
+    if codes is not None:
+        keep = np.isin(ev_codes, list(codes))
+        ev_codes, onsets = ev_codes[keep], onsets[keep]
+    starts = np.round(onsets * fs).astype(np.int64) + first
+    inside = (starts >= 0) & (starts + n_times <= source.n_samples)
+    order = np.argsort(starts[inside], kind='stable')
+    starts, ev_codes = starts[inside][order], ev_codes[inside][order]
+
+    if baseline is not None:
+        b0 = 0 if baseline[0] is None else int(round(baseline[0] * fs)) - first
+        b1 = -first if baseline[1] is None else int(round(baseline[1] * fs)) - first
+        b0, b1 = max(0, b0), min(n_times, b1)
+    offsets = np.arange(n_times)
+    chunk = max(1, int(chunk_sec * fs))
+
+    for c0 in range(0, source.n_samples, chunk):
+        lo, hi = np.searchsorted(starts, [c0, c0 + chunk])
+        if lo == hi:
+            continue
+        # Read up to the end of the last epoch that starts in this chunk
+        data = source.read(c0, int(starts[hi - 1]) + n_times)
+        index = (starts[lo:hi] - c0)[:, None] + offsets
+        epochs = data[:, index].transpose(1, 0, 2).astype(np.float64)
+        if baseline is not None and b1 > b0:
+            epochs -= epochs[:, :, b0:b1].mean(axis=2, keepdims=True)
+        rejected = None
+        if reject is not None:
+            rejected = (np.ptp(epochs, axis=2) > reject).any(axis=1)
+        average.add(ev_codes[lo:hi], epochs, rejected)
+    return average
+
+
+def _epoch_path(path, store, epoc_store, settings):
+    return epoch_source(open_source(path, store, epoc_store), **settings)
+
+
+def epoch_blocks(paths, store=None, epoc_store=None, workers=None, **settings):
+    """Epoch several blocks in parallel.
+
+    Returns:
+        ({path: ErpAverage}, {path: error message}).
+    """
+    results, errors = {}, {}
+    workers = max(1, min(workers or os.cpu_count() or 1, len(paths)))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_epoch_path, path, store, epoc_store, settings): path for path in paths}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                results[path] = future.result()
+            except Exception as e:
+                errors[path] = f"{type(e).__name__}: {e}"
+    return results, errors
+
+
+def grand_average(averages):
+    """Merge block averages into one, weighted by epoch counts."""
+    averages = list(averages)
+    grand = ErpAverage(averages[0].times, averages[0].n_channels)
+    for average in averages:
+        grand.merge(average)
+    return grand
+
+
+# ----------------------------------------------------------------------
+# Export and fixtures
+# ----------------------------------------------------------------------
+def _write_export(folder, fs, n_channels, n_samples, fill, codes, onsets, meta=None):
+    """Create an export folder, filling eeg.npy chunk by chunk via fill(s0, s1)."""
+    os.makedirs(folder, exist_ok=True)
+    eeg = np.lib.format.open_memmap(os.path.join(folder, EEG_FILE), mode='w+',
+                                    dtype=np.float32, shape=(n_channels, n_samples))
+    step = int(60 * fs)
+    for s0 in range(0, n_samples, step):
+        s1 = min(n_samples, s0 + step)
+        eeg[:, s0:s1] = fill(s0, s1)
+    eeg.flush()
+    del eeg
+    pd.DataFrame({'onset': onsets, 'code': codes}).to_csv(os.path.join(folder, EVENTS_FILE), index=False)
+    with open(os.path.join(folder, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump(dict(meta or {}, fs=fs, n_channels=n_channels, n_samples=n_samples), f, indent=2)
+    return folder
+
+
+def export_block(block_path, folder, store, epoc_store=None):
+    """Copy a TDT block's EEG store and trigger codes into an export folder."""
+    source = BlockSource(block_path, store, epoc_store)
+    codes, onsets = source.events()
+    return _write_export(folder, source.fs, source.n_channels, source.n_samples, source.read,
+                         codes, onsets, {'block': block_path, 'store': store})
+
+
+def make_synthetic_export(folder, fs=1000.0, n_channels=8, duration_sec=600.0,
+                          codes=tuple(range(8001, 8011)), isi_sec=1.0, noise=10e-6, seed=0):
+    """Write an export fixture with a known ERP per code.
+
+    Each code evokes a positive peak at 100 ms and a negative one at
+    300 ms whose amplitude grows with the code's rank (1-10 µV), on top
+    of white noise and a slow per-channel drift that the baseline
+    correction has to remove.
+    """
+    rng = np.random.default_rng(seed)
+    n_samples = int(duration_sec * fs)
+    onsets = np.arange(1.0, duration_sec - 1.0, isi_sec) + rng.uniform(0, 0.1 * isi_sec)
+    ev_codes = rng.choice(np.asarray(codes), len(onsets))
+    rank = {code: i + 1 for i, code in enumerate(codes)}
+    t = np.arange(int(0.6 * fs)) / fs
+    shape = np.exp(-((t - 0.1) / 0.02) ** 2) - 0.5 * np.exp(-((t - 0.3) / 0.05) ** 2)
+    amplitudes = np.array([rank[c] * 1e-6 for c in ev_codes])
+    starts = np.round(onsets * fs).astype(np.int64)
+    drift = rng.uniform(-50e-6, 50e-6, (n_channels, 1))
+
+    def fill(s0, s1):
+        data = rng.normal(0.0, noise, (n_channels, s1 - s0))
+        data += drift * np.sin(2 * np.pi * 0.05 * np.arange(s0, s1) / fs)
+        lo, hi = np.searchsorted(starts, [s0 - len(t), s1])
+        for start, amp in zip(starts[lo:hi], amplitudes[lo:hi]):
+            a, b = max(s0, start), min(s1, start + len(t))
+            if a < b:
+                data[:, a - s0:b - s0] += amp * shape[a - start:b - start]
+        return data
+
+    meta = {'synthetic': True, 'codes': [int(c) for c in codes], 'peak_uv_per_rank': 1.0}
+    return _write_export(folder, fs, n_channels, n_samples, fill, ev_codes, onsets, meta)
+
+
+# ----------------------------------------------------------------------
+# Command line
+# ----------------------------------------------------------------------
+def parse_codes(text):
+    """'8001-8010,8999' -> [8001, ..., 8010, 8999]."""
+    codes = []
+    for part in filter(None, (p.strip() for p in text.split(','))):
+        lo, _, hi = part.partition('-')
+        codes.extend(range(int(lo), int(hi or lo) + 1))
+    return codes
+
+
+def print_summary(name, average):
+    total = sum(average.counts.values())
+    rejected = sum(average.rejected.values())
+    print(f"✓ {name}: {total} epochs in {len(average.codes)} codes"
+          + (f", {rejected} rejected" if rejected else ""))
+    for code in average.codes:
+        mean = average.mean(code).mean(axis=0)
+        peak = int(np.argmax(np.abs(mean)))
+        print(f"  {code:>6}  n={average.counts[code]:<5} peak {1e6 * mean[peak]:+7.2f} µV "
+              f"at {1000.0 * average.times[peak]:+6.0f} ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('blocks', nargs='*', help='TDT block folders or export folders')
+    parser.add_argument('--store', help='EEG stream store of TDT blocks')
+    parser.add_argument('--epoc-store', help='epoc store with the trigger codes')
+    parser.add_argument('--codes', type=parse_codes, help="codes to epoch, e.g. '8001-8010' (default: all)")
+    parser.add_argument('--tmin', type=float, default=-0.2)
+    parser.add_argument('--tmax', type=float, default=0.8)
+    parser.add_argument('--baseline', type=float, nargs=2, default=[-0.2, 0.0], metavar=('START', 'END'))
+    parser.add_argument('--no-baseline', action='store_true')
+    parser.add_argument('--reject', type=float, help='peak-to-peak rejection limit (store units, e.g. 100e-6)')
+    parser.add_argument('--chunk-sec', type=float, default=60.0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--out', default=os.path.join('data', 'erp'), help='folder for the *_erp.npz files')
+    parser.add_argument('--synthetic', metavar='FOLDER', help='write a synthetic export fixture and exit')
+    parser.add_argument('--duration', type=float, default=600.0, help='synthetic fixture length (s)')
+    args = parser.parse_args(argv)
+
+    if args.synthetic:
+        make_synthetic_export(args.synthetic, duration_sec=args.duration)
+        print(f"✓ Synthetic export written: {args.synthetic}")
+        return 0
+    if not args.blocks:
+        parser.error('no blocks given')
+
+    settings = {'codes': args.codes, 'tmin': args.tmin, 'tmax': args.tmax,
+                'baseline': None if args.no_baseline else tuple(args.baseline),
+                'chunk_sec': args.chunk_sec, 'reject': args.reject}
+    t0 = time.perf_counter()
+    results, errors = epoch_blocks(args.blocks, args.store, args.epoc_store, args.workers, **settings)
+    for path in args.blocks:
+        if path in results:
+            name = os.path.basename(os.path.normpath(path))
+            print_summary(name, results[path])
+            results[path].save(os.path.join(args.out, f"{name}_erp.npz"))
+        else:
+            print(f"✗ {path}: {errors[path]}")
+    if len(results) > 1:
+        grand = grand_average(results[path] for path in args.blocks if path in results)
+        print_summary('grand average', grand)
+        grand.save(os.path.join(args.out, 'grand_erp.npz'))
+    print(f"✓ ERP averages saved to {args.out} ({time.perf_counter() - t0:.1f} s)")
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
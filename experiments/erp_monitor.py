@@ -0,0 +1,494 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Online running-average ERP monitor.
+
+Gives the operator live per-code ERPs and the noise level while the ERP
+block runs. The monitor is its own process, started at lowered
+priority, so drawing never takes time from the stimulus loop; the
+experiment only sends one UDP datagram per trigger to localhost and
+does not care whether anyone listens.
+
+Inputs, all on one clock:
+
+- udp (default): samples arrive as datagrams on --sample-port
+  (t0, fs, channels x samples float32) and triggers on --trigger-port
+  (code, time), both on the time.perf_counter clock. During
+  run_erp_block the tutorial publishes its trigger log records
+  (requested time = DAC time of the stimulus) to the trigger port via
+  `TriggerPublisher`. The `replay` command stands in for the rig: it
+  streams an erp_epochs export folder in real time and, unless
+  --no-triggers, publishes the export's events as the experiment would.
+- live: polls the block Synapse is recording (tdt.read_block from the
+  last sample read) and takes the triggers from the block's epoc store,
+  i.e. the markers as recorded.
+
+`RunningErp` keeps the last --ring-sec seconds of samples in a ring
+buffer; once a trigger's epoch is complete it is cut from the ring,
+baseline-corrected and added to the code's cumulative sum and to a ring
+of its last --recent epochs. The figure (cumulative and recent average
+per code, epochs, noise RMS) is redrawn at most --max-fps times a second
+and only when something changed.
+
+Usage:
+    python experiments/erp_monitor.py replay data/erp_fixture --speed 1
+    python experiments/erp_monitor.py monitor
+    python experiments/erp_monitor.py monitor --source live --store EEG1
+    python experiments/erp_monitor.py monitor --no-plot --duration 60
+"""
+
+import argparse
+import os
+import select
+import socket
+import struct
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+TRIGGER_PORT = 7011
+SAMPLE_PORT = 7012
+HOST = '127.0.0.1'
+
+_TRIGGER = struct.Struct('<id')        # code, time
+_SAMPLES = struct.Struct('<ddII')      # t0, fs, channels, samples
+_MAX_DATAGRAM = 60000
+
+
+def lower_process_priority():
+    """Run the calling process below normal priority where the OS allows it."""
+    try:
+        if os.name == 'nt':
+            import ctypes
+            BELOW_NORMAL_PRIORITY_CLASS = 0x4000
+            kernel32 = ctypes.windll.kernel32
+            kernel32.SetPriorityClass(kernel32.GetCurrentProcess(), BELOW_NORMAL_PRIORITY_CLASS)
+        else:
+            os.nice(10)
+        return True
+    except Exception:
+        return False
+
+
+def launch_monitor(args=()):
+    """Start `erp_monitor.py monitor <args>` as a separate process."""
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), 'monitor', *args])
+
+
+# ----------------------------------------------------------------------
+# Publishing (experiment / replay side)
+# ----------------------------------------------------------------------
+class TriggerPublisher:
+    """TRIGGER_LOG listener sending (code, requested time) to the monitor.
+
+    Args:
+        codes: Only publish these codes (default: all).
+        port, host: Monitor trigger address.
+    """
+
+    def __init__(self, codes=None, port=TRIGGER_PORT, host=HOST):
+        self.codes = None if codes is None else set(codes)
+        self.address = (host, port)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+
+    def __call__(self, record):
+        self.publish(record[0], record[2])
+
+    def publish(self, code, t):
+        if self.codes is not None and code not in self.codes:
+            return
+        try:
+            self.sock.sendto(_TRIGGER.pack(int(code), t), self.address)
+        except OSError:
+            pass  # nobody listening or buffer full: the experiment goes on
+
+    def close(self):
+        self.sock.close()
+
+
+def send_samples(sock, address, t0, fs, data):
+    """Send a channels x samples block as one or more datagrams."""
+    data = np.ascontiguousarray(data, dtype=np.float32)
+    n_channels, n_samples = data.shape
+    step = max(1, (_MAX_DATAGRAM - _SAMPLES.size) // (4 * n_channels))
+    for s0 in range(0, n_samples, step):
+        part = np.ascontiguousarray(data[:, s0:s0 + step])
+        header = _SAMPLES.pack(t0 + s0 / fs, fs, n_channels, part.shape[1])
+        try:
+            sock.sendto(header + part.tobytes(), address)
+        except OSError:
+            pass
+
+
+def replay(folder, speed=1.0, chunk_sec=0.05, triggers=True, loop=False,
+           sample_port=SAMPLE_PORT, trigger_port=TRIGGER_PORT, host=HOST):
+    """Stream an erp_epochs export as the rig would (samples and, optionally, triggers)."""
+    from erp_epochs import ExportSource
+    source = ExportSource(folder)
+    fs = source.fs
+    codes, onsets = source.events()
+    order = np.argsort(onsets)
+    codes, onsets = codes[order], onsets[order]
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    publisher = TriggerPublisher(port=trigger_port, host=host)
+    chunk = max(1, int(chunk_sec * fs))
+    print(f"Replaying {source.name}: {source.n_channels} ch, {fs:g} Hz, "
+          f"{source.n_samples / fs:.0f} s, {len(codes)} triggers at {speed:g}x")
+    try:
+        while True:
+            t_start = time.perf_counter()
+            next_event = 0
+            for s0 in range(0, source.n_samples, chunk):
+                due = t_start + s0 / fs / speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                s1 = min(source.n_samples, s0 + chunk)
+                send_samples(sock, (host, sample_port), t_start + s0 / fs, fs, source.read(s0, s1))
+                if triggers:
+                    while next_event < len(onsets) and onsets[next_event] * fs < s1:
+                        publisher.publish(codes[next_event], t_start + onsets[next_event])
+                        next_event += 1
+            if not loop:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sock.close()
+        publisher.close()
+
+
+# ----------------------------------------------------------------------
+# Running averages
+# ----------------------------------------------------------------------
+class RunningErp:
+    """Ring buffer of samples and incremental per-code averages.
+
+    Args:
+        fs: Sample rate of the stream.
+        n_channels: Channels per sample.
+        tmin, tmax: Epoch window in seconds.
+        ring_sec: Seconds of samples kept for cutting epochs.
+        recent: Epochs per code in the recent average.
+    """
+
+    def __init__(self, fs, n_channels, tmin=-0.1, tmax=0.5, ring_sec=10.0, recent=20):
+        self.fs = fs
+        self.n_channels = n_channels
+        self.first = int(round(tmin * fs))
+        self.n_times = int(round(tmax * fs)) - self.first
+        self.times = (self.first + np.arange(self.n_times)) / fs
+        self.capacity = max(int(ring_sec * fs), 2 * self.n_times)
+        self.ring = np.zeros((n_channels, self.capacity), dtype=np.float32)
+        # Absolute sample index held by each slot (-1: never written), to detect gaps
+        self.stamp = np.full(self.capacity, -1, dtype=np.int64)
+        self.recent = recent
+        self.t_first = None
+        self.head = 0
+        self.pending = []
+        self.sums, self.counts = {}, {}
+        self.recent_epochs, self.recent_pos = {}, {}
+        self.dropped = 0
+        self._offsets = np.arange(self.n_times)
+
+    def index(self, t):
+        return int(round((t - self.t_first) * self.fs))
+
+    def push(self, t0, data):
+        """Write a channels x samples block whose first sample is at time t0."""
+        if self.t_first is None:
+            self.t_first = t0
+        start = self.index(t0)
+        n = data.shape[1]
+        slots = np.arange(start, start + n) % self.capacity
+        self.ring[:, slots] = data
+        self.stamp[slots] = np.arange(start, start + n)
+        self.head = max(self.head, start + n)
+
+    def trigger(self, code, t):
+        self.pending.append((int(code), t))
+
+    def update(self):
+        """Cut the pending epochs that are complete; returns how many were added."""
+        if self.t_first is None or not self.pending:
+            return 0
+        added, waiting = 0, []
+        for code, t in self.pending:
+            start = self.index(t) + self.first
+            if start + self.n_times > self.head:
+                waiting.append((code, t))
+                continue
+            wanted = start + self._offsets
+            slots = wanted % self.capacity
+            if start < 0 or not np.array_equal(self.stamp[slots], wanted):
+                self.dropped += 1  # overwritten, lost datagram or before the stream started
+                continue
+            epoch = self.ring[:, slots].astype(np.float64)
+            if self.first < 0:
+                epoch -= epoch[:, :-self.first].mean(axis=1, keepdims=True)
+            self._add(code, epoch)
+            added += 1
+        self.pending = waiting
+        return added
+
+    def _add(self, code, epoch):
+        if code not in self.sums:
+            self.sums[code] = np.zeros_like(epoch)
+            self.counts[code] = 0
+            self.recent_epochs[code] = np.zeros((self.recent,) + epoch.shape)
+            self.recent_pos[code] = 0
+        self.sums[code] += epoch
+        self.counts[code] += 1
+        self.recent_epochs[code][self.recent_pos[code] % self.recent] = epoch
+        self.recent_pos[code] += 1
+
+    def mean(self, code):
+        return self.sums[code] / self.counts[code]
+
+    def recent_mean(self, code):
+        n = min(self.recent_pos[code], self.recent)
+        return self.recent_epochs[code][:n].mean(axis=0)
+
+    def noise_rms(self, seconds=1.0):
+        """RMS per channel over the last `seconds` of samples."""
+        n = min(int(seconds * self.fs), self.head, self.capacity)
+        if n < 2:
+            return np.full(self.n_channels, np.nan)
+        slots = np.arange(self.head - n, self.head) % self.capacity
+        block = self.ring[:, slots]
+        return block.std(axis=1)
+
+
+# ----------------------------------------------------------------------
+# Inputs
+# ----------------------------------------------------------------------
+class UdpInput:
+    """Sample and trigger datagrams on localhost."""
+
+    def __init__(self, sample_port=SAMPLE_PORT, trigger_port=TRIGGER_PORT, host=HOST):
+        self.samples = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.samples.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        self.samples.bind((host, sample_port))
+        self.triggers = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.triggers.bind((host, trigger_port))
+
+    def poll(self, timeout):
+        """Return ([(t0, fs, data)], [(code, t)]) received within `timeout`."""
+        blocks, events = [], []
+        ready, _, _ = select.select([self.samples, self.triggers], [], [], timeout)
+        while ready:
+            for sock in ready:
+                payload = sock.recv(65536)
+                if sock is self.triggers:
+                    events.append(_TRIGGER.unpack(payload))
+                else:
+                    t0, fs, n_channels, n_samples = _SAMPLES.unpack_from(payload)
+                    data = np.frombuffer(payload, np.float32, offset=_SAMPLES.size)
+                    blocks.append((t0, fs, data.reshape(n_channels, n_samples)))
+            ready, _, _ = select.select([self.samples, self.triggers], [], [], 0)
+        return blocks, events
+
+    def close(self):
+        self.samples.close()
+        self.triggers.close()
+
+
+class LiveBlockInput:
+    """Polls the block being recorded (samples and recorded epocs, block clock).
+
+    Args:
+        store: EEG stream store.
+        block_path: Block folder; by default the current block reported
+            by Synapse (tank folder + block name).
+        epoc_store: Epoc store with the trigger codes.
+    """
+
+    def __init__(self, store, block_path=None, epoc_store=None):
+        import tdt
+        self.tdt = tdt
+        if block_path is None:
+            syn = tdt.SynapseAPI()
+            block_path = os.path.join(syn.getCurrentTank(), syn.getCurrentBlock())
+        self.block_path = block_path
+        self.store = store
+        self.epoc_store = epoc_store
+        self.t = 0.0
+        self.seen = 0
+
+    def poll(self, timeout):
+        from verify_triggers import load_recorded
+        time.sleep(timeout)
+        blocks, events = [], []
+        try:
+            stream = self.tdt.read_block(self.block_path, store=self.store, t1=self.t).streams[self.store]
+        except Exception:
+            return blocks, events  # nothing flushed to disk yet
+        data = np.atleast_2d(np.asarray(stream.data, dtype=np.float32))
+        if data.shape[1]:
+            t0 = getattr(stream, 'start_time', self.t)
+            blocks.append((t0, float(stream.fs), data))
+            self.t = t0 + data.shape[1] / float(stream.fs)
+        try:
+            codes, onsets, _ = load_recorded(self.block_path, self.epoc_store)
+        except Exception:
+            return blocks, events
+        events = list(zip(codes[self.seen:].tolist(), onsets[self.seen:].tolist()))
+        self.seen = len(codes)
+        return blocks, events
+
+    def close(self):
+        pass
+
+
+# ----------------------------------------------------------------------
+# Display
+# ----------------------------------------------------------------------
+class ErpFigure:
+    """Cumulative (solid) and recent (thin) channel-mean ERP per code."""
+
+    def __init__(self):
+        import matplotlib.pyplot as plt
+        self.plt = plt
+        plt.ion()
+        self.fig, self.ax = plt.subplots(figsize=(9, 5))
+        self.fig.canvas.manager.set_window_title('ERP monitor')
+        self.ax.axvline(0, color='gray', linewidth=0.5)
+        self.ax.set_xlabel('Time from trigger (ms)')
+        self.ax.set_ylabel('Channel mean (µV)')
+        self.lines = {}
+
+    def draw(self, erp, status):
+        ax = self.ax
+        for code in sorted(erp.counts):
+            mean = 1e6 * erp.mean(code).mean(axis=0)
+            recent = 1e6 * erp.recent_mean(code).mean(axis=0)
+            if code not in self.lines:
+                solid, = ax.plot(erp.times * 1000.0, mean, linewidth=2)
+                thin, = ax.plot(erp.times * 1000.0, recent, linewidth=0.8, color=solid.get_color(), alpha=0.6)
+                self.lines[code] = (solid, thin)
+            solid, thin = self.lines[code]
+            solid.set_ydata(mean)
+            thin.set_ydata(recent)
+            solid.set_label(f"{code} (n={erp.counts[code]})")
+        ax.relim()
+        ax.autoscale_view()
+        ax.set_title(status, fontsize=10)
+        ax.legend(loc='upper right', fontsize=8)
+        self.fig.canvas.draw_idle()
+        self.plt.pause(0.001)
+
+    def idle(self):
+        """Keep the window responsive between redraws."""
+        self.fig.canvas.flush_events()
+
+    def alive(self):
+        return self.plt.fignum_exists(self.fig.number)
+
+
+def status_line(erp):
+    rms = 1e6 * np.nanmedian(erp.noise_rms())
+    total = sum(erp.counts.values())
+    return (f"{total} epochs in {len(erp.counts)} codes | noise RMS {rms:.1f} µV (median channel)"
+            + (f" | {erp.dropped} dropped" if erp.dropped else ""))
+
+
+def run_monitor(source='udp', store=None, block_path=None, epoc_store=None, tmin=-0.1, tmax=0.5,
+                ring_sec=10.0, recent=20, max_fps=4.0, plot=True, duration=None,
+                sample_port=SAMPLE_PORT, trigger_port=TRIGGER_PORT):
+    """Run the monitor loop until the figure is closed, Ctrl+C or `duration` seconds."""
+    lower_process_priority()
+    if source == 'live':
+        feed = LiveBlockInput(store, block_path, epoc_store)
+    else:
+        feed = UdpInput(sample_port, trigger_port)
+    figure = ErpFigure() if plot else None
+    erp = None
+    early = []
+    period = 1.0 / max_fps
+    t_end = None if duration is None else time.perf_counter() + duration
+    last_draw = 0.0
+    dirty = False
+    print(f"ERP monitor listening ({source}); redrawing at most {max_fps:g}x per second")
+    try:
+        while t_end is None or time.perf_counter() < t_end:
+            blocks, events = feed.poll(period if source == 'live' else min(period, 0.05))
+            for t0, fs, data in blocks:
+                if erp is None:
+                    erp = RunningErp(fs, data.shape[0], tmin, tmax, ring_sec, recent)
+                erp.push(t0, data)
+            if erp is None:
+                early.extend(events)
+                continue
+            for code, t in early + events:
+                erp.trigger(code, t)
+            early = []
+            dirty = erp.update() > 0 or dirty
+
+            now = time.perf_counter()
+            if figure is not None:
+                if not figure.alive():
+                    break
+                if dirty and now - last_draw >= period:
+                    figure.draw(erp, status_line(erp))
+                    last_draw, dirty = now, False
+                else:
+                    figure.idle()
+            elif dirty and now - last_draw >= max(period, 2.0):
+                print(status_line(erp))
+                last_draw, dirty = now, False
+    except KeyboardInterrupt:
+        pass
+    finally:
+        feed.close()
+    if erp is not None:
+        print(status_line(erp))
+    return erp
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    monitor = commands.add_parser('monitor', help='show running ERPs')
+    monitor.add_argument('--source', choices=['udp', 'live'], default='udp')
+    monitor.add_argument('--store', help='EEG stream store (live)')
+    monitor.add_argument('--block', help='block folder (live; default: Synapse current block)')
+    monitor.add_argument('--epoc-store', help='epoc store with the trigger codes (live)')
+    monitor.add_argument('--tmin', type=float, default=-0.1)
+    monitor.add_argument('--tmax', type=float, default=0.5)
+    monitor.add_argument('--ring-sec', type=float, default=10.0)
+    monitor.add_argument('--recent', type=int, default=20, help='epochs in the recent average')
+    monitor.add_argument('--max-fps', type=float, default=4.0)
+    monitor.add_argument('--no-plot', action='store_true', help='print status lines instead')
+    monitor.add_argument('--duration', type=float, help='stop after this many seconds')
+    monitor.add_argument('--sample-port', type=int, default=SAMPLE_PORT)
+    monitor.add_argument('--trigger-port', type=int, default=TRIGGER_PORT)
+
+    rep = commands.add_parser('replay', help='stream an erp_epochs export as the rig would')
+    rep.add_argument('folder', help='export folder (erp_epochs.py --synthetic or export_block)')
+    rep.add_argument('--speed', type=float, default=1.0)
+    rep.add_argument('--chunk-sec', type=float, default=0.05)
+    rep.add_argument('--no-triggers', action='store_true',
+                     help='stream samples only (triggers come from the experiment)')
+    rep.add_argument('--loop', action='store_true')
+    rep.add_argument('--sample-port', type=int, default=SAMPLE_PORT)
+    rep.add_argument('--trigger-port', type=int, default=TRIGGER_PORT)
+    args = parser.parse_args(argv)
+
+    if args.command == 'replay':
+        replay(args.folder, args.speed, args.chunk_sec, not args.no_triggers, args.loop,
+               args.sample_port, args.trigger_port)
+        return 0
+    if args.source == 'live' and not args.store:
+        parser.error('--source live needs --store')
+    run_monitor(args.source, args.store, args.block, args.epoc_store, args.tmin, args.tmax,
+                args.ring_sec, args.recent, args.max_fps, not args.no_plot, args.duration,
+                args.sample_port, args.trigger_port)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
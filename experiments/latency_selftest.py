@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Per-machine latency self-test for the sentence comprehension setup.
+
+Qualifies a stimulus PC before participants are run. The test drives the
+experiment's own code paths many times on this machine's display, audio
+device and disk, and compares each path's latency distribution with
+thresholds:
+
+- mix:            SentenceExperiment.load_stereo_audio (two real stimuli)
+- play overrun:   play_audio wall time beyond the clip's nominal duration
+- quiz render:    Display.quiz() plus drawing the quiz stims
+- quiz frame:     interval between flips while the quiz is on screen
+- trigger:        TDTSynapseManager.send_trigger (software pulses include
+                  the 10 ms wait; see --pulse-mode)
+- save:           save_data appending a row to a session CSV
+
+Triggers go to a mock Synapse unless --tdt real is given; a real Synapse
+is switched from Idle to Preview for the test and restored afterwards.
+The report (numbers, limits, pass/fail and machine details) is printed
+and saved to data/selftest/{host}_{time}.json. The exit code is 0 when
+every path passes.
+
+Run it from the experiment folder (quiz.xlsx, stimuli/), like the
+experiments themselves.
+
+Usage:
+    python experiments/latency_selftest.py
+    python experiments/latency_selftest.py --iterations 200 --display window
+    python experiments/latency_selftest.py --tdt real --thresholds lab_limits.json
+
+A thresholds file overrides the defaults per path and metric, e.g.
+    {"trigger": {"p95_ms": 15}, "play overrun": {"max_ms": 150}}
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+from sentence_core import Display, FullscreenDisplay, NullTriggers, SentenceExperiment
+from sentence_comprehension_TDT import TDT_AVAILABLE, TDTSynapseManager
+
+# Limits in milliseconds; a path passes when every listed metric is within its limit
+DEFAULT_THRESHOLDS = {
+    'mix': {'p95_ms': 50.0, 'max_ms': 200.0},
+    'play overrun': {'p95_ms': 100.0, 'max_ms': 250.0},
+    'quiz render': {'p95_ms': 5.0, 'max_ms': 50.0},
+    'quiz frame': {'p95_ms': 25.0, 'max_ms': 50.0},
+    'trigger': {'p95_ms': 20.0, 'max_ms': 50.0},
+    'save': {'p95_ms': 20.0, 'max_ms': 100.0},
+}
+PATHS = list(DEFAULT_THRESHOLDS)
+SYNAPSE_IDLE, SYNAPSE_PREVIEW = 0, 2
+
+
+class _MockSynapse:
+    """Accepts the calls TDTSynapseManager.send_trigger makes and does nothing."""
+
+    def getMode(self):
+        return SYNAPSE_PREVIEW
+
+    def setMode(self, mode):
+        pass
+
+    def setParameterValue(self, gizmo, parameter, value):
+        return True
+
+
+class MockSynapseManager(TDTSynapseManager):
+    """TDTSynapseManager connected to _MockSynapse instead of Synapse."""
+
+    def _connect(self):
+        self.synapse = _MockSynapse()
+        self.connected = True
+
+
+# ----------------------------------------------------------------------
+# Statistics and thresholds
+# ----------------------------------------------------------------------
+def summarize(samples_ms, warmup=0):
+    """Distribution of one path's samples; the first `warmup` are excluded."""
+    first = samples_ms[0] if samples_ms else None
+    values = np.asarray(samples_ms[warmup:] or samples_ms, dtype=float)
+    if not len(values):
+        return {'n': 0}
+    return {
+        'n': int(len(values)),
+        'first_ms': round(float(first), 3),
+        'mean_ms': round(float(values.mean()), 3),
+        'median_ms': round(float(np.median(values)), 3),
+        'p95_ms': round(float(np.percentile(values, 95)), 3),
+        'p99_ms': round(float(np.percentile(values, 99)), 3),
+        'max_ms': round(float(values.max()), 3),
+        'std_ms': round(float(values.std()), 3),
+    }
+
+
+def load_thresholds(path=None):
+    """DEFAULT_THRESHOLDS updated with the per-path limits in JSON `path`."""
+    thresholds = {name: dict(limits) for name, limits in DEFAULT_THRESHOLDS.items()}
+    if path:
+        with open(path, encoding='utf-8') as f:
+            for name, limits in json.load(f).items():
+                thresholds.setdefault(name, {}).update(limits)
+    return thresholds
+
+
+def evaluate(stats, thresholds):
+    """Return {path: [(metric, limit, value, ok), ...]} for the measured paths."""
+    checks = {}
+    for name, limits in thresholds.items():
+        s = stats.get(name)
+        if not s or not s.get('n'):
+            continue
+        checks[name] = [(metric, limit, s[metric], s[metric] <= limit)
+                        for metric, limit in limits.items() if metric in s]
+    return checks
+
+
+# ----------------------------------------------------------------------
+# Measurements
+# ----------------------------------------------------------------------
+def measure(exp, manager, iterations=100, play_iterations=30, play_sec=0.25,
+            trigger_code=1, paths=PATHS):
+    """Run each path repeatedly; return {path: [milliseconds, ...]}."""
+    samples = {name: [] for name in paths}
+    pairs = [random.sample(exp.audio_files, 2) for _ in range(max(iterations, play_iterations))]
+
+    if 'mix' in samples:
+        for left, right in pairs[:iterations]:
+            t0 = time.perf_counter()
+            stereo, _, _ = exp.load_stereo_audio(left, right)
+            samples['mix'].append(1000.0 * (time.perf_counter() - t0))
+            if stereo is None:
+                raise RuntimeError(f"load_stereo_audio failed for {left} / {right}")
+
+    if 'play overrun' in samples:
+        for left, right in pairs[:play_iterations]:
+            stereo, sr, _ = exp.load_stereo_audio(left, right)
+            clip = stereo[:int(play_sec * sr)]
+            t0 = exp.clock.getTime()
+            exp.play_audio(clip, sr)
+            elapsed = exp.clock.getTime() - t0
+            samples['play overrun'].append(1000.0 * (elapsed - len(clip) / sr))
+
+    if 'quiz render' in samples or 'quiz frame' in samples:
+        items = list(exp.quiz_data.values())
+        window = exp.window
+        last_flip = None
+        for i in range(iterations + 1):
+            item = items[i % len(items)]
+            t0 = time.perf_counter()
+            stims = exp.display.quiz(item['quiz'], item['options'])
+            for stim in stims:
+                stim.draw()
+            t1 = time.perf_counter()
+            flip = window.flip()
+            if i and 'quiz render' in samples:
+                samples['quiz render'].append(1000.0 * (t1 - t0))
+            if last_flip is not None and flip is not None and 'quiz frame' in samples:
+                samples['quiz frame'].append(1000.0 * (flip - last_flip))
+            last_flip = flip
+
+    if 'trigger' in samples:
+        for _ in range(iterations):
+            t0 = time.perf_counter()
+            ok = manager.send_trigger(trigger_code)
+            samples['trigger'].append(1000.0 * (time.perf_counter() - t0))
+            if not ok:
+                raise RuntimeError("send_trigger failed")
+        manager.send_trigger(0)
+
+    if 'save' in samples:
+        for i, (left, right) in enumerate(pairs[:iterations], 1):
+            exp.data_list.append({
+                'trial_num': i,
+                'total_trials': iterations,
+                'left_file': left,
+                'right_file': right,
+                'correct_answer': 1,
+                'user_response': 1,
+                'is_correct': True,
+                'latency_sec': 1.0,
+                'timestamp': datetime.now().isoformat()
+            })
+            t0 = time.perf_counter()
+            exp.save_data('SELFTEST', 0)
+            samples['save'].append(1000.0 * (time.perf_counter() - t0))
+
+    return samples
+
+
+def machine_info(exp):
+    """Host, software and device details recorded with the report."""
+    info = {
+        'host': platform.node(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+    }
+    try:
+        import psychopy
+        info['psychopy'] = psychopy.__version__
+    except Exception:
+        pass
+    try:
+        import sounddevice as sd
+        info['audio_output'] = sd.query_devices(kind='output')['name']
+    except Exception:
+        pass
+    window = exp.window
+    info['window_size'] = list(exp.display.size)
+    period = getattr(window, 'monitorFramePeriod', None)
+    if period:
+        info['frame_period_ms'] = round(1000.0 * period, 3)
+    try:
+        rate = window.getActualFrameRate()
+        if rate:
+            info['measured_frame_rate_hz'] = round(float(rate), 2)
+    except Exception:
+        pass
+    return info
+
+
+# ----------------------------------------------------------------------
+# Report
+# ----------------------------------------------------------------------
+def print_report(info, stats, checks):
+    passed = all(ok for results in checks.values() for *_, ok in results)
+    print("=" * 78)
+    print(f"Latency self-test: {info['host']} ({info.get('audio_output', 'unknown output')})")
+    print(f"{'path':<14}{'n':>5}{'first':>9}{'median':>9}{'p95':>9}{'p99':>9}{'max':>9}   limits")
+    for name in PATHS + sorted(set(stats) - set(PATHS)):
+        s = stats.get(name)
+        if not s or not s.get('n'):
+            continue
+        results = checks.get(name, [])
+        limits = ', '.join(f"{'✓' if ok else '✗'} {metric[:-3]} ≤ {limit:g}"
+                           for metric, limit, _, ok in results)
+        print(f"{name:<14}{s['n']:>5}{s['first_ms']:>9.2f}{s['median_ms']:>9.2f}{s['p95_ms']:>9.2f}"
+              f"{s['p99_ms']:>9.2f}{s['max_ms']:>9.2f}   {limits}")
+    print("-" * 78)
+    print("✓ PASS: this machine meets the timing thresholds" if passed
+          else "✗ FAIL: see the paths marked ✗ (times in ms)")
+    print("=" * 78)
+    return passed
+
+
+def save_report(out_dir, info, settings, stats, checks, passed):
+    os.makedirs(out_dir, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    path = os.path.join(out_dir, f"{info['host'] or 'machine'}_{stamp}.json")
+    report = {
+        'passed': passed,
+        'time': datetime.now().isoformat(),
+        'machine': info,
+        'settings': settings,
+        'stats': stats,
+        'checks': {name: [{'metric': m, 'limit': limit, 'value': v, 'ok': ok}
+                          for m, limit, v, ok in results]
+                   for name, results in checks.items()},
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✓ Self-test report saved: {path}")
+    return path
+
+
+# ----------------------------------------------------------------------
+# Entry point
+# ----------------------------------------------------------------------
+def _open_manager(tdt_mode, pulse_mode='auto'):
+    """Return (manager, restore) for --tdt mock/real."""
+    if tdt_mode == 'mock':
+        return MockSynapseManager(pulse_mode), lambda: None
+    if not TDT_AVAILABLE:
+        raise RuntimeError("--tdt real needs the tdt package (pip install tdt)")
+    manager = TDTSynapseManager(pulse_mode)
+    synapse = manager.synapse
+    mode = synapse.getMode()
+    if mode == SYNAPSE_IDLE:
+        print("⚠ Synapse is idle; switching to Preview for the trigger test")
+        synapse.setMode(SYNAPSE_PREVIEW)
+    return manager, lambda: synapse.setMode(mode)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=100, help='samples per path')
+    parser.add_argument('--play-iterations', type=int, default=30,
+                        help='clips played for the play overrun path')
+    parser.add_argument('--play-sec', type=float, default=0.25, help='length of each played clip')
+    parser.add_argument('--warmup', type=int, default=2,
+                        help='leading samples per path left out of the statistics')
+    parser.add_argument('--display', choices=['fullscreen', 'window'], default='fullscreen')
+    parser.add_argument('--tdt', choices=['mock', 'real'], default='mock',
+                        help='send triggers to a mock or to the running Synapse')
+    parser.add_argument('--pulse-mode', choices=['auto', 'hardware', 'software'], default='auto',
+                        help='trigger pulse mode (see synapse_client.TriggerPulser)')
+    parser.add_argument('--trigger-code', type=int, default=1)
+    parser.add_argument('--only', choices=PATHS, action='append', help='path(s) to test (default: all)')
+    parser.add_argument('--thresholds', help='JSON file overriding the default limits')
+    parser.add_argument('--out', default=os.path.join('data', 'selftest'), help='report folder')
+    parser.add_argument('--verbose', action='store_true', help='show the experiment console output')
+    args = parser.parse_args(argv)
+
+    thresholds = load_thresholds(args.thresholds)
+    paths = args.only or PATHS
+    display = FullscreenDisplay() if args.display == 'fullscreen' else Display(size=(1200, 800))
+    exp = SentenceExperiment(display, NullTriggers(), name='latency_selftest',
+                             title='Latency self-test', instructions='')
+    manager, restore_synapse = _open_manager(args.tdt, args.pulse_mode)
+    scratch = tempfile.mkdtemp(prefix='selftest_')
+    exp.data_dir = scratch
+    display.open()
+    print(f"Measuring {', '.join(paths)} ({args.iterations} iterations)...")
+    try:
+        with open(os.devnull, 'w') as devnull, \
+                contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+            samples = measure(exp, manager, args.iterations, args.play_iterations, args.play_sec,
+                              args.trigger_code, paths)
+        info = machine_info(exp)
+        info['trigger_pulse'] = manager.pulser.mode
+    finally:
+        restore_synapse()
+        display.close()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    stats = {name: summarize(values, args.warmup) for name, values in samples.items()}
+    checks = evaluate(stats, thresholds)
+    passed = print_report(info, stats, checks)
+    settings = {k: v for k, v in vars(args).items() if k not in ('out', 'verbose')}
+    settings['thresholds'] = thresholds
+    save_report(args.out, info, settings, stats, checks, passed)
+    return 0 if passed else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
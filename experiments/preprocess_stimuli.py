@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Batch stimulus preprocessing.
+
+Validates every audio file in a stimulus folder, then decodes, downmixes,
+resamples, loudness-normalises and ramps them in parallel with a process
+pool, and writes the pack the sentence experiments load at startup
+(<stimuli>/.pack/audio-*.f32 + index.json, see stimulus_bank.py).
+
+Validation covers unreadable files, sample rates, channel counts, very
+short files, and coverage against quiz.xlsx (and optionally trg_table.xlsx).
+Files without a quiz entry are silently skipped by the experiment, so they
+are listed here. A file that fails to decode is reported as an error in
+validation.csv and the pack is not written. The results go to
+validation.csv and gains.csv in the pack folder, followed by a
+throughput summary.
+
+Usage:
+    python experiments/preprocess_stimuli.py stimuli
+    python experiments/preprocess_stimuli.py stimuli --workers 8 --rms -23 --ramp-ms 5
+    python experiments/preprocess_stimuli.py stimuli --validate-only --strict
+"""
+
+import argparse
+import csv
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import soundfile as sf
+
+from stimulus_bank import DEFAULT_PACK_DIR, PackWriter, StimulusBank
+
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.flac', '.ogg')
+
+
+def inspect_file(stimuli_dir, filename):
+    """Header-level check of one file (runs in a worker)."""
+    path = os.path.join(stimuli_dir, filename)
+    row = {'filename': filename, 'ok': False, 'error': '', 'samplerate': None,
+           'channels': None, 'frames': None, 'duration_sec': None, 'subtype': None,
+           'size_bytes': os.path.getsize(path)}
+    try:
+        info = sf.info(path)
+        row.update(ok=info.frames > 0, samplerate=info.samplerate, channels=info.channels,
+                   frames=info.frames, duration_sec=round(info.duration, 4), subtype=info.subtype)
+        if info.frames <= 0:
+            row['error'] = 'empty file'
+    except Exception as e:
+        row['error'] = str(e)
+    return row
+
+
+def process_chunk(stimuli_dir, filenames, settings):
+    """Decode and normalise a chunk of files (runs in a worker).
+
+    Each chunk goes through the same vectorised StimulusBank.build() the
+    experiments use, so the pack matches an in-memory build.
+    """
+    bank = StimulusBank(stimuli_dir, filenames, verbose=False, **settings).build()
+    return [(row, bank[row['filename']]) for row in bank.table]
+
+
+def _load_names(xlsx_path, column):
+    import pandas as pd
+    return set(pd.read_excel(xlsx_path)[column].astype(str))
+
+
+def validate(rows, quiz_names=None, trigger_names=None, target_sr=44100, min_duration=0.05):
+    """Return (errors, warnings) lists of human-readable messages."""
+    errors, warnings = [], []
+    present = {r['filename'] for r in rows}
+    for r in rows:
+        name = r['filename']
+        if not r['ok']:
+            errors.append(f"{name}: unreadable ({r['error']})")
+            continue
+        if r['duration_sec'] < min_duration:
+            warnings.append(f"{name}: very short ({r['duration_sec']:.3f}s)")
+        if quiz_names is not None and name not in quiz_names:
+            warnings.append(f"{name}: no quiz entry (skipped by the experiment)")
+        if trigger_names is not None and name not in trigger_names:
+            warnings.append(f"{name}: no trigger value in trigger table")
+    for name in sorted((quiz_names or set()) - present):
+        warnings.append(f"{name}: quiz entry without audio file")
+
+    rates = sorted({r['samplerate'] for r in rows if r['ok']})
+    channels = sorted({r['channels'] for r in rows if r['ok']})
+    if rates and rates != [target_sr]:
+        print(f"  Sample rates found: {rates} (resampled to {target_sr} Hz)")
+    if channels and channels != [1]:
+        print(f"  Channel counts found: {channels} (downmixed to mono)")
+    return errors, warnings
+
+
+def write_csv(path, rows):
+    if not rows:
+        return
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('stimuli_dir', nargs='?', default='stimuli')
+    parser.add_argument('--out', help=f'pack folder (default: <stimuli_dir>/{DEFAULT_PACK_DIR})')
+    parser.add_argument('--quiz', default='quiz.xlsx', help='quiz table for coverage checks')
+    parser.add_argument('--trigger-table', help='trigger table for coverage checks (e.g. trg_table.xlsx)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--chunk', type=int, default=32, help='files per worker task')
+    parser.add_argument('--target-sr', type=int, default=44100)
+    parser.add_argument('--rms', type=float, default=-20.0, help='target RMS in dBFS')
+    parser.add_argument('--no-normalise', action='store_true', help='keep raw levels (ramps only)')
+    parser.add_argument('--peak-ceiling', type=float, default=0.99)
+    parser.add_argument('--ramp-ms', type=float, default=10.0)
+    parser.add_argument('--min-duration', type=float, default=0.05)
+    parser.add_argument('--validate-only', action='store_true')
+    parser.add_argument('--strict', action='store_true', help='treat warnings as errors')
+    args = parser.parse_args(argv)
+
+    stimuli_dir = args.stimuli_dir
+    out_dir = args.out or os.path.join(stimuli_dir, DEFAULT_PACK_DIR)
+    files = sorted(f for f in os.listdir(stimuli_dir) if f.lower().endswith(AUDIO_EXTENSIONS))
+    if not files:
+        print(f"✗ No audio files in {stimuli_dir}")
+        return 1
+    settings = {
+        'target_sr': args.target_sr,
+        'target_rms_dbfs': None if args.no_normalise else args.rms,
+        'peak_ceiling': args.peak_ceiling,
+        'ramp_ms': args.ramp_ms,
+    }
+    workers = max(1, args.workers)
+    print(f"Preprocessing {len(files)} files from {stimuli_dir} with {workers} worker(s)")
+
+    t_start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # 1. Validate headers
+        chunksize = max(1, len(files) // (workers * 4))
+        rows = list(pool.map(inspect_file, [stimuli_dir] * len(files), files, chunksize=chunksize))
+        t_validated = time.perf_counter()
+
+        quiz_names = _load_names(args.quiz, 'filename') if args.quiz and os.path.exists(args.quiz) else None
+        trigger_names = _load_names(args.trigger_table, 'filename') if args.trigger_table else None
+        errors, warnings = validate(rows, quiz_names, trigger_names, args.target_sr, args.min_duration)
+        os.makedirs(out_dir, exist_ok=True)
+        write_csv(os.path.join(out_dir, 'validation.csv'), rows)
+
+        for msg in errors:
+            print(f"✗ {msg}")
+        for msg in warnings:
+            print(f"⚠ {msg}")
+        if errors or (args.strict and warnings):
+            print(f"✗ Validation failed: {len(errors)} error(s), {len(warnings)} warning(s)")
+            return 1
+        print(f"✓ Validated {len(rows)} files ({len(warnings)} warning(s))")
+        if args.validate_only:
+            return 0
+
+        # 2. Decode/resample/normalise in parallel; write results as they arrive
+        valid = [r['filename'] for r in rows if r['ok']]
+        chunks = [valid[i:i + args.chunk] for i in range(0, len(valid), args.chunk)]
+        writer = PackWriter(out_dir, settings)
+        gain_rows = []
+        failed = {}
+        futures = {pool.submit(process_chunk, stimuli_dir, chunk, settings): chunk for chunk in chunks}
+        try:
+            while futures:
+                future = next(as_completed(futures))
+                chunk = futures.pop(future)
+                try:
+                    results = future.result()
+                except Exception as e:
+                    if len(chunk) == 1:
+                        failed[chunk[0]] = str(e) or type(e).__name__
+                    else:
+                        # Retry file by file to find the one that failed
+                        for name in chunk:
+                            futures[pool.submit(process_chunk, stimuli_dir, [name], settings)] = [name]
+                    continue
+                for row, audio in results:
+                    writer.add(os.path.join(stimuli_dir, row['filename']), audio, row)
+                    gain_rows.append(row)
+        except BaseException:
+            writer.abort()
+            raise
+        if failed:
+            writer.abort()
+            for r in rows:
+                if r['filename'] in failed:
+                    r.update(ok=False, error=f"processing failed: {failed[r['filename']]}")
+            write_csv(os.path.join(out_dir, 'validation.csv'), rows)
+            for name in sorted(failed):
+                print(f"✗ {name}: processing failed ({failed[name]})")
+            print(f"✗ Pack not written: {len(failed)} file(s) failed to process")
+            return 1
+        writer.close()
+    t_done = time.perf_counter()
+
+    gain_rows.sort(key=lambda r: r['filename'])
+    write_csv(os.path.join(out_dir, 'gains.csv'), gain_rows)
+
+    # 3. Throughput summary
+    total = t_done - t_start
+    audio_sec = sum(r['duration_sec'] for r in gain_rows)
+    source_mb = sum(r['size_bytes'] for r in rows) / 1e6
+    pack_mb = writer.total_samples * 4 / 1e6
+    print(f"✓ Pack written: {out_dir} ({len(gain_rows)} files, {pack_mb:.1f} MB)")
+    print("=" * 50)
+    print(f"Files:        {len(gain_rows)} ({source_mb:.1f} MB source, {audio_sec:.1f} s audio)")
+    print(f"Workers:      {workers}")
+    print(f"Validation:   {t_validated - t_start:.2f} s")
+    print(f"Processing:   {t_done - t_validated:.2f} s")
+    print(f"Throughput:   {len(gain_rows) / total:.1f} files/s, {source_mb / total:.1f} MB/s, "
+          f"{audio_sec / total:.0f}x real time")
+    print("=" * 50)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
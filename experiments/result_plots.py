@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Result figures shared by the experiments and the cohort report.
+
+`plot_session` draws the 2x2 summary that plot_results() shows at the end
+of a sentence session. The other functions draw the batch figures made
+by cohort_report.py: one per subject, one per stimulus and one per
+tutorial session. Everything renders with the non-interactive Agg
+backend, so it is safe to call from worker processes.
+"""
+
+import matplotlib
+matplotlib.use('Agg')  # Use non-interactive backend first
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+# Configure matplotlib for Korean font display on macOS
+# Apply BOTH matplotlib and plt rcParams for compatibility
+matplotlib.rcParams['font.sans-serif'] = ['AppleSDGothicNeo', 'AppleGothic', 'Helvetica']
+matplotlib.rcParams['axes.unicode_minus'] = False
+plt.rcParams['font.sans-serif'] = ['AppleSDGothicNeo', 'AppleGothic', 'Helvetica']
+plt.rcParams['axes.unicode_minus'] = False
+plt.rcParams['font.size'] = 11
+
+import logging
+import warnings
+warnings.filterwarnings('ignore')
+# Missing Korean fonts are reported once per glyph lookup; keep worker logs readable
+logging.getLogger('matplotlib.font_manager').setLevel(logging.ERROR)
+
+
+def _save(fig, path):
+    plt.tight_layout()
+    fig.savefig(path, dpi=150, bbox_inches='tight')
+    plt.close(fig)
+    return path
+
+
+def plot_session(df, path):
+    """2x2 summary of one sentence session (accuracy, latency, histogram, pie)."""
+    accuracy = df['is_correct'].mean() * 100
+    avg_latency = df['latency_sec'].mean()
+
+    fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(14, 10))
+
+    # 1. Accuracy over trials
+    ax1.plot(df['trial_num'], df['is_correct'].astype(int), 'go-', linewidth=2, markersize=8)
+    ax1.set_xlabel('Trial Number', fontsize=11)
+    ax1.set_ylabel('Correct (1) / Incorrect (0)', fontsize=11)
+    ax1.set_title('정확도 변화 (Accuracy Over Trials)', fontsize=12, fontweight='bold')
+    ax1.set_ylim(-0.1, 1.1)
+    ax1.grid(True, alpha=0.3)
+
+    # 2. Latency over trials
+    ax2.plot(df['trial_num'], df['latency_sec'], 'bs-', linewidth=2, markersize=8)
+    ax2.set_xlabel('Trial Number', fontsize=11)
+    ax2.set_ylabel('Latency (seconds)', fontsize=11)
+    ax2.set_title('반응 시간 변화 (Latency Over Trials)', fontsize=12, fontweight='bold')
+    ax2.grid(True, alpha=0.3)
+
+    # 3. Latency distribution histogram
+    ax3.hist(df['latency_sec'], bins=10, color='skyblue', edgecolor='black')
+    ax3.axvline(avg_latency, color='red', linestyle='--', linewidth=2, label=f'Mean: {avg_latency:.2f}s')
+    ax3.set_xlabel('Latency (seconds)', fontsize=11)
+    ax3.set_ylabel('Frequency', fontsize=11)
+    ax3.set_title('반응 시간 분포 (Latency Distribution)', fontsize=12, fontweight='bold')
+    ax3.grid(True, alpha=0.3, axis='y')
+    ax3.legend()
+
+    # 4. Accuracy summary
+    correct_count = int(df['is_correct'].sum())
+    incorrect_count = len(df) - correct_count
+    colors = ['#2ecc71', '#e74c3c']
+    sizes = [correct_count, incorrect_count]
+    labels = [f'맞음 ({correct_count})', f'틀림 ({incorrect_count})']
+
+    ax4.pie(sizes, labels=labels, colors=colors, autopct='%1.1f%%', startangle=90, textprops={'fontsize': 11})
+    ax4.set_title(f'정확도 요약 ({accuracy:.1f}%)', fontsize=12, fontweight='bold')
+
+    return _save(fig, path)
+
+
+def plot_subject(subject, sessions, path):
+    """Accuracy and mean latency per session for one subject.
+
+    Args:
+        subject: Subject ID (figure title).
+        sessions: List of (label, DataFrame) in chronological order; each
+            frame has `is_correct` and, for sentence sessions, `latency_sec`.
+        path: Output PNG path.
+    """
+    labels = [label for label, _ in sessions]
+    x = np.arange(len(sessions))
+    accuracy = [df['is_correct'].mean() * 100 if len(df) else np.nan for _, df in sessions]
+    latency = [df['latency_sec'].mean() if 'latency_sec' in df and len(df) else np.nan
+               for _, df in sessions]
+
+    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(14, 5))
+    ax1.bar(x, accuracy, color='#2ecc71', edgecolor='black')
+    ax1.set_xticks(x)
+    ax1.set_xticklabels(labels, rotation=45, ha='right', fontsize=9)
+    ax1.set_ylim(0, 105)
+    ax1.set_ylabel('Accuracy (%)', fontsize=11)
+    ax1.set_title(f'{subject}: 세션별 정확도 (Accuracy per Session)', fontsize=12, fontweight='bold')
+    ax1.grid(True, alpha=0.3, axis='y')
+
+    ax2.plot(x, latency, 'bs-', linewidth=2, markersize=8)
+    ax2.set_xticks(x)
+    ax2.set_xticklabels(labels, rotation=45, ha='right', fontsize=9)
+    ax2.set_ylabel('Mean latency (seconds)', fontsize=11)
+    ax2.set_title(f'{subject}: 세션별 반응 시간 (Latency per Session)', fontsize=12, fontweight='bold')
+    ax2.grid(True, alpha=0.3)
+
+    return _save(fig, path)
+
+
+def plot_stimulus(stimulus, df, path):
+    """Cohort accuracy and latency distribution for one stimulus (right_file)."""
+    accuracy = df['is_correct'].mean() * 100
+    by_subject = df.groupby('subject')['is_correct'].mean() * 100
+
+    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(14, 5))
+    ax1.bar(np.arange(len(by_subject)), by_subject.values, color='#3498db', edgecolor='black')
+    ax1.set_xticks(np.arange(len(by_subject)))
+    ax1.set_xticklabels(by_subject.index, rotation=45, ha='right', fontsize=9)
+    ax1.set_ylim(0, 105)
+    ax1.axhline(accuracy, color='red', linestyle='--', linewidth=2, label=f'Cohort: {accuracy:.1f}%')
+    ax1.set_ylabel('Accuracy (%)', fontsize=11)
+    ax1.set_title(f'{stimulus}: 피험자별 정확도 (n={len(df)})', fontsize=12, fontweight='bold')
+    ax1.grid(True, alpha=0.3, axis='y')
+    ax1.legend()
+
+    ax2.hist(df['latency_sec'], bins=15, color='skyblue', edgecolor='black')
+    ax2.axvline(df['latency_sec'].mean(), color='red', linestyle='--', linewidth=2,
+                label=f"Mean: {df['latency_sec'].mean():.2f}s")
+    ax2.set_xlabel('Latency (seconds)', fontsize=11)
+    ax2.set_ylabel('Frequency', fontsize=11)
+    ax2.set_title(f'{stimulus}: 반응 시간 분포', fontsize=12, fontweight='bold')
+    ax2.grid(True, alpha=0.3, axis='y')
+    ax2.legend()
+
+    return _save(fig, path)
+
+
+def plot_tutorial_session(title, df, path):
+    """Main-block accuracy and ERP onset timing of one tutorial session."""
+    main = df[df['main_trigger'].notna()] if 'main_trigger' in df else df.iloc[:0]
+    erp = df[df['onset_error_ms'].notna()] if 'onset_error_ms' in df else df.iloc[:0]
+
+    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(14, 5))
+    if len(main) and 'correct' in main:
+        correct = pd.to_numeric(main['correct'], errors='coerce')
+        ax1.plot(np.arange(1, len(main) + 1), correct, 'go-', linewidth=2, markersize=8)
+        ax1.set_title(f'Main block accuracy ({correct.mean() * 100:.1f}%)', fontsize=12, fontweight='bold')
+    else:
+        ax1.set_title('Main block (no responses recorded)', fontsize=12, fontweight='bold')
+    ax1.set_xlabel('Trial Number', fontsize=11)
+    ax1.set_ylabel('Correct (1) / Incorrect (0)', fontsize=11)
+    ax1.set_ylim(-0.1, 1.1)
+    ax1.grid(True, alpha=0.3)
+
+    if len(erp):
+        errors = pd.to_numeric(erp['onset_error_ms'], errors='coerce')
+        ax2.plot(np.arange(1, len(erp) + 1), errors, 'bs-', linewidth=2, markersize=6)
+        ax2.set_title(f'ERP onset error (mean {errors.mean():.2f} ms)', fontsize=12, fontweight='bold')
+    else:
+        ax2.set_title('ERP onset error (not recorded)', fontsize=12, fontweight='bold')
+    ax2.set_xlabel('ERP Trial', fontsize=11)
+    ax2.set_ylabel('Achieved - scheduled onset (ms)', fontsize=11)
+    ax2.grid(True, alpha=0.3)
+
+    fig.suptitle(title, fontsize=13, fontweight='bold')
+    return _save(fig, path)
@@ -0,0 +1,882 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shared core of the sentence comprehension experiments.
+
+Both entry points (sentence_comprehension.py and
+sentence_comprehension_TDT.py) are thin configurations of
+`SentenceExperiment`, which owns stimulus loading, resampling, mixing,
+playback, the quiz, data saving, plotting and the timing trace. What
+differs between them is plugged in:
+
+- a display backend (`Display`: fixed 1200x800 window with a countdown
+  during playback, or `FullscreenDisplay`: detected resolution, scaled
+  layout and a fixation cross), and
+- a trigger backend (`NullTriggers`, or TDTTriggers in
+  sentence_comprehension_TDT.py).
+
+Stimuli are reused across trials: the message and quiz TextStims are
+created once per window and only their text changes per trial. Audio is
+decoded, resampled, loudness-matched and ramped once at startup by
+`StimulusBank`; a trial only mixes two ready arrays. With
+`streaming=True` (for long passages) nothing is decoded up front: each
+trial streams blocks from the pack or the source files through
+streaming_playback.StereoStream.
+
+Playback (with its triggers) and the quiz response run as
+critical_section windows: garbage collection is held off there and done
+on the trial start screen instead.
+
+Messages go through session_log: the console and <session>_log.jsonl are
+written by a listener thread, and per-trial lines are DEBUG records.
+"""
+
+import os
+import random
+import threading
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import sounddevice as sd
+from result_plots import plot_session  # configures the Agg backend and fonts
+from session_export import export_session
+
+from psychopy import visual, event, core, gui, logging
+
+# Suppress warnings
+os.environ['OPENBLAS_NUM_THREADS'] = '1'
+import warnings
+warnings.filterwarnings('ignore')
+logging.console.setLevel(logging.WARNING)
+
+from critical_section import CRITICAL, critical
+from session_log import SESSION_LOG, get_logger
+from session_trace import TRACE, span, traced
+from stimulus_bank import DEFAULT_PACK_DIR, StimulusBank
+from streaming_playback import ArraySource, SoundFileSource, StereoStream, StreamingPlayer
+from trigger_log import TRIGGER_LOG
+
+
+TARGET_SR = 44100  # Playback sample rate
+PLAYBACK_MARGIN_SEC = 1.0  # Grace past the nominal duration before playback is stopped
+FONT = 'AppleGothic'
+QUIZ_KEYS = ['1', '2', '3', '4']
+
+log = get_logger('sentence')
+
+
+# ----------------------------------------------------------------------
+# Display backends
+# ----------------------------------------------------------------------
+class Display:
+    """Windowed display with the fixed-pixel layout of the original script.
+
+    Args:
+        size: Window size in pixels.
+        fullscr: Open the window full screen.
+    """
+
+    background = [-1, -1, -1]
+    playback_background = [-0.5, -0.5, -0.5]
+
+    def __init__(self, size=(1200, 800), fullscr=False):
+        self.size = tuple(size)
+        self.fullscr = fullscr
+        self.window = None
+        self.clock = None
+        self.scale = self.scale_y = 1.0
+        self.message_height = 30
+        self.message_wrap = 1000
+        self.quiz_wrap = 1000
+        self._message = None
+        self._quiz = None
+        self._listening = None
+
+    def open(self):
+        """Create the window and clock."""
+        with span('window init'):
+            self.window = visual.Window(
+                size=self.size,
+                color=self.background,
+                units='pix',
+                fullscr=self.fullscr
+            )
+        self.clock = core.Clock()
+        return self.window
+
+    def close(self):
+        if self.window is not None:
+            self.window.close()
+
+    def message(self, text, color):
+        """Return the shared message TextStim showing `text`."""
+        if self._message is None:
+            self._message = visual.TextStim(
+                self.window,
+                text='',
+                font=FONT,
+                height=self.message_height,
+                wrapWidth=self.message_wrap,
+                anchorHoriz='center'
+            )
+        self._message.color = color
+        self._message.text = text
+        return self._message
+
+    def quiz(self, quiz_text, options):
+        """Return the shared quiz stims (question, 4 options, instruction)."""
+        if self._quiz is None:
+            scale, scale_y = self.scale, self.scale_y
+            question = visual.TextStim(
+                self.window,
+                text='',
+                font=FONT,
+                height=int(35 * scale),
+                color=[1, 1, 1],
+                pos=(0, int(250 * scale_y)),
+                wrapWidth=self.quiz_wrap,
+                anchorHoriz='center'
+            )
+            option_stims = [
+                visual.TextStim(
+                    self.window,
+                    text='',
+                    font=FONT,
+                    height=int(28 * scale),
+                    color=[1, 1, 1],
+                    pos=(0, int(y * scale_y)),
+                    wrapWidth=self.quiz_wrap,
+                    anchorHoriz='center'
+                )
+                for y in [150, 50, -50, -150]
+            ]
+            instruction = visual.TextStim(
+                self.window,
+                text="1, 2, 3, 4 중 정답 번호를 입력하세요",
+                font=FONT,
+                height=int(24 * scale),
+                color=[1, 1, 0],
+                pos=(0, int(-280 * scale_y)),
+                anchorHoriz='center'
+            )
+            self._quiz = [question] + option_stims + [instruction]
+
+        self._quiz[0].text = f"문제: {quiz_text}"
+        for i, (stim, option) in enumerate(zip(self._quiz[1:5], options)):
+            stim.text = f"{i+1}. {option}"
+        return self._quiz
+
+    def playback_stims(self):
+        """Stims drawn while the sentences play, built once."""
+        if self._listening is None:
+            self._listening = [visual.TextStim(
+                self.window,
+                text="🎧 음원을 듣고 있습니다...",
+                font=FONT,
+                height=40,
+                color=[0, 1, 0]
+            )]
+        return self._listening
+
+    def update_playback(self, stims, remaining):
+        """Per-frame update of the playback screen (remaining seconds)."""
+        if remaining is not None:
+            stims[0].text = f"🎧 음원을 듣고 있습니다... ({remaining:.1f}초 남음)"
+
+
+class FullscreenDisplay(Display):
+    """Full-screen display scaled from a 1920x1080 reference layout."""
+
+    playback_background = [0.3, 0.3, 0.3]
+
+    def __init__(self):
+        super().__init__(size=(1920, 1080), fullscr=True)
+        self._cross = None
+
+    def open(self):
+        width, height = detect_screen_resolution()
+        log.info(f"✓ Display resolution detected: {width}x{height}")
+        log.info(f"✓ Window size set to 100% (fullscreen): {width}x{height}")
+        self.size = (width, height)
+
+        # Reference resolution: 1920x1080
+        scale_x = width / 1920
+        self.scale_y = height / 1080
+        self.scale = min(scale_x, self.scale_y)  # Use minimum to maintain aspect ratio
+        self.message_height = int(35 * self.scale)
+        self.message_wrap = int(width * 0.9)
+        self.quiz_wrap = int(width * 0.85)
+        return super().open()
+
+    def playback_stims(self):
+        """White fixation cross (two lines and a dot), built once."""
+        if self._cross is None:
+            crosshair_size = int(17 * self.scale)
+            circle_radius = int(2 * self.scale)
+            self._cross = [
+                visual.Line(self.window, start=(0, crosshair_size), end=(0, -crosshair_size),
+                            lineColor=[1, 1, 1], lineWidth=2),
+                visual.Line(self.window, start=(crosshair_size, 0), end=(-crosshair_size, 0),
+                            lineColor=[1, 1, 1], lineWidth=2),
+                visual.Circle(self.window, radius=circle_radius,
+                              fillColor=[1, 1, 1], lineColor=[1, 1, 1]),
+            ]
+        return self._cross
+
+    def update_playback(self, stims, remaining):
+        pass
+
+
+def detect_screen_resolution():
+    """Detect monitor resolution (pyglet, then screeninfo, then Quartz)."""
+    try:
+        # Try using pyglet for cross-platform display detection
+        import pyglet
+        display = pyglet.canvas.get_display()
+        screen = display.get_screens()[0]
+        width = int(screen.width)
+        height = int(screen.height)
+        log.info(f"✓ Using pyglet to detect resolution: {width}x{height}")
+        return width, height
+    except Exception as e:
+        log.warning(f"⚠ pyglet detection failed ({e}), trying alternative method...")
+
+    # Fallback: Try using screeninfo (if available)
+    try:
+        import screeninfo
+        monitors = screeninfo.get_monitors()
+        if monitors:
+            width, height = monitors[0].width, monitors[0].height
+            log.info(f"✓ Using screeninfo to detect resolution: {width}x{height}")
+            return width, height
+    except Exception as e:
+        log.warning(f"⚠ screeninfo detection failed ({e}), using default...")
+
+    # Final fallback for macOS using Quartz
+    try:
+        from Quartz import CGDisplayBounds, CGMainDisplayID
+        bounds = CGDisplayBounds(CGMainDisplayID())
+        width = int(bounds.size.width)
+        height = int(bounds.size.height)
+        log.info(f"✓ Using Quartz to detect resolution: {width}x{height}")
+        return width, height
+    except Exception as e:
+        log.warning(f"⚠ Quartz detection failed ({e}), using default resolution")
+        return 1920, 1080  # Default fallback
+
+
+# ----------------------------------------------------------------------
+# Trigger backends
+# ----------------------------------------------------------------------
+class NullTriggers:
+    """Trigger backend that sends nothing (behavioural-only sessions).
+
+    A trigger backend provides:
+        open(subject_id, session): connect/configure once the window exists.
+        status_message(): (text, color, seconds) shown before instructions, or None.
+        wait_ready(timeout): block before the first trial until recording is
+            confirmed; False if it never was.
+        trigger_for(filename): onset code for a right-channel file, or None.
+        scheduler: SampleTriggerScheduler for DAC-aligned triggers, or None.
+        audio_start(code, label, duration) / audio_stop(): immediate-mode
+            triggers sent around playback.
+        close(): stop recording and release the connection.
+    """
+
+    scheduler = None
+
+    def open(self, subject_id, session):
+        pass
+
+    def status_message(self):
+        return None
+
+    def wait_ready(self, timeout=30.0):
+        return True
+
+    def trigger_for(self, filename):
+        return None
+
+    def audio_start(self, code, label, duration):
+        pass
+
+    def audio_stop(self):
+        pass
+
+    def close(self):
+        pass
+
+
+# ----------------------------------------------------------------------
+# Experiment
+# ----------------------------------------------------------------------
+class SentenceExperiment:
+    """Sentence comprehension experiment with spatial audio.
+
+    Args:
+        display: Display backend (window, layout, playback screen).
+        triggers: Trigger backend (see NullTriggers).
+        name: Prefix of the result plot file name.
+        title: Participant dialog title.
+        instructions: Instruction screen text.
+        ready_message: Optional screen shown right after the window opens.
+        target_rms_dbfs: RMS level all stimuli are matched to (None = raw level).
+        ramp_ms: Onset/offset cosine ramp duration applied to every stimulus.
+        streaming: Stream stimuli block by block instead of holding them all
+            in memory. Uses the pack when it is current (normalised and
+            ramped); otherwise the source files are played at their own
+            rate and level.
+        gc_mode: Garbage collection in critical windows: 'disable',
+            'freeze' or 'off' (measure only); see critical_section.
+        cpu: Core to pin the main thread to during the trials (None = any).
+    """
+
+    def __init__(self, display, triggers, name, title, instructions, ready_message=None,
+                 target_rms_dbfs=-20.0, ramp_ms=10.0, streaming=False, gc_mode='disable', cpu=None):
+        self.display = display
+        self.triggers = triggers
+        self.name = name
+        self.title = title
+        self.instructions = instructions
+        self.ready_message = ready_message
+        self.streaming = streaming
+        self.gc_mode = gc_mode
+        self.cpu = cpu
+
+        self.data_list = []
+        self.data_filename = None
+        self.session_stamp = None
+        self.used_files = set()
+        self.quiz_data = {}
+        self.audio_files = []
+
+        # Setup directories
+        self.data_dir = 'data'
+        self.stimuli_dir = 'stimuli'
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+
+        # Load quiz data before window is created
+        self._load_quiz_data()
+
+        # Get available audio files
+        self._get_audio_files()
+
+        # Use the preprocess_stimuli.py pack if it is current; otherwise
+        # decode and normalise every stimulus now, not at trial time
+        bank_settings = {'target_sr': TARGET_SR, 'target_rms_dbfs': target_rms_dbfs, 'ramp_ms': ramp_ms}
+        pack_dir = os.path.join(self.stimuli_dir, DEFAULT_PACK_DIR)
+        with span('stimulus build', files=len(self.audio_files)):
+            self.stimulus_bank = StimulusBank.from_pack(
+                pack_dir, self.stimuli_dir, self.audio_files, **bank_settings
+            )
+            if self.stimulus_bank is None and not streaming:
+                self.stimulus_bank = StimulusBank(
+                    self.stimuli_dir, self.audio_files, **bank_settings
+                ).build()
+
+    @property
+    def window(self):
+        return self.display.window
+
+    @property
+    def clock(self):
+        return self.display.clock
+
+    # ------------------------------------------------------------------
+    # Stimulus bank
+    # ------------------------------------------------------------------
+    def _load_quiz_data(self):
+        """Load quiz data from Excel file."""
+        quiz_file = 'quiz.xlsx'
+        try:
+            df = pd.read_excel(quiz_file)
+            for _, row in df.iterrows():
+                filename = row['filename']
+                self.quiz_data[filename] = {
+                    'quiz': row['quiz'],
+                    'options': [row[1], row[2], row[3], row[4]],
+                    'answer': int(row['정답'])  # Load correct answer (1, 2, 3, or 4)
+                }
+            log.info(f"✓ Loaded {len(self.quiz_data)} quiz items with answers")
+        except Exception as e:
+            self.show_message(f"✗ Error loading quiz.xlsx: {str(e)}", color=[1, 0, 0])
+            core.quit()
+
+    def _get_audio_files(self):
+        """Get list of available audio files from stimuli folder."""
+        if not os.path.exists(self.stimuli_dir):
+            os.makedirs(self.stimuli_dir)
+            self.show_message(
+                f"✗ Stimuli folder is empty.\nPlace .wav files in '{self.stimuli_dir}/' folder",
+                color=[1, 0, 0]
+            )
+            core.quit()
+
+        # Get all .wav and .mp3 files that have a quiz entry
+        candidates = [f for f in os.listdir(self.stimuli_dir) if f.lower().endswith(('.wav', '.mp3'))]
+        self.audio_files = [f for f in candidates if f in self.quiz_data]
+        skipped = sorted(set(candidates) - set(self.audio_files))
+        if skipped:
+            log.warning(f"⚠ Skipping {len(skipped)} audio file(s) without a quiz entry: {', '.join(skipped)}")
+
+        if len(self.audio_files) < 2:
+            self.show_message(
+                f"✗ Need at least 2 audio files in '{self.stimuli_dir}/' folder\n"
+                f"Found: {len(self.audio_files)}",
+                color=[1, 0, 0]
+            )
+            core.quit()
+
+        random.shuffle(self.audio_files)
+        log.info(f"✓ Found {len(self.audio_files)} audio files")
+        log.info(f"  Number of trials: {len(self.audio_files) // 2}")
+
+    def select_trial_stimuli(self):
+        """Select two unused audio files for current trial."""
+        available = [f for f in self.audio_files if f not in self.used_files]
+
+        if len(available) < 2:
+            return None, None
+
+        selected = random.sample(available, 2)
+        for f in selected:
+            self.used_files.add(f)
+
+        return selected[0], selected[1]
+
+    def _open_source(self, filename):
+        """Block source for `filename`: a pack slice if loaded, else the file."""
+        bank = self.stimulus_bank
+        if bank is not None and filename in bank:
+            return ArraySource(bank[filename], bank.target_sr)
+        return SoundFileSource(os.path.join(self.stimuli_dir, filename))
+
+    def load_stereo_audio(self, left_file, right_file):
+        """Mix two prepared stimuli into a (samples, 2) left/right array.
+
+        In streaming mode this returns a primed StereoStream instead; it
+        mixes left/right block by block during playback.
+        """
+        try:
+            if self.streaming:
+                with span('stimulus open', left=left_file, right=right_file):
+                    stream = StereoStream(self._open_source(left_file), self._open_source(right_file))
+                    stream.prime()
+                return stream, stream.samplerate, right_file
+
+            with span('stimulus load', left=left_file, right=right_file):
+                left_data = self.stimulus_bank[left_file]
+                right_data = self.stimulus_bank[right_file]
+
+            with span('mix'):
+                # Pad to same length; shape is (samples, channels)
+                max_len = max(len(left_data), len(right_data))
+                stereo_data = np.zeros((max_len, 2), dtype=np.float32)
+                stereo_data[:len(left_data), 0] = left_data
+                stereo_data[:len(right_data), 1] = right_data
+
+            return stereo_data, TARGET_SR, right_file
+        except Exception as e:
+            log.error(f"✗ Error loading audio: {e}")
+            return None, None, None
+
+    # ------------------------------------------------------------------
+    # Screens
+    # ------------------------------------------------------------------
+    def show_message(self, message, color=None, duration=None, wait_key=None):
+        """Display a message for `duration` seconds, until `wait_key`, or once."""
+        if self.window is None:
+            # Window not initialized yet (startup validation path)
+            log.info(message)
+            return
+
+        if color is None:
+            color = [1, 1, 1]  # white
+
+        text_stim = self.display.message(message, color)
+        window = self.window
+        event.clearEvents()
+
+        if duration is not None:
+            start_time = self.clock.getTime()
+            while self.clock.getTime() - start_time < duration:
+                text_stim.draw()
+                window.flip()
+        elif wait_key is not None:
+            while True:
+                text_stim.draw()
+                window.flip()
+                if event.getKeys(keyList=[wait_key]):
+                    break
+        else:
+            # Just display once
+            text_stim.draw()
+            window.flip()
+
+        event.clearEvents()
+
+    def show_instructions(self):
+        """Show experiment instructions."""
+        self.show_message(self.instructions, color=[1, 1, 1], wait_key='space')
+
+    def show_trial_start(self):
+        """Show trial start screen."""
+        message = "다음 시행을 시작합니다\n\n스페이스바를 눌러주세요"
+        self.show_message(message, color=[1, 1, 1], wait_key='space')
+
+    # ------------------------------------------------------------------
+    # Playback
+    # ------------------------------------------------------------------
+    @traced('playback')
+    def play_audio(self, stereo_data, sample_rate, right_file=None):
+        """Play stereo audio with the onset/offset triggers of `right_file`."""
+        if stereo_data is None:
+            return
+
+        display = self.display
+        self.window.color = display.playback_background
+        stims = display.playback_stims()
+        duration = len(stereo_data) / sample_rate
+        trigger_value = self.triggers.trigger_for(right_file) if right_file else None
+
+        if self.triggers.scheduler is not None:
+            self._play_audio_scheduled(stereo_data, sample_rate, trigger_value, right_file, stims)
+        else:
+            self._play_audio_immediate(stereo_data, sample_rate, trigger_value, right_file,
+                                       stims, duration)
+
+        self.window.color = display.background  # Reset background
+
+    def _play_audio_immediate(self, stereo_data, sample_rate, trigger_value, right_file,
+                              stims, duration):
+        """Send START, play in a background thread while drawing, then send STOP."""
+        self.triggers.audio_start(trigger_value, right_file, duration)
+
+        if isinstance(stereo_data, StereoStream):
+            player = StreamingPlayer()
+            player.play(stereo_data)
+            wait_done = player.wait
+        else:
+            # Start playback in background thread
+            player = None
+            event_flag = threading.Event()
+            def play_thread():
+                sd.play(stereo_data, samplerate=sample_rate)
+                sd.wait()
+                event_flag.set()
+
+            thread = threading.Thread(target=play_thread, daemon=True)
+            thread.start()
+            wait_done = event_flag.wait
+
+        clock = self.clock
+        window = self.window
+        update = self.display.update_playback
+        start_time = clock.getTime()
+
+        # Flip until the nominal duration has elapsed (flip paces the loop)
+        while True:
+            elapsed = clock.getTime() - start_time
+            if elapsed >= duration:
+                break
+            update(stims, duration - elapsed)
+            for stim in stims:
+                stim.draw()
+            window.flip()
+
+        # Wait for playback to finish
+        wait_done(timeout=1.0)
+        if player is not None:
+            player.close()
+
+        self.triggers.audio_stop()
+
+    def _play_audio_scheduled(self, stereo_data, sample_rate, trigger_value, right_file, stims):
+        """Play audio with START/STOP triggers fired at the first/last sample's DAC time."""
+        triggers = [(len(stereo_data), 0)]
+        if trigger_value is not None:
+            log.debug(">>> Scheduling TDT trigger START for %s: value = %s at sample 0",
+                      right_file, trigger_value)
+            triggers.insert(0, (0, trigger_value))
+        else:
+            log.warning("⚠ No trigger value found for %s; scheduling STOP only", right_file)
+
+        scheduler = self.triggers.scheduler
+        scheduler.play(stereo_data, triggers=triggers, samplerate=sample_rate)
+
+        # Show the playback screen until the last sample (and STOP trigger) has gone out
+        window = self.window
+        clock = self.clock
+        deadline = clock.getTime() + len(stereo_data) / sample_rate + PLAYBACK_MARGIN_SEC
+        event.clearEvents()
+        while not scheduler.is_finished():
+            if event.getKeys(keyList=['escape']):
+                scheduler.stop()
+                log.warning("⚠ Playback of %s stopped with escape", right_file)
+                core.quit()
+                return
+            if clock.getTime() > deadline:
+                scheduler.stop()
+                log.warning("⚠ Playback of %s did not finish within %.1f s of its end; stopped",
+                            right_file, PLAYBACK_MARGIN_SEC)
+                break
+            for stim in stims:
+                stim.draw()
+            window.flip()
+
+        scheduler.print_report()
+
+    # ------------------------------------------------------------------
+    # Quiz
+    # ------------------------------------------------------------------
+    @traced('quiz')
+    def show_quiz(self, right_file):
+        """Show and collect quiz response with latency measurement."""
+        if right_file not in self.quiz_data:
+            return None, None, None
+
+        quiz_info = self.quiz_data[right_file]
+        correct_answer = quiz_info['answer']  # Get correct answer
+
+        with span('quiz render'):
+            stims = self.display.quiz(quiz_info['quiz'], quiz_info['options'])
+
+        # Collect response with latency measurement
+        window = self.window
+        clock = self.clock
+        event.clearEvents()
+        response = None
+        latency = None
+        response_start_time = clock.getTime()  # Start timing when quiz appears
+
+        with span('response'):
+            while response is None:
+                for stim in stims:
+                    stim.draw()
+                window.flip()
+
+                keys = event.getKeys(keyList=QUIZ_KEYS)
+                if keys:
+                    response = int(keys[0])
+                    latency = clock.getTime() - response_start_time  # Calculate latency
+
+        return response, latency, correct_answer
+
+    # ------------------------------------------------------------------
+    # Trials and session
+    # ------------------------------------------------------------------
+    def run_trial(self, trial_num, total_trials):
+        """Run a single trial."""
+        # Select stimuli
+        left_file, right_file = self.select_trial_stimuli()
+        if left_file is None:
+            return False
+
+        # Show trial start screen (the collector runs before it, not in the windows below)
+        CRITICAL.idle()
+        self.show_trial_start()
+
+        # Load stereo audio
+        stereo_data, sample_rate, _ = self.load_stereo_audio(left_file, right_file)
+        if stereo_data is None:
+            return False
+
+        # Play audio (with trigger signals based on right_file)
+        with critical('playback'):
+            self.play_audio(stereo_data, sample_rate, right_file=right_file)
+
+        # Brief pause after audio
+        core.wait(0.5)
+
+        # Show quiz and collect response
+        with critical('response'):
+            response, latency, correct_answer = self.show_quiz(right_file)
+
+        # Calculate accuracy
+        is_correct = (response == correct_answer)
+
+        # Record trial data
+        self.data_list.append({
+            'trial_num': trial_num,
+            'total_trials': total_trials,
+            'left_file': left_file,
+            'right_file': right_file,
+            'correct_answer': correct_answer,
+            'user_response': response,
+            'is_correct': is_correct,
+            'latency_sec': latency,
+            'timestamp': datetime.now().isoformat()
+        })
+
+        return True
+
+    def get_participant_info(self):
+        """Show the participant dialog; returns (subject_id, session)."""
+        with span('dialog'):
+            dlg = gui.DlgFromDict(
+                {'Subject ID': 'S001', 'Session': 1},
+                title=self.title
+            )
+
+        if not dlg.OK:
+            core.quit()
+            return None, None
+
+        try:
+            subject_id = str(dlg.data[0])
+            session = int(dlg.data[1])
+        except:
+            subject_id = str(dlg.data['Subject ID'])
+            session = int(float(dlg.data['Session']))
+        return subject_id, session
+
+    def run(self):
+        """Run the entire experiment."""
+        # Get participant info FIRST (before window initialization)
+        subject_id, session = self.get_participant_info()
+        if subject_id is None:
+            return
+
+        log.info(f"\n{'='*50}")
+        log.info("실험 참가자 정보")
+        log.info(f"{'='*50}")
+        log.info(f"Subject ID: {subject_id}")
+        log.info(f"Session: {session}")
+        log.info(f"{'='*50}\n")
+
+        # One timestamp names the CSV and every side file of this run
+        self.session_stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        TRIGGER_LOG.start(f"{self._session_base(subject_id, session)}_triggers.bin",
+                          clocks={'psychopy': core.getTime})
+        SESSION_LOG.start(f"{self._session_base(subject_id, session)}_log.jsonl")
+
+        try:
+            # NOW initialize the window and triggers
+            log.info("PsychoPy 화면 초기화 중...")
+            self.display.open()
+            self.triggers.open(subject_id, session)
+            log.info("✓ PsychoPy 화면 준비 완료\n")
+
+            if self.ready_message:
+                self.show_message(self.ready_message, color=[1, 1, 1], wait_key='space')
+
+            status = self.triggers.status_message()
+            if status is not None:
+                text, color, seconds = status
+                self.show_message(text, color=color, duration=seconds)
+
+            # Show instructions
+            self.show_instructions()
+
+            # Recording was requested when the triggers opened; the mode
+            # switch ran behind the screens above
+            if not self.triggers.wait_ready():
+                self.show_message("✗ TDT 녹화 시작을 확인하지 못했습니다\n실험을 종료합니다",
+                                  color=[1, 0, 0], duration=3)
+                return
+
+            # Calculate number of trials
+            num_trials = len(self.audio_files) // 2
+            CRITICAL.start(gc_mode=self.gc_mode, cpu=self.cpu)
+
+            # Run trials
+            trial_count = 0
+            for trial_num in range(1, num_trials + 1):
+                TRIGGER_LOG.trial = trial_num
+                with span('trial', trial=trial_num):
+                    success = self.run_trial(trial_num, num_trials)
+                if success:
+                    trial_count += 1
+                    # Save data after every trial to prevent data loss
+                    self.save_data(subject_id, session)
+                else:
+                    break
+            TRIGGER_LOG.trial = 0
+
+            # Show completion message
+            self.show_message(
+                f"✓ 실험 완료!\n총 {trial_count}/{num_trials} 시행 완료",
+                color=[0, 1, 0],
+                duration=2
+            )
+
+            # Plot results
+            self.plot_results()
+
+        finally:
+            # Close triggers and window even if an error occurs
+            self.triggers.close()
+            TRIGGER_LOG.close()
+            CRITICAL.close()
+            self.display.close()
+            if self.data_filename is not None:
+                with span('export'):
+                    export_session(self.data_filename, kind='sentence')
+            base = self._session_base(subject_id, session)
+            TRACE.save(f"{base}_trace.json")
+            if self.stimulus_bank is not None:
+                self.stimulus_bank.write_gain_table(f"{base}_gains.csv")
+            SESSION_LOG.close()
+
+    # ------------------------------------------------------------------
+    # Output
+    # ------------------------------------------------------------------
+    @traced('save')
+    def save_data(self, subject_id, session):
+        """Append the latest trial row to a single session CSV."""
+        if not self.data_list:
+            log.error("✗ No data to save")
+            return
+
+        # Create one file per run and append one trial row each time.
+        if self.data_filename is None:
+            self.data_filename = f"{self._session_base(subject_id, session)}.csv"
+
+        latest_trial_df = pd.DataFrame([self.data_list[-1]])
+        write_header = not os.path.exists(self.data_filename)
+        latest_trial_df.to_csv(
+            self.data_filename,
+            mode='a',
+            header=write_header,
+            index=False
+        )
+        log.debug("✓ Trial data appended: %s", self.data_filename)
+
+    def _session_base(self, subject_id, session):
+        """Path prefix for the session's side files (trace, gains, trigger and session logs)."""
+        if self.data_filename is not None:
+            return os.path.splitext(self.data_filename)[0]
+        timestamp = self.session_stamp or datetime.now().strftime('%Y%m%d_%H%M%S')
+        return os.path.join(self.data_dir, f"{subject_id}_session{session}_{timestamp}")
+
+    @traced('plot')
+    def plot_results(self):
+        """Plot experimental results."""
+        if not self.data_list:
+            return
+
+        df = pd.DataFrame(self.data_list)
+
+        # Calculate statistics
+        accuracy = df['is_correct'].mean() * 100
+        avg_latency = df['latency_sec'].mean()
+
+        log.info("")
+        log.info("=" * 50)
+        log.info("실험 결과 통계")
+        log.info("=" * 50)
+        log.info(f"총 시행 수: {len(df)}")
+        log.info(f"정확도: {accuracy:.1f}% ({df['is_correct'].sum()}/{len(df)})")
+        log.info(f"평균 반응 시간: {avg_latency:.2f}초")
+        log.info(f"최소 반응 시간: {df['latency_sec'].min():.2f}초")
+        log.info(f"최대 반응 시간: {df['latency_sec'].max():.2f}초")
+        log.info("=" * 50)
+        log.info("")
+
+        # Save figure
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        filename = os.path.join(self.data_dir, f"{self.name}_{timestamp}.png")
+        plot_session(df, filename)
+        log.info(f"✓ Results saved: {filename}")
@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Typed columnar copies of session data, plus a dataset catalog.
+
+CSV stays the primary, append-per-trial record. At the end of a session
+the CSV is also written as one Parquet (or Feather) file with real
+dtypes:
+
+- `is_correct` as bool
+- `latency_sec` as float32
+- stimulus file names as categoricals
+- `timestamp` as datetime64
+
+Loading thousands of sessions then skips text parsing and type
+conversion entirely. Each export is staged next to its CSV, and
+compact() (run by the CLI) merges the staged files into one
+sessions.parquet per folder, so loading does not pay a file open and
+footer per session. Every session is recorded in catalog.json in the
+same folder, with the subject, session, start time, trial count,
+accuracy and file sizes, so analyses can select sessions without
+opening them. `load_sessions()` reads a selection back as one frame.
+
+Parquet/Feather need pyarrow (or fastparquet for Parquet). Without
+either, the export is skipped with a warning and the CSV is untouched.
+
+Usage:
+    python experiments/session_export.py                 # backfill data/ and tutorial/data/
+    python experiments/session_export.py data --format feather
+    python experiments/session_export.py data --compare  # CSV vs columnar load time and size
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from session_log import get_logger
+
+CATALOG = 'catalog.json'
+CATALOG_VERSION = 1
+FORMATS = {'parquet': '.parquet', 'feather': '.feather'}
+SESSION_RE = re.compile(r'^(?P<subject>.+)_session(?P<session>[^_]+)_(?P<time>\d{8}_\d{6})\.csv$')
+# Files saved next to a session's data file: PsychoPy backups, the final
+# save and trace/gain exports. They are not sessions of their own.
+DERIVED_SUFFIXES = ('_ERP_backup', '_MAIN_backup', '_final', '_trace', '_gains')
+TUTORIAL_RE = re.compile(r'^(?P<subject>.+?)_(?P<experiment>[^_]+)_(?P<time>\d.*?)'
+                         + ''.join(f'(?<!{suffix})' for suffix in DERIVED_SUFFIXES) + r'\.csv$')
+
+log = get_logger('session_export')
+
+
+def _has(module):
+    try:
+        __import__(module)
+        return True
+    except ImportError:
+        return False
+
+
+def available_format(preferred='parquet'):
+    """Return the columnar format that can be written here, or None."""
+    arrow = _has('pyarrow')
+    if preferred == 'feather' and arrow:
+        return 'feather'
+    if arrow or _has('fastparquet'):
+        return 'parquet'
+    return None
+
+
+# ----------------------------------------------------------------------
+# Typing
+# ----------------------------------------------------------------------
+def _to_bool(series):
+    if series.dtype == bool:
+        return series
+    mapped = series.map({True: True, False: False, 'True': True, 'False': False,
+                         'true': True, 'false': False, 1: True, 0: False})
+    return mapped.astype('boolean') if mapped.isna().any() else mapped.astype(bool)
+
+
+def typed_sentence_frame(df):
+    """Sentence session rows with compact, analysis-ready dtypes."""
+    out = pd.DataFrame(index=df.index)
+    for col in ('trial_num', 'total_trials'):
+        if col in df:
+            out[col] = pd.to_numeric(df[col], downcast='integer')
+    for col in ('left_file', 'right_file'):
+        if col in df:
+            out[col] = df[col].astype('category')
+    for col in ('correct_answer', 'user_response'):
+        if col in df:
+            out[col] = pd.to_numeric(df[col], errors='coerce').astype('Int8')
+    if 'is_correct' in df:
+        out['is_correct'] = _to_bool(df['is_correct'])
+    if 'latency_sec' in df:
+        out['latency_sec'] = pd.to_numeric(df['latency_sec'], errors='coerce').astype(np.float32)
+    if 'timestamp' in df:
+        out['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
+    # Keep any columns added later, with inferred types
+    for col in df.columns:
+        if col not in out:
+            out[col] = df[col]
+    return out
+
+
+def typed_generic_frame(df, max_category_ratio=0.5):
+    """Infer compact dtypes for wide PsychoPy output (tutorial sessions)."""
+    df = df.loc[:, [c for c in df.columns if c and not str(c).startswith('Unnamed')]]
+    df = df.dropna(axis=1, how='all')
+    out = {}
+    for col in df.columns:
+        s = df[col]
+        numeric = pd.to_numeric(s, errors='coerce')
+        if s.notna().any() and numeric.notna().sum() == s.notna().sum():
+            if numeric.dropna().mod(1).eq(0).all():
+                out[col] = numeric.astype('Int32') if numeric.isna().any() else pd.to_numeric(numeric, downcast='integer')
+            else:
+                out[col] = numeric.astype(np.float32)
+        elif s.nunique(dropna=True) <= max(1, int(len(s) * max_category_ratio)):
+            out[col] = s.astype('category')
+        else:
+            out[col] = s.astype('string')
+    return pd.DataFrame(out, index=df.index)
+
+
+def read_csv(path, kind):
+    df = pd.read_csv(path, encoding='utf-8-sig')
+    return typed_sentence_frame(df) if kind == 'sentence' else typed_generic_frame(df)
+
+
+# ----------------------------------------------------------------------
+# Export + catalog
+# ----------------------------------------------------------------------
+def _session_info(filename, kind, df):
+    info = {'subject': None, 'session': None, 'started': None}
+    m = (SESSION_RE if kind == 'sentence' else TUTORIAL_RE).match(filename)
+    if m:
+        info['subject'] = m['subject']
+        info['session'] = m.groupdict().get('session')
+    if kind == 'tutorial':
+        if 'participant' in df and df['participant'].notna().any():
+            info['subject'] = str(df['participant'].dropna().iloc[0])
+        if 'session' in df and df['session'].notna().any():
+            info['session'] = str(df['session'].dropna().iloc[0])
+    if 'timestamp' in df and df['timestamp'].notna().any():
+        info['started'] = df['timestamp'].min().isoformat()
+    elif m:
+        try:
+            info['started'] = pd.to_datetime(m['time'], format='%Y%m%d_%H%M%S').isoformat()
+        except (ValueError, IndexError):
+            pass
+    return info
+
+
+def _summary(df, kind):
+    row = {'rows': int(len(df))}
+    if kind == 'sentence' and len(df):
+        row['accuracy'] = round(float(df['is_correct'].mean()), 4)
+        row['mean_latency_sec'] = round(float(df['latency_sec'].mean()), 4)
+    elif kind == 'tutorial' and 'correct' in df and df['correct'].notna().any():
+        row['accuracy'] = round(float(pd.to_numeric(df['correct'], errors='coerce').mean()), 4)
+    return row
+
+
+def load_catalog(folder):
+    path = os.path.join(folder, CATALOG)
+    try:
+        with open(path, encoding='utf-8') as f:
+            catalog = json.load(f)
+        if catalog.get('version') == CATALOG_VERSION:
+            return catalog
+    except (OSError, ValueError):
+        pass
+    return {'version': CATALOG_VERSION, 'sessions': {}, 'dataset': None}
+
+
+def save_catalog(folder, catalog):
+    path = os.path.join(folder, CATALOG)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(catalog, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def _read_columnar(path, fmt, **kwargs):
+    return pd.read_feather(path) if fmt == 'feather' else pd.read_parquet(path, **kwargs)
+
+
+def _write_columnar(df, path, fmt):
+    tmp = path + '.tmp'
+    if fmt == 'feather':
+        df.reset_index(drop=True).to_feather(tmp)
+    else:
+        df.to_parquet(tmp, index=False)
+    os.replace(tmp, path)
+
+
+def _categorize(df):
+    """Make repeated strings categorical again after concatenation."""
+    for col in df.columns:
+        if df[col].dtype == object or isinstance(df[col].dtype, pd.StringDtype) \
+                or isinstance(df[col].dtype, pd.CategoricalDtype):
+            if df[col].nunique(dropna=True) <= max(1, len(df) // 2):
+                df[col] = df[col].astype('category')
+    return df
+
+
+def export_session(csv_path, kind='sentence', fmt='parquet', catalog=None):
+    """Write the typed columnar copy of `csv_path` and catalog it.
+
+    The copy is staged next to the CSV until compact() merges it into the
+    folder's dataset file; load_sessions() reads both.
+
+    Args:
+        csv_path: Session CSV.
+        kind: 'sentence' (known schema) or 'tutorial' (inferred dtypes).
+        fmt: 'parquet' or 'feather'.
+        catalog: Catalog dict to update in place (the folder's catalog.json
+            is loaded and saved when None).
+
+    Returns:
+        Path of the columnar file, or None if no writer is available.
+    """
+    fmt = available_format(fmt)
+    if fmt is None:
+        log.warning("⚠ Columnar export skipped: install pyarrow for Parquet/Feather output")
+        return None
+    folder, filename = os.path.split(csv_path)
+    out_path = os.path.splitext(csv_path)[0] + FORMATS[fmt]
+    try:
+        df = read_csv(csv_path, kind)
+        _write_columnar(df, out_path, fmt)
+    except Exception as e:
+        log.warning(f"⚠ Columnar export failed for {csv_path}: {e}")
+        return None
+
+    own_catalog = catalog is None
+    if own_catalog:
+        catalog = load_catalog(folder)
+    st = os.stat(csv_path)
+    catalog['sessions'][filename] = dict(
+        _session_info(filename, kind, df),
+        **_summary(df, kind),
+        kind=kind,
+        file=os.path.basename(out_path),
+        format=fmt,
+        csv_bytes=st.st_size,
+        csv_mtime_ns=st.st_mtime_ns,
+        in_dataset=False,
+    )
+    if own_catalog:
+        save_catalog(folder, catalog)
+    return out_path
+
+
+def compact(folder, fmt='parquet', catalog=None):
+    """Merge staged session files into the folder's single dataset file.
+
+    One file per folder avoids per-file open and footer costs when loading
+    thousands of sessions. The staged files are removed afterwards; the
+    CSVs remain the source of truth.
+    """
+    own_catalog = catalog is None
+    if own_catalog:
+        catalog = load_catalog(folder)
+    sessions = catalog['sessions']
+    staged = {name: e for name, e in sessions.items() if not e.get('in_dataset')}
+    if not staged:
+        return None
+    frames = []
+    dataset = catalog.get('dataset')
+    if dataset and os.path.exists(os.path.join(folder, dataset['file'])):
+        old = _read_columnar(os.path.join(folder, dataset['file']), dataset['format'])
+        keep = [name for name, e in sessions.items() if e.get('in_dataset')]
+        frames.append(old[old['source'].isin(keep)])
+    for name, e in sorted(staged.items()):
+        df = _read_columnar(os.path.join(folder, e['file']), e['format'])
+        frames.append(df.assign(source=name, subject=e['subject']))
+    combined = _categorize(pd.concat(frames, ignore_index=True))
+
+    path = os.path.join(folder, 'sessions' + FORMATS[fmt])
+    _write_columnar(combined, path, fmt)
+    if dataset and dataset['file'] != os.path.basename(path):
+        os.remove(os.path.join(folder, dataset['file']))
+    catalog['dataset'] = {'file': os.path.basename(path), 'format': fmt,
+                          'bytes': os.path.getsize(path), 'rows': int(len(combined))}
+    for name, e in staged.items():
+        staged_path = os.path.join(folder, e['file'])
+        if os.path.exists(staged_path):
+            os.remove(staged_path)
+        e.update(file=None, in_dataset=True)
+    if own_catalog:
+        save_catalog(folder, catalog)
+    return path
+
+
+def backfill(folder, kind, fmt='parquet', force=False):
+    """Export every session CSV whose catalog entry is stale, then compact.
+
+    A CSV that fails to export keeps its previous catalog entry and is
+    retried on the next run.
+    """
+    pattern = SESSION_RE if kind == 'sentence' else TUTORIAL_RE
+    catalog = load_catalog(folder)
+    fmt = available_format(fmt)
+    if fmt is None:
+        log.warning("⚠ Columnar export skipped: install pyarrow for Parquet/Feather output")
+        return catalog, 0
+    exported = 0
+    present = set()
+    for filename in sorted(os.listdir(folder)):
+        if not pattern.match(filename):
+            continue
+        present.add(filename)
+        csv_path = os.path.join(folder, filename)
+        entry = catalog['sessions'].get(filename)
+        st = os.stat(csv_path)
+        if (not force and entry is not None and entry['csv_mtime_ns'] == st.st_mtime_ns
+                and entry['csv_bytes'] == st.st_size):
+            continue
+        if export_session(csv_path, kind, fmt, catalog) is None:
+            continue
+        exported += 1
+    # Sessions whose CSV was deleted leave the catalog (and the dataset)
+    for name in set(catalog['sessions']) - present:
+        del catalog['sessions'][name]
+        exported += 1
+    if exported:
+        compact(folder, fmt, catalog)
+    save_catalog(folder, catalog)
+    return catalog, exported
+
+
+def folder_kind(folder):
+    """'sentence' if the folder holds sentence session CSVs, else 'tutorial'."""
+    return 'sentence' if any(SESSION_RE.match(f) for f in os.listdir(folder)) else 'tutorial'
+
+
+def load_sessions(folder, subjects=None):
+    """Load the folder's sessions (optionally only some subjects) as one frame.
+
+    Reads the compacted dataset plus any sessions staged since. Adds
+    `source` (CSV name) and `subject` columns; repeated strings such as
+    stimulus names stay categorical.
+    """
+    catalog = load_catalog(folder)
+    frames = []
+    dataset = catalog.get('dataset')
+    if dataset and os.path.exists(os.path.join(folder, dataset['file'])):
+        kwargs = {}
+        if subjects is not None and dataset['format'] == 'parquet':
+            kwargs['filters'] = [('subject', 'in', list(subjects))]
+        df = _read_columnar(os.path.join(folder, dataset['file']), dataset['format'], **kwargs)
+        current = [name for name, e in catalog['sessions'].items() if e.get('in_dataset')]
+        frames.append(df[df['source'].isin(current)])
+    for name, e in sorted(catalog['sessions'].items()):
+        if e.get('in_dataset') or not e.get('file'):
+            continue
+        if subjects is not None and e['subject'] not in subjects:
+            continue
+        df = _read_columnar(os.path.join(folder, e['file']), e['format'])
+        frames.append(df.assign(source=name, subject=e['subject']))
+    if not frames:
+        return pd.DataFrame()
+    combined = frames[0] if len(frames) == 1 else _categorize(pd.concat(frames, ignore_index=True))
+    if subjects is not None:
+        combined = combined[combined['subject'].isin(subjects)]
+    return combined.reset_index(drop=True)
+
+
+def compare(folder, kind='sentence'):
+    """Print load time and disk usage of the CSVs vs the columnar data."""
+    catalog = load_catalog(folder)
+    entries = sorted(catalog['sessions'].items())
+    if not entries:
+        print(f"✗ No catalogued sessions in {folder}")
+        return
+    t0 = time.perf_counter()
+    for name, _ in entries:
+        read_csv(os.path.join(folder, name), kind)
+    t_csv = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    load_sessions(folder)
+    t_col = time.perf_counter() - t0
+    csv_mb = sum(e['csv_bytes'] for _, e in entries) / 1e6
+    col_bytes = (catalog.get('dataset') or {}).get('bytes', 0)
+    col_bytes += sum(os.path.getsize(os.path.join(folder, e['file'])) for _, e in entries if e.get('file'))
+    print("=" * 50)
+    print(f"Sessions:   {len(entries)} ({kind})")
+    print(f"Load CSV:   {t_csv:.3f} s (parse + type conversion)")
+    print(f"Load typed: {t_col:.3f} s ({t_csv / max(t_col, 1e-9):.0f}x faster)")
+    print(f"Disk:       {csv_mb:.2f} MB CSV, {col_bytes / 1e6:.2f} MB columnar")
+    print("=" * 50)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('folders', nargs='*', help='session folders (default: data and tutorial/data)')
+    parser.add_argument('--format', choices=sorted(FORMATS), default='parquet')
+    parser.add_argument('--force', action='store_true', help='re-export up-to-date sessions')
+    parser.add_argument('--compare', action='store_true', help='report CSV vs columnar load time and size')
+    args = parser.parse_args(argv)
+
+    if available_format(args.format) is None:
+        print("✗ No Parquet/Feather writer available (pip install pyarrow)")
+        return 1
+    folders = args.folders or ['data', os.path.join('tutorial', 'data')]
+    for folder in folders:
+        if not os.path.isdir(folder):
+            continue
+        kind = folder_kind(folder)
+        catalog, exported = backfill(folder, kind, args.format, args.force)
+        print(f"✓ {folder}: {exported} updated, {len(catalog['sessions'])} catalogued ({CATALOG})")
+        if args.compare:
+            compare(folder, kind)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
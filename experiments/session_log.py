@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Session logging through a queue, off the main thread.
+
+A synchronous print() to a Windows console can block for milliseconds
+when the buffer scrolls, which is too slow for the trigger and trial
+paths. Loggers from `get_logger()` hand each record to a QueueHandler
+that only stamps it and puts it on a queue; a QueueListener thread
+formats it and writes it to the sinks:
+
+- the console (stdout, message only, so lines look as they did), and
+- after `SESSION_LOG.start(path)`, a per-session JSON-lines file with
+  wall time, perf_counter time (the clock of the session trace and the
+  trigger log), level, logger, thread, trial and message.
+
+Levels are configuration, not code: EXPERIMENT_LOG_LEVEL sets the
+console level (default INFO) and EXPERIMENT_LOG_FILE_LEVEL the file
+level (default DEBUG), or call `SESSION_LOG.configure()`. Per-trigger
+and per-trial messages are logged at DEBUG, so by default they reach
+the file but not the console. A call below both levels returns after
+one level check. Hot paths should pass values as arguments
+(`log.debug("Trigger sent: %d", code)`); records are formatted on the
+listener thread, so the arguments must not be changed afterwards.
+
+Example:
+    from session_log import SESSION_LOG, get_logger
+
+    log = get_logger('sentence')
+    SESSION_LOG.start('data/S001_session1_20260101_120000_log.jsonl')
+    log.info("✓ Trial data appended: %s", path)
+    log.debug("Trigger sent: %d", code)
+    SESSION_LOG.close()
+
+    EXPERIMENT_LOG_LEVEL=DEBUG python sentence_comprehension_TDT.py
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+from datetime import datetime
+
+LOGGER_NAME = 'experiment'
+CONSOLE_LEVEL_ENV = 'EXPERIMENT_LOG_LEVEL'
+FILE_LEVEL_ENV = 'EXPERIMENT_LOG_FILE_LEVEL'
+
+
+def _level(value, default):
+    if value is None or value == '':
+        return default
+    if isinstance(value, int):
+        return value
+    level = logging.getLevelName(str(value).upper())
+    if not isinstance(level, int):
+        raise ValueError(f"Unknown log level: {value!r}")
+    return level
+
+
+def _env_level(name, default):
+    try:
+        return _level(os.environ.get(name), default)
+    except ValueError:
+        # A stray environment value must not stop an experiment
+        print(f"⚠ Ignoring {name}={os.environ[name]!r}: not a log level")
+        return default
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Stamps a record and enqueues it; formatting waits for the listener."""
+
+    def __init__(self, queue, owner):
+        super().__init__(queue)
+        self.owner = owner
+
+    def emit(self, record):
+        try:
+            record.perf_t = time.perf_counter()
+            source = self.owner.trial_source
+            record.trial = source.trial if source is not None else None
+            self.queue.put_nowait(record)
+        except Exception:
+            self.handleError(record)
+
+
+class _ConsoleHandler(logging.StreamHandler):
+    """StreamHandler on whatever sys.stdout is when the record is written."""
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """One JSON object per record."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='microseconds'),
+            't': getattr(record, 'perf_t', None),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'trial': getattr(record, 'trial', None),
+            'msg': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SessionLog:
+    """Queue, listener thread and sinks behind the 'experiment' loggers."""
+
+    def __init__(self):
+        self.path = None
+        self.trial_source = None   # object with a .trial attribute (TRIGGER_LOG)
+        self.queue = queue.SimpleQueue()
+        self.console = _ConsoleHandler()
+        self.console.setFormatter(logging.Formatter('%(message)s'))
+        self.file = None
+        self.file_level = logging.DEBUG
+        self.logger = logging.getLogger(LOGGER_NAME)
+        self.logger.addHandler(_QueueHandler(self.queue, self))
+        self.logger.propagate = False
+        self._listener = None
+        self.configure()
+        self._restart()
+
+    def configure(self, console=None, file=None):
+        """Set the console and file levels (names or numbers).
+
+        Unset levels come from EXPERIMENT_LOG_LEVEL and
+        EXPERIMENT_LOG_FILE_LEVEL, then INFO and DEBUG.
+        """
+        self.console.setLevel(_level(console, _env_level(CONSOLE_LEVEL_ENV, logging.INFO)))
+        self.file_level = _level(file, _env_level(FILE_LEVEL_ENV, logging.DEBUG))
+        if self.file is not None:
+            self.file.setLevel(self.file_level)
+        self._update_level()
+
+    def _update_level(self):
+        # Calls below every sink stop at the logger's level check
+        levels = [self.console.level]
+        if self.file is not None:
+            levels.append(self.file.level)
+        self.logger.setLevel(min(levels))
+
+    def _restart(self):
+        """(Re)start the listener on the current sinks; queued records are kept."""
+        self.stop()
+        handlers = [self.console] + ([self.file] if self.file is not None else [])
+        self._listener = logging.handlers.QueueListener(
+            self.queue, *handlers, respect_handler_level=True)
+        self._listener.start()
+
+    def start(self, path):
+        """Also write records to the JSON-lines file `path`."""
+        if self.file is not None:
+            self.close()
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        self.file = logging.FileHandler(path, mode='a', encoding='utf-8')
+        self.file.setFormatter(JsonLinesFormatter())
+        self.file.setLevel(self.file_level)
+        self.path = path
+        self._update_level()
+        self._restart()
+
+    def flush(self):
+        """Block until every record logged so far has been written."""
+        self._restart()
+
+    def close(self):
+        """Write what is queued and close the session file; returns its path."""
+        path, file = self.path, self.file
+        if file is None:
+            self.flush()
+            return None
+        self.file = None
+        self.path = None
+        self._update_level()
+        self._restart()   # drains the queue into the file first
+        file.close()
+        return path
+
+    def stop(self):
+        """Drain the queue and stop the listener thread."""
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
+
+# One listener per process; experiments add their session file to it
+SESSION_LOG = SessionLog()
+atexit.register(SESSION_LOG.stop)
+
+
+def get_logger(name):
+    """Logger `experiment.<name>` writing through SESSION_LOG."""
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
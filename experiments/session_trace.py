@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Per-session timing trace in Chrome trace (Perfetto) format.
+
+Every experiment phase (dialog, window init, TDT configure, stimulus load,
+resample, mix, trigger send, playback, quiz render, response, save, plot)
+is recorded as a span with a high-resolution start time, duration and the
+native ID of the thread that ran it. `save()` writes one JSON file per
+session that opens directly in chrome://tracing or https://ui.perfetto.dev,
+so the critical path of a trial is visible instead of being pieced
+together from console prints.
+
+Example:
+    from session_trace import TRACE, span, traced
+
+    @traced('save')
+    def save_data(self): ...
+
+    with span('trial', trial=3):
+        ...
+    TRACE.save('data/S001_trace.json')
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+
+from session_log import get_logger
+
+log = get_logger('session_trace')
+
+
+class _Span:
+    """Context manager recording one complete ('X') event."""
+
+    __slots__ = ('trace', 'name', 'cat', 'args', 't0')
+
+    def __init__(self, trace, name, cat, args):
+        self.trace = trace
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.t0 = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        t1 = time.perf_counter_ns()
+        if exc_type is not None:
+            self.args = dict(self.args or {}, error=exc_type.__name__)
+        self.trace._add('X', self.name, self.cat, self.t0, t1 - self.t0, self.args)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class SessionTrace:
+    """Collects spans and instant events for one session.
+
+    Args:
+        name: Process name shown in the trace viewer.
+        enabled: When False, span() returns a no-op context manager.
+    """
+
+    def __init__(self, name='session', enabled=True):
+        self.name = name
+        self.enabled = enabled
+        self.reset()
+
+    def reset(self):
+        """Drop recorded events and restart the trace clock."""
+        self._origin = time.perf_counter_ns()
+        self._events = []
+        self._threads = {}
+
+    def _add(self, ph, name, cat, t0, dur, args):
+        tid = threading.get_native_id()
+        if tid not in self._threads:
+            self._threads[tid] = threading.current_thread().name
+        # list.append is atomic, so worker threads need no lock here
+        self._events.append((ph, name, cat, t0, dur, tid, args))
+
+    def span(self, name, cat='phase', **args):
+        """Return a context manager that records `name` as a span."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, cat, args or None)
+
+    def instant(self, name, cat='event', **args):
+        """Record a zero-duration event (e.g. a trigger code on the wire)."""
+        if self.enabled:
+            self._add('i', name, cat, time.perf_counter_ns(), 0, args or None)
+
+    def events(self):
+        """Return the recorded events as Chrome trace dicts (times in µs)."""
+        pid = os.getpid()
+        origin = self._origin
+        out = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0,
+                'args': {'name': self.name}}]
+        for tid, thread_name in list(self._threads.items()):
+            out.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                        'args': {'name': thread_name}})
+        for ph, name, cat, t0, dur, tid, args in list(self._events):
+            event = {'name': name, 'cat': cat, 'ph': ph, 'pid': pid, 'tid': tid,
+                     'ts': (t0 - origin) / 1000.0}
+            if ph == 'X':
+                event['dur'] = dur / 1000.0
+            else:
+                event['s'] = 't'
+            if args:
+                event['args'] = args
+            out.append(event)
+        return out
+
+    def save(self, path):
+        """Write the trace as Chrome trace JSON; returns the path or None."""
+        if not self.enabled or not self._events:
+            return None
+        try:
+            folder = os.path.dirname(path)
+            if folder and not os.path.exists(folder):
+                os.makedirs(folder)
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump({'traceEvents': self.events(), 'displayTimeUnit': 'ms'},
+                          f, ensure_ascii=False, default=str)
+            log.info(f"✓ Timing trace saved: {path}")
+            return path
+        except Exception as e:
+            log.warning(f"⚠ Failed to save timing trace: {e}")
+            return None
+
+    def summary(self):
+        """Total and mean duration per span name in milliseconds."""
+        totals = {}
+        for ph, name, _, _, dur, _, _ in list(self._events):
+            if ph != 'X':
+                continue
+            count, total = totals.get(name, (0, 0))
+            totals[name] = (count + 1, total + dur)
+        return {name: {'count': count, 'total_ms': total / 1e6, 'mean_ms': total / 1e6 / count}
+                for name, (count, total) in totals.items()}
+
+
+# One trace per process; experiments save it at the end of each session
+TRACE = SessionTrace()
+
+
+def span(name, cat='phase', **args):
+    """Record a span on the process-wide trace."""
+    return TRACE.span(name, cat, **args)
+
+
+def traced(name, cat='phase'):
+    """Decorator recording each call of the function as a span."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not TRACE.enabled:
+                return fn(*args, **kwargs)
+            with _Span(TRACE, name, cat, None):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Stimulus bank: decode, resample, loudness-normalise and ramp every
+stimulus once, before the first trial.
+
+All files are decoded back to back into one flat float32 buffer, so RMS
+and peak are computed for the whole set in a few vectorised NumPy
+reductions, and gain and the onset/offset cosine ramps are applied in
+place on per-file views. Trials then only look up ready-to-play float32
+arrays; normalisation costs nothing at trial time. The per-file gain table can be written out as CSV for
+auditing.
+
+A bank can also be loaded from a pack written by preprocess_stimuli.py
+(`StimulusBank.from_pack`): one raw float32 file that is memory-mapped,
+plus an index.json with offsets, levels and the settings used. Each
+write goes to a new data file named in the index, so a crash while
+writing leaves the previous pack intact. Packs whose settings, data file
+length or source files (size/mtime) no longer match are ignored.
+"""
+
+import csv
+import json
+import os
+import uuid
+from math import gcd
+
+import numpy as np
+import soundfile as sf
+from scipy import signal as scipy_signal
+
+from session_log import get_logger
+
+
+DEFAULT_PACK_DIR = '.pack'  # inside the stimuli folder
+PACK_INDEX = 'index.json'
+PACK_DATA = 'audio-{}.f32'  # one name per write; index.json names the current one
+PACK_VERSION = 3  # 2: ramps clamped per file; 3: data file named in the index
+
+log = get_logger('stimulus_bank')
+
+
+def to_db(x):
+    """Amplitude to dBFS (silence maps to -inf)."""
+    with np.errstate(divide='ignore'):
+        return 20.0 * np.log10(x)
+
+
+def cosine_ramp(n):
+    """Raised-cosine onset ramp of n samples (0 → 1)."""
+    if n <= 0:
+        return np.ones(0, dtype=np.float32)
+    return (0.5 - 0.5 * np.cos(np.pi * (np.arange(n) + 0.5) / n)).astype(np.float32)
+
+
+def resample(audio, original_sr, target_sr):
+    """Polyphase resampling to `target_sr` (float32)."""
+    if original_sr == target_sr:
+        return audio.astype(np.float32, copy=False)
+    g = gcd(int(original_sr), int(target_sr))
+    out = scipy_signal.resample_poly(audio, int(target_sr) // g, int(original_sr) // g)
+    return out.astype(np.float32)
+
+
+class StimulusBank:
+    """Normalised, ramped mono stimuli at one sample rate.
+
+    Args:
+        stimuli_dir: Folder with the audio files.
+        files: File names (relative to stimuli_dir) to load.
+        target_sr: Playback sample rate.
+        target_rms_dbfs: RMS level every file is matched to; None disables
+            loudness matching (ramps are still applied).
+        peak_ceiling: Maximum absolute sample value after gain; files whose
+            peak would exceed it get a lower gain (flagged as 'limited').
+        ramp_ms: Duration of the onset and offset cosine ramps.
+        verbose: Print a one-line summary after build().
+    """
+
+    def __init__(self, stimuli_dir, files, target_sr=44100, target_rms_dbfs=-20.0,
+                 peak_ceiling=0.99, ramp_ms=10.0, verbose=True):
+        self.stimuli_dir = stimuli_dir
+        self.files = list(files)
+        self.target_sr = target_sr
+        self.target_rms_dbfs = target_rms_dbfs
+        self.peak_ceiling = peak_ceiling
+        self.ramp_ms = ramp_ms
+        self.verbose = verbose
+        self._audio = {}
+        self.table = []
+
+    def settings(self):
+        """Processing settings a pack must match to be reused."""
+        return {
+            'target_sr': self.target_sr,
+            'target_rms_dbfs': self.target_rms_dbfs,
+            'peak_ceiling': self.peak_ceiling,
+            'ramp_ms': self.ramp_ms,
+        }
+
+    def items(self):
+        return self._audio.items()
+
+    def __contains__(self, filename):
+        return filename in self._audio
+
+    def __getitem__(self, filename):
+        return self._audio[filename]
+
+    def __len__(self):
+        return len(self._audio)
+
+    def _decode(self, filename):
+        data, sr = sf.read(os.path.join(self.stimuli_dir, filename), dtype='float32')
+        if data.ndim > 1:
+            data = data.mean(axis=1)
+        return resample(data, sr, self.target_sr), sr
+
+    def build(self):
+        """Decode every file and normalise/ramp the whole set at once."""
+        decoded = [self._decode(f) for f in self.files]
+        if not decoded:
+            return self
+
+        # One flat buffer; each file is a view into it
+        lengths = np.array([len(audio) for audio, _ in decoded], dtype=np.int64)
+        flat = np.concatenate([audio for audio, _ in decoded]).astype(np.float32, copy=False)
+        bounds = np.cumsum(lengths)
+        views = np.split(flat, bounds[:-1])
+
+        # Level statistics for all files in one pass; reduceat needs the
+        # start of every non-empty file (empty files stay at 0)
+        filled = lengths > 0
+        starts = (bounds - lengths)[filled]
+        sums = np.zeros(len(decoded))
+        peak = np.zeros(len(decoded))
+        if starts.size:
+            sums[filled] = np.add.reduceat(np.square(flat, dtype=np.float64), starts)
+            peak[filled] = np.maximum.reduceat(np.abs(flat), starts)
+        rms = np.sqrt(sums / np.maximum(lengths, 1))
+
+        if self.target_rms_dbfs is None:
+            gain = np.ones(len(decoded))
+        else:
+            target = 10.0 ** (self.target_rms_dbfs / 20.0)
+            gain = np.divide(target, rms, out=np.ones_like(rms), where=rms > 0)
+        max_gain = np.divide(self.peak_ceiling, peak, out=np.full_like(peak, np.inf), where=peak > 0)
+        limited = gain > max_gain
+        gain = np.minimum(gain, max_gain)
+
+        # Onset/offset ramps, shortened to half the length of short files
+        n_ramp = int(round(self.ramp_ms * self.target_sr / 1000.0))
+        ramps = np.minimum(n_ramp, lengths // 2)
+        shapes = {}
+        for audio, g, n in zip(views, gain.astype(np.float32), ramps):
+            audio *= g
+            if n > 0:
+                ramp = shapes.get(n)
+                if ramp is None:
+                    ramp = shapes[n] = cosine_ramp(n)
+                audio[:n] *= ramp
+                audio[-n:] *= ramp[::-1]
+
+        self._audio = dict(zip(self.files, views))
+
+        rms_after = rms * gain
+        self.table = [
+            {
+                'filename': f,
+                'original_sr': sr,
+                'samples': int(lengths[i]),
+                'duration_sec': round(lengths[i] / self.target_sr, 4),
+                'rms_dbfs': round(float(to_db(rms[i])), 2),
+                'peak_dbfs': round(float(to_db(peak[i])), 2),
+                'gain_db': round(float(to_db(gain[i])), 2),
+                'rms_after_dbfs': round(float(to_db(rms_after[i])), 2),
+                'limited': bool(limited[i]),
+                'ramp_ms': round(1000.0 * int(ramps[i]) / self.target_sr, 2),
+            }
+            for i, (f, (_, sr)) in enumerate(zip(self.files, decoded))
+        ]
+        n_limited = int(limited.sum())
+        n_short = int((ramps < n_ramp).sum())
+        if self.verbose:
+            log.info(f"✓ Stimulus bank: {len(self.files)} files normalised"
+                     + (f" to {self.target_rms_dbfs:.1f} dBFS RMS" if self.target_rms_dbfs is not None else "")
+                     + f", {1000.0 * n_ramp / self.target_sr:.1f} ms ramps"
+                     + (f" ({n_short} shortened)" if n_short else "")
+                     + (f" ({n_limited} peak-limited)" if n_limited else ""))
+        return self
+
+    @classmethod
+    def from_pack(cls, pack_dir, stimuli_dir, files, **kwargs):
+        """Load `files` from a preprocessed pack; None if missing or stale."""
+        bank = cls(stimuli_dir, files, **kwargs)
+        index_path = os.path.join(pack_dir, PACK_INDEX)
+        if not os.path.exists(index_path):
+            return None
+        try:
+            with open(index_path, encoding='utf-8') as f:
+                index = json.load(f)
+            if index.get('version') != PACK_VERSION or index.get('settings') != bank.settings():
+                log.warning(f"⚠ Stimulus pack {pack_dir} was built with other settings; rebuilding in memory")
+                return None
+            data_path = os.path.join(pack_dir, index['data'])
+            if not os.path.exists(data_path) or os.path.getsize(data_path) != 4 * index['total_samples']:
+                log.warning(f"⚠ Stimulus pack {pack_dir} has no complete data file; rebuilding in memory")
+                return None
+            entries = {row['filename']: row for row in index['files']}
+            data = np.memmap(data_path, dtype=np.float32, mode='r')
+            for filename in bank.files:
+                row = entries.get(filename)
+                if row is None or not _source_matches(os.path.join(stimuli_dir, filename), row):
+                    log.warning(f"⚠ Stimulus pack {pack_dir} is stale ({filename}); rebuilding in memory")
+                    return None
+                bank._audio[filename] = data[row['offset']:row['offset'] + row['samples']]
+                bank.table.append({k: v for k, v in row.items()
+                                   if k not in ('offset', 'source_size', 'source_mtime_ns')})
+        except Exception as e:
+            log.warning(f"⚠ Could not read stimulus pack {pack_dir}: {e}")
+            return None
+        if bank.verbose:
+            log.info(f"✓ Stimulus bank: {len(bank.files)} files loaded from pack {pack_dir}")
+        return bank
+
+    def write_pack(self, pack_dir):
+        """Write the bank as a pack (audio-*.f32 + index.json) in `pack_dir`."""
+        writer = PackWriter(pack_dir, self.settings())
+        for row in self.table:
+            writer.add(os.path.join(self.stimuli_dir, row['filename']), self._audio[row['filename']], row)
+        return writer.close()
+
+    def write_gain_table(self, path):
+        """Write the per-file level/gain table as CSV; returns the path or None."""
+        if not self.table:
+            return None
+        try:
+            with open(path, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.DictWriter(f, fieldnames=list(self.table[0]))
+                writer.writeheader()
+                writer.writerows(self.table)
+            log.info(f"✓ Stimulus gain table saved: {path}")
+            return path
+        except Exception as e:
+            log.warning(f"⚠ Failed to save stimulus gain table: {e}")
+            return None
+
+
+def _source_stat(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def _source_matches(path, row):
+    try:
+        return _source_stat(path) == (row['source_size'], row['source_mtime_ns'])
+    except OSError:
+        return False
+
+
+class PackWriter:
+    """Appends processed stimuli to a pack; index.json is written on close().
+
+    Args:
+        pack_dir: Output folder (created if needed).
+        settings: StimulusBank.settings() the audio was processed with.
+    """
+
+    def __init__(self, pack_dir, settings):
+        os.makedirs(pack_dir, exist_ok=True)
+        self.pack_dir = pack_dir
+        self.settings = settings
+        self.rows = []
+        self._offset = 0
+        # A fresh name: the current index keeps pointing at the old data
+        # until close() replaces it, so a crash never leaves a half pack
+        self.data_name = PACK_DATA.format(uuid.uuid4().hex[:12])
+        self._data_path = os.path.join(pack_dir, self.data_name)
+        self._data = open(self._data_path, 'wb')
+
+    def add(self, source_path, audio, row):
+        audio = np.ascontiguousarray(audio, dtype=np.float32)
+        self._data.write(audio.tobytes())
+        size, mtime_ns = _source_stat(source_path)
+        self.rows.append(dict(row, offset=self._offset, source_size=size, source_mtime_ns=mtime_ns))
+        self._offset += len(audio)
+
+    @property
+    def total_samples(self):
+        return self._offset
+
+    def close(self):
+        self._data.close()
+        index = {
+            'version': PACK_VERSION,
+            'settings': self.settings,
+            'data': self.data_name,
+            'total_samples': self._offset,
+            'files': sorted(self.rows, key=lambda r: r['filename']),
+        }
+        index_tmp = os.path.join(self.pack_dir, PACK_INDEX + '.tmp')
+        with open(index_tmp, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False, indent=1)
+        os.replace(index_tmp, os.path.join(self.pack_dir, PACK_INDEX))
+        # Data files of earlier writes (or of crashed ones)
+        for name in os.listdir(self.pack_dir):
+            if name.startswith('audio') and '.f32' in name and name != self.data_name:
+                try:
+                    os.remove(os.path.join(self.pack_dir, name))
+                except OSError:
+                    pass  # still memory-mapped by a running experiment (Windows)
+        return self.pack_dir
+
+    def abort(self):
+        """Drop the data written so far; an existing pack stays as it was."""
+        self._data.close()
+        if os.path.exists(self._data_path):
+            os.remove(self._data_path)
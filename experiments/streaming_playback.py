@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streaming playback for long stimuli.
+
+Instead of decoding a whole file before onset, `StereoStream` reads
+fixed-size blocks from `soundfile.SoundFile` (or from a memory-mapped
+stimulus pack) on a producer thread into a ring buffer. The output
+stream callback copies from that ring buffer. Memory stays bounded by the
+ring size. Only the first few blocks are read before playback can start,
+so time-to-first-sample does not depend on file length.
+
+Two mono sources can be mixed on the fly into the left and right
+channels, or a single file can be played as-is (mono is duplicated to
+both channels).
+
+A StereoStream behaves like an (n, 2) array for SampleTriggerScheduler:
+it has len() and read_into(outdata). This lets sample-accurate triggers
+work unchanged with streamed stimuli.
+
+Example:
+    stream = StereoStream(SoundFileSource('left.wav'), SoundFileSource('right.wav'))
+    stream.prime()                 # during the ISI
+    player = StreamingPlayer()
+    player.play(stream)            # at onset
+    player.wait()
+"""
+
+import threading
+import time
+
+import numpy as np
+import soundfile as sf
+
+from critical_section import unpin_thread
+
+try:
+    import sounddevice as sd
+except Exception:
+    sd = None
+
+
+class SoundFileSource:
+    """Block reader over a soundfile.SoundFile (no full decode)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = sf.SoundFile(path)
+        self.samplerate = self._file.samplerate
+        self.channels = self._file.channels
+        self.frames = self._file.frames
+
+    def read(self, frames):
+        """Next block as a float32 (n, channels) array; empty at EOF."""
+        return self._file.read(frames, dtype='float32', always_2d=True)
+
+    def close(self):
+        self._file.close()
+
+
+class ArraySource:
+    """Block reader over an in-memory or memory-mapped array."""
+
+    def __init__(self, array, samplerate):
+        array = np.asarray(array, dtype=np.float32)
+        self._array = array[:, None] if array.ndim == 1 else array
+        self.samplerate = samplerate
+        self.channels = self._array.shape[1]
+        self.frames = len(self._array)
+        self._pos = 0
+
+    def read(self, frames):
+        block = self._array[self._pos:self._pos + frames]
+        self._pos += len(block)
+        return block
+
+    def close(self):
+        self._array = self._array[:0]
+
+
+def _mono(block):
+    return block[:, 0] if block.shape[1] == 1 else block.mean(axis=1)
+
+
+class StereoStream:
+    """Ring-buffered stereo stream fed by a producer thread.
+
+    Args:
+        left: Source for the left channel, or the only source when
+            `right` is None (played as-is; mono is duplicated).
+        right: Optional source for the right channel (downmixed to mono).
+        blocksize: Frames read from the sources per producer step.
+        buffer_blocks: Ring buffer capacity in blocks.
+        prime_blocks: Blocks read synchronously before playback starts.
+    """
+
+    def __init__(self, left, right=None, blocksize=4096, buffer_blocks=16, prime_blocks=2):
+        if right is not None and right.samplerate != left.samplerate:
+            raise ValueError(f"Sample rates differ ({left.samplerate} vs {right.samplerate} Hz); "
+                             "preprocess the stimuli to one rate first")
+        self.left = left
+        self.right = right
+        self.samplerate = left.samplerate
+        self.frames = max(left.frames, right.frames if right is not None else 0)
+        self.blocksize = blocksize
+        self.prime_blocks = min(prime_blocks, buffer_blocks)
+
+        self._ring = np.zeros((blocksize * buffer_blocks, 2), dtype=np.float32)
+        self._capacity = len(self._ring)
+        # Monotonic frame counters; one writer (producer) and one reader (callback)
+        self._written = 0
+        self._read = 0
+        self._produced = 0
+        self._space = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._primed = False
+
+        self.underruns = 0
+        self.max_fill = 0
+        self.prime_time = None
+
+    def __len__(self):
+        return self.frames
+
+    # ------------------------------------------------------------------
+    # Producer
+    # ------------------------------------------------------------------
+    def _next_block(self):
+        """Read and mix the next block into an (n, 2) array."""
+        n = min(self.blocksize, self.frames - self._produced)
+        if n <= 0:
+            return None
+        block = np.zeros((n, 2), dtype=np.float32)
+        if self.right is None:
+            data = self.left.read(n)
+            if data.shape[1] == 1:
+                block[:len(data)] = data
+            else:
+                block[:len(data)] = data[:, :2]
+        else:
+            for col, source in enumerate((self.left, self.right)):
+                data = source.read(n)
+                if len(data):
+                    block[:len(data), col] = _mono(data)
+        self._produced += n
+        return block
+
+    def _push(self, block):
+        start = self._written % self._capacity
+        n = len(block)
+        first = min(n, self._capacity - start)
+        self._ring[start:start + first] = block[:first]
+        if first < n:
+            self._ring[:n - first] = block[first:]
+        self._written += n
+        self.max_fill = max(self.max_fill, self._written - self._read)
+
+    def _fill(self, max_blocks=None):
+        """Push blocks while there is room; returns False at end of stream."""
+        pushed = 0
+        while self._capacity - (self._written - self._read) >= self.blocksize:
+            if max_blocks is not None and pushed >= max_blocks:
+                return True
+            block = self._next_block()
+            if block is None:
+                return False
+            self._push(block)
+            pushed += 1
+        return True
+
+    def prime(self):
+        """Read the first blocks synchronously (call ahead of the onset)."""
+        if not self._primed:
+            t0 = time.perf_counter()
+            self._fill(self.prime_blocks)
+            self.prime_time = time.perf_counter() - t0
+            self._primed = True
+        return self
+
+    def start(self):
+        """Prime (if needed) and start the producer thread."""
+        self.prime()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._producer, name='stream-producer', daemon=True)
+            self._thread.start()
+        return self
+
+    def _producer(self):
+        unpin_thread()
+        while not self._stop.is_set():
+            if not self._fill():
+                break
+            self._space.wait(0.05)
+            self._space.clear()
+
+    # ------------------------------------------------------------------
+    # Consumer (audio callback)
+    # ------------------------------------------------------------------
+    def read_into(self, out):
+        """Copy the next len(out) frames into `out` without blocking.
+
+        Missing frames are zero-filled; before the end of the stream that
+        counts as an underrun. Returns the number of real frames copied.
+        """
+        frames = len(out)
+        n = min(frames, self._written - self._read)
+        if n > 0:
+            start = self._read % self._capacity
+            first = min(n, self._capacity - start)
+            out[:first] = self._ring[start:start + first]
+            if first < n:
+                out[first:n] = self._ring[:n - first]
+            self._read += n
+            self._space.set()
+        out[n:] = 0
+        if n < frames and self._read < self.frames:
+            self.underruns += 1
+        return n
+
+    @property
+    def drained(self):
+        """True once every frame of the stream has been read."""
+        return self._read >= self.frames
+
+    def close(self):
+        self._stop.set()
+        self._space.set()
+        if self._thread is not None:
+            self._thread.join(1.0)
+        self.left.close()
+        if self.right is not None:
+            self.right.close()
+
+    def stats(self):
+        return {
+            'frames': self.frames,
+            'ring_frames': self._capacity,
+            'max_fill_frames': self.max_fill,
+            'underruns': self.underruns,
+            'prime_ms': None if self.prime_time is None else 1000.0 * self.prime_time,
+        }
+
+
+class StreamingPlayer:
+    """Plays a StereoStream through a sounddevice output stream.
+
+    Args:
+        blocksize: Frames per audio callback.
+        latency: Requested output latency passed to sounddevice.
+    """
+
+    def __init__(self, blocksize=256, latency='low'):
+        if sd is None:
+            raise RuntimeError("sounddevice is not available")
+        self.blocksize = blocksize
+        self.latency = latency
+        self._source = None
+        self._stream = None
+        self._finished = threading.Event()
+        self._finished.set()
+        self._t_play = None
+        self.time_to_first_sample = None
+
+    def play(self, source):
+        """Start `source` (a StereoStream) on a new output stream."""
+        self.stop()
+        self._source = source.start()
+        self._finished.clear()
+        self.time_to_first_sample = None
+        self._t_play = time.perf_counter()
+        self._stream = sd.OutputStream(
+            samplerate=source.samplerate,
+            channels=2,
+            dtype='float32',
+            blocksize=self.blocksize,
+            latency=self.latency,
+            callback=self._callback,
+            finished_callback=self._finished.set,
+        )
+        self._stream.start()
+
+    def _callback(self, outdata, frames, time_info, status):
+        self._source.read_into(outdata)
+        if self.time_to_first_sample is None:
+            self.time_to_first_sample = time.perf_counter() - self._t_play
+        if self._source.drained:
+            raise sd.CallbackStop
+
+    def is_finished(self):
+        return self._finished.is_set()
+
+    def wait(self, timeout=None):
+        return self._finished.wait(timeout)
+
+    def stop(self):
+        if self._stream is not None:
+            self._stream.abort()
+            self._stream.close()
+            self._stream = None
+        if self._source is not None:
+            self._source.close()
+            self._source = None
+        self._finished.set()
+
+    close = stop
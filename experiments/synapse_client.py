@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Keep-alive Synapse client with pipelined parameter writes.
+
+`SynapseClient` is a drop-in tdt.SynapseAPI: every method the managers
+call (getMode, setMode, setCurrentBlock, setParameterValue, ...) keeps
+its signature and return value. What changes is the transport:
+
+- One TCP connection is kept open (with TCP_NODELAY) and shared by all
+  calls; a lock keeps calls from the trigger thread and the main thread
+  from interleaving on it. If Synapse closes the connection, the next
+  call reopens it; `stats()` counts the reconnects.
+- Inside `with client.pipeline():` parameter writes are queued and sent
+  together in one write when the block ends. Their responses are read
+  back in order (HTTP/1.1 pipelining), so a trigger's IntegerValue and
+  ManualTrigger=1 cost one round trip instead of two. If the server
+  drops a pipelined request or does not answer within `timeout`, the
+  client switches to sequential sends.
+- Every call's latency is recorded per request path; `stats()` and
+  `print_stats()` summarise them.
+
+`TriggerPulser` sends trigger codes to a gizmo. In hardware mode it writes
+each code once to a strobe parameter and the RZ times the pulse; the
+software mode keeps the IntegerValue / ManualTrigger 1 / wait /
+ManualTrigger 0 sequence for gizmos without one.
+
+Example:
+    syn = SynapseClient()
+    with pipeline(syn):
+        syn.setParameterValue('TTL2Int1', 'IntegerValue', 12)
+        syn.setParameterValue('TTL2Int1', 'ManualTrigger', 1)
+    time.sleep(0.01)
+    syn.setParameterValue('TTL2Int1', 'ManualTrigger', 0)
+    syn.print_stats()
+"""
+
+import contextlib
+import http.client
+import json
+import socket
+import threading
+import time
+from collections import defaultdict
+
+from session_log import get_logger
+
+try:
+    import tdt
+    _SynapseAPI = tdt.SynapseAPI
+except ImportError:
+    tdt = None
+    _SynapseAPI = object
+
+log = get_logger('synapse')
+
+
+class _KeepAliveConnection(http.client.HTTPConnection):
+    """HTTPConnection that disables Nagle and counts (re)connects."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.connects = 0
+
+    def connect(self):
+        super().connect()
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.connects += 1
+
+
+class _SharedReader:
+    """Hands one buffered reader to several HTTPResponse objects.
+
+    HTTPResponse calls sock.makefile() and closes the file when done; a
+    private file per response would lose bytes read ahead from the next
+    pipelined response.
+    """
+
+    def __init__(self, fp):
+        self._fp = fp
+
+    def makefile(self, *args, **kwargs):
+        return self
+
+    def __getattr__(self, name):
+        return getattr(self._fp, name)
+
+    def close(self):
+        pass
+
+
+def pipeline(synapse):
+    """`synapse.pipeline()` if it supports pipelining, else a no-op context."""
+    start = getattr(synapse, 'pipeline', None)
+    return start() if start is not None else contextlib.nullcontext()
+
+
+class SynapseClient(_SynapseAPI):
+    """tdt.SynapseAPI over one kept-alive connection, with per-call timing.
+
+    Args:
+        server: Synapse server host.
+        port: Synapse server port (Synapse's default is 24414).
+        pipelining: Send the writes of a pipeline() block in one go; when
+            False they are sent one by one as the block ends.
+        timeout: Seconds to wait on a pipelined write or response before
+            falling back to sequential sends (pipeline() holds the client
+            lock, so a hung read would block every thread).
+    """
+
+    def __init__(self, server='localhost', port=24414, pipelining=True, timeout=1.0):
+        if tdt is None:
+            raise ImportError("SynapseClient needs the tdt package (pip install tdt)")
+        super().__init__(server, port)
+        self.synCon = _KeepAliveConnection(server, port)
+        self.pipelining = pipelining
+        self.timeout = timeout
+        self._lock = threading.RLock()
+        self._queue = None
+        self._queue_owner = None
+        self._samples = defaultdict(list)
+
+    # ------------------------------------------------------------------
+    # Timed, serialised requests
+    # ------------------------------------------------------------------
+    def _timed(self, key, send, *args):
+        with self._lock:
+            t0 = time.perf_counter()
+            try:
+                return send(*args)
+            finally:
+                self._samples[key].append(time.perf_counter() - t0)
+
+    def sendGet(self, reqStr, respKey=None, reqData=None):
+        return self._timed('GET ' + reqStr, super().sendGet, reqStr, respKey, reqData)
+
+    def sendOptions(self, reqStr, respKey, reqData=None):
+        return self._timed('OPTIONS ' + reqStr, super().sendOptions, reqStr, respKey, reqData)
+
+    def sendPut(self, reqStr, reqData):
+        if self._queue is not None and threading.current_thread() is self._queue_owner:
+            self._queue.append((reqStr, reqData))
+            return 1
+        return self._timed('PUT ' + reqStr, super().sendPut, reqStr, reqData)
+
+    # ------------------------------------------------------------------
+    # Pipelining
+    # ------------------------------------------------------------------
+    @contextlib.contextmanager
+    def pipeline(self):
+        """Queue the writes made in the block and send them together at its end.
+
+        Writes return 1 immediately; Synapse errors are printed when the
+        responses are read, as sendPut does.
+        """
+        if self._queue is not None:
+            yield self  # nested: the outer block sends everything
+            return
+        with self._lock:
+            self._queue, self._queue_owner = [], threading.current_thread()
+            try:
+                yield self
+            finally:
+                queue, self._queue = self._queue, None
+                self._flush(queue)
+
+    def _flush(self, queue):
+        if not self.pipelining or len(queue) < 2:
+            for reqStr, reqData in queue:
+                self.sendPut(reqStr, reqData)
+            return
+        t0 = time.perf_counter()
+        done = 0
+        try:
+            for _ in self._send_pipelined(queue):
+                done += 1
+        except (socket.timeout, OSError, http.client.HTTPException) as e:
+            log.warning("⚠ Synapse pipelining failed (%s); sending requests one by one", type(e).__name__)
+            self.pipelining = False
+            self.synCon.close()
+            for reqStr, reqData in queue[done:]:
+                self.sendPut(reqStr, reqData)
+            return
+        key = 'PUT pipeline ' + ' + '.join(reqStr.rsplit('.', 1)[-1] for reqStr, _ in queue)
+        self._samples[key].append(time.perf_counter() - t0)
+
+    def _send_pipelined(self, queue):
+        """Write all requests at once, then yield each response's result."""
+        conn = self.synCon
+        if conn.sock is None:
+            conn.connect()
+        host = f"{conn.host}:{conn.port}"
+        payload = []
+        for reqStr, reqData in queue:
+            body = (reqData or '').encode('utf-8')
+            payload.append(
+                f"PUT {reqStr} HTTP/1.1\r\nHost: {host}\r\nAccept-Encoding: identity\r\n"
+                f"Content-type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode('latin-1')
+                + body
+            )
+        sock = conn.sock
+        previous_timeout = sock.gettimeout()
+        sock.settimeout(self.timeout)
+        reader = None
+        try:
+            sock.sendall(b''.join(payload))
+            reader = _SharedReader(sock.makefile('rb'))
+            for i, (reqStr, reqData) in enumerate(queue, 1):
+                resp = http.client.HTTPResponse(reader, method='PUT')
+                resp.begin()
+                body = resp.read()
+                self.lastReqStr, self.lastReqData = reqStr, repr(reqData)
+                yield self._check(resp.status, body)
+                if resp.will_close:
+                    conn.close()
+                    if i < len(queue):
+                        raise http.client.RemoteDisconnected('Synapse closed a pipelined connection')
+        finally:
+            if reader is not None:
+                reader._fp.close()
+            if sock.fileno() != -1:
+                sock.settimeout(previous_timeout)
+
+    def _check(self, status, body):
+        """sendPut's return value for one response, printing Synapse errors."""
+        retval = None
+        if status == 200:
+            try:
+                retval = json.loads(body.decode('utf-8'))
+                if '_return_code_' in retval:
+                    status = retval['_return_code_']
+            except Exception:
+                status = 404
+        if status != 200:
+            log.error('Error received from Synapse')
+            if retval is not None and len(retval.get('_return_msg_', '')) > 0:
+                log.error(' %s %s %s', self.lastReqData, retval['_return_code_'],
+                          self.formatErrorMsg(retval['_return_msg_']))
+            return 0
+        return 0 if retval == '' else 1
+
+    # ------------------------------------------------------------------
+    # Statistics
+    # ------------------------------------------------------------------
+    def stats(self):
+        """Per-request latency ({path: calls, mean/p95/max ms}) and connects."""
+        out = {}
+        for key, values in list(self._samples.items()):
+            ordered = sorted(values)
+            out[key] = {
+                'calls': len(values),
+                'mean_ms': round(1000.0 * sum(values) / len(values), 3),
+                'p95_ms': round(1000.0 * ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))], 3),
+                'max_ms': round(1000.0 * ordered[-1], 3),
+            }
+        return {'connects': self.synCon.connects, 'requests': out}
+
+    def print_stats(self):
+        stats = self.stats()
+        if not stats['requests']:
+            return
+        log.info(f"Synapse RPC latency ({stats['connects']} connection(s)):")
+        for key, s in sorted(stats['requests'].items(), key=lambda item: -item[1]['calls']):
+            log.info(f"  {key:<48}{s['calls']:>6} calls  mean {s['mean_ms']:7.2f} ms"
+                     f"  p95 {s['p95_ms']:7.2f} ms  max {s['max_ms']:7.2f} ms")
+
+
+class TriggerPulser:
+    """Sends trigger codes to one Synapse gizmo as pulses.
+
+    'hardware' writes the code once to `strobe_param`, a gizmo parameter
+    that latches the code and fires the gizmo's own strobe (pulse width
+    set on the gizmo in Synapse). One RPC, no wait on the caller's
+    thread; only a trigger following the previous one within
+    `pulse_sec` waits for that pulse to end. 'software' writes
+    IntegerValue and ManualTrigger=1, waits `pulse_sec` and writes
+    ManualTrigger=0, so the pulse width includes RPC latency. 'auto'
+    uses hardware when the gizmo lists `strobe_param`.
+
+    send() is called from the main, helper and recording threads; a lock
+    keeps pulses from overlapping, wait included.
+
+    Args:
+        synapse: SynapseClient (or any SynapseAPI-like object).
+        gizmo: Trigger gizmo name.
+        mode: 'auto', 'hardware' or 'software'.
+        strobe_param: Strobe parameter of the gizmo for hardware mode.
+        pulse_sec: Software pulse width; minimum spacing in hardware mode.
+    """
+
+    def __init__(self, synapse, gizmo='TTL2Int1', mode='auto', strobe_param='StrobeValue',
+                 pulse_sec=0.01):
+        if mode not in ('auto', 'hardware', 'software'):
+            raise ValueError(f"Unknown pulse mode: {mode!r}")
+        self.synapse = synapse
+        self.gizmo = gizmo
+        self.strobe_param = strobe_param
+        self.pulse_sec = pulse_sec
+        self._last = None
+        self._lock = threading.Lock()
+        if mode == 'auto':
+            mode = 'hardware' if self._has_strobe() else 'software'
+        self.mode = mode
+
+    def _has_strobe(self):
+        try:
+            return self.strobe_param in (self.synapse.getParameterNames(self.gizmo) or [])
+        except Exception:
+            return False
+
+    def send(self, code, wait_fn=time.sleep):
+        """Pulse `code`; `wait_fn` waits out the pulse (e.g. core.wait on the main thread).
+
+        Returns:
+            perf_counter time at which Synapse acknowledged the write that
+            starts the pulse.
+        """
+        syn = self.synapse
+        with self._lock:
+            if self.mode == 'hardware':
+                if self._last is not None:
+                    remaining = self.pulse_sec - (time.perf_counter() - self._last)
+                    if remaining > 0:
+                        wait_fn(remaining)
+                syn.setParameterValue(self.gizmo, self.strobe_param, int(code))
+                self._last = time.perf_counter()
+                return self._last
+            # Value and rising edge go out together in one round trip
+            with pipeline(syn):
+                syn.setParameterValue(self.gizmo, 'IntegerValue', int(code))
+                syn.setParameterValue(self.gizmo, 'ManualTrigger', 1)
+            acked = time.perf_counter()
+            wait_fn(self.pulse_sec)
+            syn.setParameterValue(self.gizmo, 'ManualTrigger', 0)
+            return acked
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Synapse session setup that only changes what differs.
+
+Setting the user, experiment or subject makes Synapse reload parts of
+the project, even when the value is already current. `configure_synapse`
+reads the current state once (mode, user, experiment, subject, block),
+then issues only the calls whose values differ. Known subjects are
+reused instead of created again, and Idle mode is entered only when
+something has to change. Each step is timed (and traced as a 'tdt'
+span), and `print_setup_report` shows what was set, what was skipped
+and the total setup time. Back-to-back sessions on one rig then only
+set the new block name.
+
+Switching to Record can take seconds. `RecordingLifecycle` does it on a
+background thread, polling getMode() until the rig reports Record, so
+the switch runs while instructions are on screen; the first trial calls
+wait() to gate on the confirmation (with a timeout).
+
+Example:
+    steps = configure_synapse(syn, user='Psychopy', experiment='SentenceComp',
+                              subject='S001', block='S001_S1_20260101_120000',
+                              subject_desc='Session_1', subject_icon='Human',
+                              record=True)
+    print_setup_report(steps)
+
+    recording = RecordingLifecycle(syn)
+    recording.arm()                 # returns at once
+    show_instructions()
+    if not recording.wait(timeout=30.0):
+        ...                         # Synapse never reported Record
+"""
+
+import threading
+import time
+
+from session_log import get_logger
+from session_trace import span
+
+IDLE, RECORD = 0, 3
+
+log = get_logger('synapse')
+
+
+def _read_state(synapse):
+    return {
+        'mode': synapse.getMode(),
+        'user': synapse.getCurrentUser(),
+        'experiment': synapse.getCurrentExperiment(),
+        'subject': synapse.getCurrentSubject(),
+        'block': synapse.getCurrentBlock(),
+        'tank': synapse.getCurrentTank(),
+    }
+
+
+def configure_synapse(synapse, user, experiment, subject, block, subject_desc='',
+                      subject_icon='mouse', record=False):
+    """Bring Synapse to the wanted user/experiment/subject/block.
+
+    Args:
+        synapse: SynapseAPI-like object.
+        user, experiment, subject, block: Wanted values.
+        subject_desc, subject_icon: Used when `subject` has to be created.
+        record: Switch to Record mode at the end.
+
+    Returns:
+        List of step dicts {'step', 'action', 'ms', 'value'}; action is
+        'read', 'set' or 'skip'.
+    """
+    steps = []
+
+    def step(name, value, call=None, *args, action='set'):
+        t0 = time.perf_counter()
+        result = None
+        if call is not None:
+            with span(f'tdt {name}', cat='tdt'):
+                result = call(*args)
+        steps.append({'step': name, 'action': action if call is not None else 'skip',
+                      'ms': 1000.0 * (time.perf_counter() - t0), 'value': value})
+        return result
+
+    state = step('read state', None, _read_state, synapse, action='read')
+    steps[-1]['value'] = f"tank {state['tank']}"
+
+    changes = (state['user'] != user or state['experiment'] != experiment
+               or state['subject'] != subject or state['block'] != block)
+    if changes and state['mode'] != IDLE:
+        step('mode idle', IDLE, synapse.setMode, IDLE)
+        state['mode'] = IDLE
+    else:
+        step('mode idle', IDLE)
+
+    if state['user'] != user:
+        step('user', user, synapse.setCurrentUser, user)
+    else:
+        step('user', user)
+    if state['experiment'] != experiment:
+        step('experiment', experiment, synapse.setCurrentExperiment, experiment)
+        # Loading another experiment can change the current subject
+        state['subject'] = step('read subject', None, synapse.getCurrentSubject, action='read')
+    else:
+        step('experiment', experiment)
+
+    if state['subject'] != subject:
+        known = step('read subjects', None, synapse.getKnownSubjects, action='read') or []
+        if subject not in known:
+            step('create subject', subject, synapse.createSubject, subject, subject_desc, subject_icon)
+        step('subject', subject, synapse.setCurrentSubject, subject)
+    else:
+        step('subject', subject)
+
+    if state['block'] != block:
+        step('block', block, synapse.setCurrentBlock, block)
+    else:
+        step('block', block)
+    if record and state['mode'] != RECORD:
+        step('mode record', RECORD, synapse.setMode, RECORD)
+    elif record:
+        step('mode record', RECORD)
+    return steps
+
+
+def print_setup_report(steps):
+    """Print each step (set/skip, ms) and the total setup time."""
+    total = sum(s['ms'] for s in steps)
+    done = sum(1 for s in steps if s['action'] != 'skip')
+    skipped = sum(1 for s in steps if s['action'] == 'skip')
+    for s in steps:
+        mark = {'set': '✓', 'read': '→', 'skip': '·'}[s['action']]
+        value = '' if s['value'] is None else f" ({s['value']})"
+        log.info(f"  {mark} {s['step']:<15}{s['action']:<6}{s['ms']:8.1f} ms{value}")
+    log.info(f"✓ TDT setup in {total:.1f} ms ({done} steps, {skipped} unchanged and skipped)")
+
+
+class RecordingLifecycle:
+    """Switches Synapse to Record in the background and confirms it.
+
+    Args:
+        synapse: SynapseAPI-like object (SynapseClient serialises the
+            background calls with the main thread's triggers).
+        poll_interval: Seconds between getMode() polls while switching.
+    """
+
+    def __init__(self, synapse, poll_interval=0.05):
+        self.synapse = synapse
+        self.poll_interval = poll_interval
+        self.error = None
+        self.switch_sec = None   # arm() to confirmed Record
+        self.gate_sec = None     # time wait() actually blocked
+        self._confirmed = threading.Event()
+        self._cancel = threading.Event()
+        self._thread = None
+        self._on_confirmed = None
+        self._t_arm = None
+
+    @property
+    def armed(self):
+        return self._thread is not None
+
+    @property
+    def confirmed(self):
+        return self._confirmed.is_set()
+
+    def arm(self, on_confirmed=None):
+        """Start switching to Record; `on_confirmed` runs on the worker once confirmed,
+        before wait() returns."""
+        if self._thread is not None:
+            return
+        self._on_confirmed = on_confirmed
+        self._t_arm = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name='synapse-record', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            with span('tdt record switch', cat='tdt'):
+                if self.synapse.getMode() != RECORD:
+                    self.synapse.setMode(RECORD)
+                while self.synapse.getMode() != RECORD:
+                    if self._cancel.wait(self.poll_interval):
+                        return
+            self.switch_sec = time.perf_counter() - self._t_arm
+            log.info("✓ TDT recording confirmed %.2f s after arming", self.switch_sec)
+            # Runs before the gate opens, so e.g. a start trigger precedes trial triggers
+            if self._on_confirmed is not None:
+                self._on_confirmed()
+            self._confirmed.set()
+        except Exception as e:
+            self.error = e
+            log.warning("⚠ TDT switch to Record failed: %s", e)
+
+    def wait(self, timeout=30.0):
+        """Block until Record is confirmed; False on timeout, failure or if not armed."""
+        if self._thread is None:
+            return False
+        t0 = time.perf_counter()
+        with span('tdt record gate', cat='tdt'):
+            deadline = t0 + timeout
+            while not self._confirmed.wait(0.05):
+                if self.error is not None or not self._thread.is_alive() \
+                        or time.perf_counter() >= deadline:
+                    break
+        self.gate_sec = time.perf_counter() - t0
+        if not self.confirmed:
+            log.error("✗ TDT did not confirm Record mode within %g s", timeout)
+        elif self.gate_sec >= 0.001:
+            log.info("  Waited %.0f ms for Record at the first trial", 1000.0 * self.gate_sec)
+        return self.confirmed
+
+    def stop(self, mode=IDLE):
+        """Cancel a pending switch and put Synapse in `mode` (Idle)."""
+        self._cancel.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+        self.synapse.setMode(mode)
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Session-wide trigger event log.
+
+Every trigger code that goes to the rig is recorded as one fixed-size
+binary record:
+
+    code, trial_num, requested_t, sent_t, ack_t, audio_t, source
+
+requested_t is when the code was due (the DAC time of its sample for
+audio-scheduled triggers, otherwise the moment send_trigger was called),
+sent_t when the first RPC started and ack_t when Synapse acknowledged the
+write that starts the pulse (NaN if the send failed). All three are time.perf_counter() seconds, the
+same monotonic clock as the session trace; the offsets of other clocks
+(PsychoPy's core.getTime) are sampled when the log starts and stored in
+the header. audio_t is the DAC time on the sounddevice stream clock for
+scheduled triggers and NaN otherwise.
+
+`TRIGGER_LOG.log()` only puts a tuple on a queue, so it never blocks the
+frame loop or the audio helper thread; a writer thread appends the
+records to `<session>_triggers.bin` in batches. Up to `max_backlog`
+records logged while no file is open (before start(), after close())
+are kept and written once the file is known; later ones are dropped
+and counted. Trigger senders
+call `TRIGGER_LOG.log()`; code that knows more about a send than the
+sender does (the audio scheduler) wraps it in `trigger_context()`.
+Callables in `TRIGGER_LOG.listeners` get every record as it is logged,
+on the sender's thread (e.g. erp_monitor.TriggerPublisher), so they must
+not block.
+
+`load_trigger_log()` reads a file back as a numpy structured array with
+one np.fromfile call (a record cut short by a crash is dropped), and
+`to_frame()` turns it into a DataFrame.
+
+Example:
+    TRIGGER_LOG.start('data/S001_session1_20260101_120000_triggers.bin',
+                      clocks={'psychopy': core.getTime})
+    TRIGGER_LOG.trial = 3
+    ...
+    TRIGGER_LOG.close()
+
+    records = load_trigger_log('data/S001_session1_20260101_120000_triggers.bin')
+    dispatch_ms = 1000.0 * (records['sent_t'] - records['requested_t'])
+
+Command line:
+    python trigger_log.py data/S001_..._triggers.bin [--csv out.csv]
+"""
+
+import argparse
+import json
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from session_log import SESSION_LOG, get_logger
+
+MAGIC = b'TRIGLOG1'
+
+RECORD_DTYPE = np.dtype([
+    ('code', '<i4'),
+    ('trial_num', '<i4'),
+    ('requested_t', '<f8'),
+    ('sent_t', '<f8'),
+    ('ack_t', '<f8'),
+    ('audio_t', '<f8'),
+    ('source', 'S16'),
+])
+
+_NAN = float('nan')
+logger = get_logger('trigger_log')
+_context = threading.local()
+
+
+class trigger_context:
+    """Annotates the triggers sent inside the block on this thread.
+
+    Args:
+        requested_t: perf_counter time at which the trigger was due.
+        audio_t: Due time on the audio stream clock.
+        source: Source name recorded instead of the thread's.
+    """
+
+    def __init__(self, requested_t=None, audio_t=None, source=None):
+        self.values = (requested_t, audio_t, source)
+
+    def __enter__(self):
+        self._outer = getattr(_context, 'values', None)
+        _context.values = self.values
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _context.values = self._outer
+        return False
+
+
+def _source_name():
+    name = threading.current_thread().name
+    return 'main' if name == 'MainThread' else name
+
+
+class TriggerLog:
+    """Non-blocking writer of trigger records.
+
+    Args:
+        flush_interval: Seconds the writer waits before writing what has
+            been queued so far.
+        max_backlog: Records kept while no log file is open.
+    """
+
+    def __init__(self, flush_interval=0.2, max_backlog=4096):
+        self.flush_interval = flush_interval
+        self.max_backlog = max_backlog
+        self.trial = 0
+        self.path = None
+        self.count = 0
+        self.dropped = 0
+        self.listeners = []
+        self._queue = queue.SimpleQueue()
+        self._backlog = 0
+        self._thread = None
+
+    def log(self, code, requested_t, sent_t, ack_t, source=None, audio_t=None, trial_num=None):
+        """Queue one record; context values set by trigger_context() take precedence."""
+        values = getattr(_context, 'values', None)
+        if values is not None:
+            requested_t = values[0] if values[0] is not None else requested_t
+            audio_t = values[1] if values[1] is not None else audio_t
+            source = values[2] or source
+        record = (
+            int(code),
+            self.trial if trial_num is None else int(trial_num),
+            requested_t,
+            sent_t,
+            _NAN if ack_t is None else ack_t,
+            _NAN if audio_t is None else audio_t,
+            (source or _source_name()).encode('ascii', 'replace')[:16],
+        )
+        if self._thread is not None:
+            self._queue.put(record)
+        elif self._backlog < self.max_backlog:
+            self._backlog += 1
+            self._queue.put(record)
+        else:
+            self.dropped += 1
+        for listener in self.listeners:
+            listener(record)
+
+    def start(self, path, clocks=None):
+        """Open `path` and start the writer thread.
+
+        Args:
+            path: Output file (usually '<session base>_triggers.bin').
+            clocks: Optional {name: callable} of other clocks; the offset
+                `clock() - perf_counter()` of each is stored in the header.
+        """
+        if self._thread is not None:
+            self.close()
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        offsets = {}
+        for name, clock in (clocks or {}).items():
+            t0 = time.perf_counter()
+            value = clock()
+            offsets[name] = value - (t0 + time.perf_counter()) / 2.0
+        header = json.dumps({
+            'dtype': RECORD_DTYPE.descr,
+            'clock': 'perf_counter',
+            'clock_offsets': offsets,
+            'created': datetime.now().isoformat(),
+            'perf_counter_at_created': time.perf_counter(),
+        }).encode('utf-8')
+        f = open(path, 'wb')
+        f.write(MAGIC + struct.pack('<I', len(header)) + header)
+        f.flush()
+        self.path = path
+        self.count = 0
+        if self.dropped:
+            logger.warning("⚠ Trigger log: %d trigger(s) sent before the log was started were not kept",
+                           self.dropped)
+            self.dropped = 0
+        self._backlog = 0
+        self._thread = threading.Thread(target=self._run, args=(f,), name='trigger-log', daemon=True)
+        self._thread.start()
+
+    def _run(self, f):
+        try:
+            while True:
+                try:
+                    rows = [self._queue.get(timeout=self.flush_interval)]
+                except queue.Empty:
+                    continue
+                while True:
+                    try:
+                        rows.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                stop = any(row is None for row in rows)
+                rows = [row for row in rows if row is not None]
+                if rows:
+                    f.write(np.array(rows, dtype=RECORD_DTYPE).tobytes())
+                    f.flush()
+                    self.count += len(rows)
+                if stop:
+                    return
+        except Exception as e:
+            logger.warning("⚠ Trigger log writer stopped: %s", e)
+        finally:
+            f.close()
+
+    def close(self):
+        """Write the remaining records and close the file; returns its path.
+
+        A log that received no records is deleted and None is returned.
+        """
+        if self._thread is None:
+            return None
+        self._queue.put(None)
+        self._thread.join(timeout=5.0)
+        self._thread = None
+        self.trial = 0
+        if self.count == 0:
+            # Sessions without a trigger backend leave no empty file behind
+            os.remove(self.path)
+            return None
+        logger.info("✓ Trigger log saved: %s (%d triggers)", self.path, self.count)
+        return self.path
+
+
+def read_header(path):
+    """Return (header dict, offset of the first record)."""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"Not a trigger log: {path}")
+        (length,) = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(length).decode('utf-8'))
+    return header, len(MAGIC) + 4 + length
+
+
+def load_trigger_log(path):
+    """Read a trigger log as a structured array of RECORD_DTYPE."""
+    header, offset = read_header(path)
+    dtype = np.dtype([(name, fmt) for name, fmt in header['dtype']])
+    count = (os.path.getsize(path) - offset) // dtype.itemsize
+    return np.fromfile(path, dtype=dtype, count=count, offset=offset)
+
+
+def to_frame(records):
+    """DataFrame of the records with source decoded and latencies in ms."""
+    import pandas as pd
+    df = pd.DataFrame({name: records[name] for name in records.dtype.names})
+    df['source'] = df['source'].str.decode('ascii')
+    df['dispatch_ms'] = 1000.0 * (df['sent_t'] - df['requested_t'])
+    df['rpc_ms'] = 1000.0 * (df['ack_t'] - df['sent_t'])
+    return df
+
+
+def summarize(records):
+    """Dispatch (sent - requested) and RPC (ack - sent) latency per source in ms."""
+    out = {}
+    for source in np.unique(records['source']):
+        rows = records[records['source'] == source]
+        dispatch = 1000.0 * (rows['sent_t'] - rows['requested_t'])
+        rpc = 1000.0 * (rows['ack_t'] - rows['sent_t'])
+        failed = int(np.isnan(rpc).sum())
+        rpc = rpc[~np.isnan(rpc)]
+        entry = {'count': len(rows), 'failed': failed,
+                 'dispatch_mean_ms': float(np.mean(dispatch)),
+                 'dispatch_max_ms': float(np.max(dispatch))}
+        if len(rpc):
+            entry.update(rpc_mean_ms=float(np.mean(rpc)),
+                         rpc_p95_ms=float(np.percentile(rpc, 95)),
+                         rpc_max_ms=float(np.max(rpc)))
+        out[source.decode('ascii')] = entry
+    return out
+
+
+def print_summary(records, label='Triggers'):
+    summary = summarize(records)
+    print(f"{label}: {len(records)} records")
+    for source, s in summary.items():
+        rpc = (f"rpc mean {s['rpc_mean_ms']:.2f} / p95 {s['rpc_p95_ms']:.2f} / max {s['rpc_max_ms']:.2f} ms"
+               if 'rpc_mean_ms' in s else "no acknowledged sends")
+        failed = f", {s['failed']} failed" if s['failed'] else ""
+        print(f"  {source:<16}{s['count']:>6} sent{failed} | dispatch mean "
+              f"{s['dispatch_mean_ms']:.2f} / max {s['dispatch_max_ms']:.2f} ms | {rpc}")
+    return summary
+
+
+# One log per process; experiments start it with the session's files
+TRIGGER_LOG = TriggerLog()
+# Session log records carry the trial the trigger log is on
+SESSION_LOG.trial_source = TRIGGER_LOG
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('path', help='Trigger log file (*_triggers.bin)')
+    parser.add_argument('--csv', help='Also write the records to this CSV file')
+    args = parser.parse_args(argv)
+
+    records = load_trigger_log(args.path)
+    header, _ = read_header(args.path)
+    offsets = ', '.join(f"{name} {value:+.6f} s" for name, value in header['clock_offsets'].items())
+    print(f"Created {header['created']} (clock offsets: {offsets or 'none'})")
+    if len(records):
+        print_summary(records, label=os.path.basename(args.path))
+    if args.csv:
+        to_frame(records).to_csv(args.csv, index=False)
+        print(f"✓ CSV written: {args.csv}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+PsychoPy sound backend selection with a per-machine cache.
+----------------------------------------------------------
+Trying 'ptb', 'pygame' and 'pysound' one after another on every launch
+repeats the same slow or failing probes. The frozen exe pays for them on
+top of onefile extraction. `select_backend()` does this instead:
+
+1. Look up the backend that won last time on this machine (same Python
+   executable and PsychoPy version) in a small JSON cache. If it still
+   opens, use it and skip every other probe.
+2. Otherwise go through the candidates in preference order: import the
+   backend module, then open a Sound on it, each step with its own
+   timeout, so one hanging driver cannot stall startup. Backends after
+   the first one that opens are never imported.
+3. Record the winner, its measured output latency and the probe time in
+   the cache. Only a working backend is cached: when nothing works, the
+   next launch probes again (a driver may have been busy or unplugged).
+
+Probes that time out cannot be killed. Before the fallback player opens
+its own stream, select_backend() gives them up to PROBE_GRACE_SEC more
+to finish, and a Sound that a late probe still opens is stopped and
+released instead of holding the device.
+"""
+
+import importlib
+import json
+import os
+import platform
+import sys
+import threading
+import time
+
+from session_log import get_logger
+
+DEFAULT_BACKENDS = ('ptb', 'pygame', 'pysound')
+BACKEND_MODULES = {
+    'ptb': 'psychopy.sound.backend_ptb',
+    'pygame': 'psychopy.sound.backend_pygame',
+    'pysound': 'psychopy.sound.backend_pysound',
+}
+FALLBACK = 'fallback'
+PROBE_GRACE_SEC = 2.0
+CACHE_VERSION = 1
+
+log = get_logger('audio_backend')
+
+
+def _machine_key():
+    """Identify this machine + interpreter + PsychoPy build."""
+    try:
+        import psychopy
+        psychopy_version = getattr(psychopy, '__version__', '')
+    except Exception:
+        psychopy_version = ''
+    return {
+        'host': platform.node(),
+        'executable': sys.executable,
+        'psychopy': psychopy_version,
+    }
+
+
+def load_cache(path):
+    """Return the cached entry dict, or None if missing/unreadable."""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding='utf-8') as f:
+            entry = json.load(f)
+        return entry if entry.get('version') == CACHE_VERSION else None
+    except Exception:
+        return None
+
+
+def clear_cache(path):
+    if path and os.path.exists(path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            log.warning(f"⚠ Could not remove audio backend cache: {e}")
+
+
+def save_cache(path, entry):
+    if not path:
+        return
+    try:
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(dict(entry, version=CACHE_VERSION), f, indent=1)
+        os.replace(tmp, path)
+    except Exception as e:
+        log.warning(f"⚠ Could not write audio backend cache: {e}")
+
+
+class _Probe:
+    """fn() on a daemon thread; a result that comes after the caller gave up goes to `on_late`."""
+
+    def __init__(self, fn, on_late=None, name='audio-probe'):
+        self.fn = fn
+        self.on_late = on_late
+        self.result = {}
+        self.abandoned = False
+        self._lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            value = self.fn()
+        except Exception as e:
+            self.result['error'] = e
+            return
+        with self._lock:
+            self.result['value'] = value
+            late = self.abandoned
+        if late and self.on_late is not None:
+            self.on_late(value)
+
+    def join(self, timeout):
+        """Return (ok, result_or_error); abandon the probe if it is still running."""
+        self.thread.join(timeout)
+        with self._lock:
+            if self.thread.is_alive() and 'value' not in self.result:
+                self.abandoned = True
+                _abandoned.append(self)
+                return False, TimeoutError(f"no answer within {timeout:.1f}s")
+        if 'error' in self.result:
+            return False, self.result['error']
+        return True, self.result['value']
+
+
+# Probes that timed out but may still be running
+_abandoned = []
+
+
+def _settle_probes(timeout):
+    """Give abandoned probes up to `timeout` seconds to finish; return how many still run."""
+    deadline = time.perf_counter() + timeout
+    for probe in _abandoned:
+        probe.thread.join(max(0.0, deadline - time.perf_counter()))
+    _abandoned[:] = [probe for probe in _abandoned if probe.thread.is_alive()]
+    return len(_abandoned)
+
+
+def _release_sound(snd):
+    """Stop and close a Sound opened by a probe that was given up on."""
+    for method in ('stop', 'close'):
+        try:
+            getattr(snd, method, lambda: None)()
+        except Exception:
+            pass
+
+
+def output_latency_ms(snd):
+    """Best-effort output latency of an opened Sound, in milliseconds."""
+    stream = getattr(snd, 'stream', None)
+    try:
+        status = stream.get_status()
+        return round(1000.0 * float(status['PredictedLatency']), 2)
+    except Exception:
+        pass
+    for obj in (stream, snd):
+        latency = getattr(obj, 'latency', None)
+        if isinstance(latency, (int, float)):
+            return round(1000.0 * latency, 2)
+    return None
+
+
+def fallback_latency_ms():
+    """Default low output latency of the sounddevice output device."""
+    try:
+        import sounddevice as sd
+        return round(1000.0 * sd.query_devices(kind='output')['default_low_output_latency'], 2)
+    except Exception:
+        return None
+
+
+def _open_sound(sound_module, name, timeout):
+    def make():
+        sound_module.Sound.backend = name
+        return sound_module.Sound('A', secs=-1, stereo=True)
+    return _Probe(make, on_late=_release_sound).join(timeout)
+
+
+def _importable(names, timeout):
+    """Import the backend modules one by one; yield the names that load.
+
+    Each import gets `timeout` seconds of its own. A generator, so the
+    caller can stop at the first backend that opens.
+    """
+    for name in names:
+        module = BACKEND_MODULES.get(name, name)
+        loaded, error = _Probe(lambda module=module: importlib.import_module(module),
+                               name='audio-import').join(timeout)
+        if loaded:
+            yield name
+        elif isinstance(error, TimeoutError):
+            log.info(f"  audio backend {name}: import timed out")
+        else:
+            log.info(f"  audio backend {name}: {error}")
+
+
+def select_backend(sound_module, backends=DEFAULT_BACKENDS, cache_path=None, timeout=5.0):
+    """Pick a working PsychoPy sound backend, using the cache when valid.
+
+    Args:
+        sound_module: The imported psychopy.sound module.
+        backends: Candidate backend names in order of preference.
+        cache_path: JSON cache file (None disables caching).
+        timeout: Seconds allowed per probe stage before giving up on it.
+
+    Returns:
+        (snd, info): an opened Sound (None means use the fallback player)
+        and a dict with backend, latency_ms, probe_ms and cached.
+    """
+    t0 = time.perf_counter()
+    key = _machine_key()
+    cached = load_cache(cache_path)
+    if cached is not None and cached.get('machine') != key:
+        cached = None
+
+    def finish(name, snd, from_cache):
+        latency = output_latency_ms(snd) if snd is not None else fallback_latency_ms()
+        info = {
+            'backend': name,
+            'latency_ms': latency,
+            'probe_ms': round(1000.0 * (time.perf_counter() - t0), 1),
+            'cached': from_cache,
+        }
+        if not from_cache and snd is not None:
+            entry = {k: v for k, v in info.items() if k != 'cached'}
+            save_cache(cache_path, dict(entry, machine=key, timestamp=time.time()))
+        return snd, info
+
+    # 1. Cached choice (only working backends are cached)
+    if cached is not None:
+        name = cached.get('backend')
+        if name in backends:
+            ok, snd = _open_sound(sound_module, name, timeout)
+            if ok:
+                return finish(name, snd, True)
+            log.warning(f"⚠ Cached audio backend '{name}' failed ({snd}); probing again")
+
+    # 2. Import and open each backend in preference order
+    for name in _importable(backends, timeout):
+        ok, snd = _open_sound(sound_module, name, timeout)
+        if ok:
+            return finish(name, snd, False)
+        log.info(f"  audio backend {name}: {snd}")
+
+    # 3. Fallback player; hung probes must not open the device under it
+    still_running = _settle_probes(PROBE_GRACE_SEC)
+    if still_running:
+        log.warning(f"⚠ {still_running} audio backend probe(s) still running; "
+                    f"a Sound they open later will be released")
+    clear_cache(cache_path)
+    return finish(FALLBACK, None, False)
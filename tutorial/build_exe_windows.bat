@@ -16,6 +16,7 @@ py -3 -m PyInstaller ^
   --onefile ^
   --name tutorial_refac_win ^
   --collect-submodules psychopy ^
+  --paths "..\experiments" ^
   --add-data "erp_stimuli;erp_stimuli" ^
   --add-data "main_stimuli;main_stimuli" ^
   tutorial_refac_win.py
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Non-slip onset scheduling for the ERP block.
+--------------------------------------------
+Running each ERP trial as its own routine restarts the timer every trial,
+so decode time, trigger RPC time and flip alignment accumulate as drift.
+Here every onset is computed up front on one block clock from the
+stimulus durations and the `isi` column, snapped to frame boundaries, and
+the achieved flip time of each onset is recorded next to the scheduled one.
+"""
+
+from session_log import get_logger
+
+log = get_logger('erp_schedule')
+
+
+class ErpSchedule:
+    """Absolute, frame-aligned onset times for a block of ERP trials.
+
+    Args:
+        durations: Stimulus durations in seconds (one per trial).
+        isis: Inter-stimulus intervals in seconds, measured from stimulus
+            offset to the next onset (matches the `isi` column).
+        frame_period: Display frame period in seconds.
+        lead_in: Delay from block start to the first onset.
+    """
+
+    def __init__(self, durations, isis, frame_period=1.0 / 60.0, lead_in=0.5):
+        if len(durations) != len(isis):
+            raise ValueError("durations and isis must have the same length")
+        self.frame_period = float(frame_period)
+        self.durations = [float(d) for d in durations]
+        self.isis = [float(i) for i in isis]
+
+        onsets = []
+        t = float(lead_in)
+        for duration, isi in zip(self.durations, self.isis):
+            onsets.append(self.align(t))
+            # Accumulate the nominal times, align only the result, so
+            # rounding never accumulates across trials.
+            t += duration + isi
+        self.onsets = onsets
+        self.offsets = [self.align(o + d) for o, d in zip(onsets, self.durations)]
+        self.end = self.align(t)
+        self.achieved = [None] * len(onsets)
+
+    def align(self, t):
+        """Snap `t` to the nearest frame boundary."""
+        return round(t / self.frame_period) * self.frame_period
+
+    def record(self, index, achieved):
+        self.achieved[index] = achieved
+
+    def rows(self):
+        """Per-trial (index, scheduled, achieved, error) tuples."""
+        out = []
+        for i, (sched, got) in enumerate(zip(self.onsets, self.achieved)):
+            error = None if got is None else got - sched
+            out.append((i, sched, got, error))
+        return out
+
+    def summary(self):
+        """Onset error and SOA statistics in milliseconds."""
+        errors = [r[3] for r in self.rows() if r[3] is not None]
+        if not errors:
+            return {'count': 0}
+        got = [a for a in self.achieved if a is not None]
+        sched_soa = [b - a for a, b in zip(self.onsets, self.onsets[1:])][:len(got) - 1]
+        got_soa = [b - a for a, b in zip(got, got[1:])]
+        soa_err = [(g - s) * 1000.0 for g, s in zip(got_soa, sched_soa)]
+        return {
+            'count': len(errors),
+            'mean_error_ms': 1000.0 * sum(errors) / len(errors),
+            'max_abs_error_ms': 1000.0 * max(abs(e) for e in errors),
+            'final_drift_ms': 1000.0 * errors[-1],
+            'max_abs_soa_error_ms': max((abs(e) for e in soa_err), default=0.0),
+        }
+
+    def print_report(self):
+        stats = self.summary()
+        if not stats['count']:
+            return stats
+        log.info(f"✓ ERP onsets: {stats['count']} trials | "
+                 f"error mean {stats['mean_error_ms']:.2f} ms, "
+                 f"max |{stats['max_abs_error_ms']:.2f}| ms, "
+                 f"final drift {stats['final_drift_ms']:.2f} ms, "
+                 f"SOA max |{stats['max_abs_soa_error_ms']:.2f}| ms")
+        return stats
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Managed launch of external tools (e.g. the real-time impedance checker).
+-----------------------------------------------------------------------
+While an external program owns the screen, the experiment should stay
+idle. A minimised PsychoPy window that keeps flipping at frame rate still
+competes with the tool for CPU and GPU time. `ExternalTool.wait()` does
+no rendering at all: it sleeps between polls of the keyboard and the
+child process, and returns on a continue key, an abort key or the
+tool's exit. The tool's lifetime and the experiment process's CPU use
+during the phase are recorded in `stats`.
+
+Example:
+    tool = ExternalTool([bundled_path, legacy_path], name='impedance checker')
+    if tool.launch():
+        hide_window(win)
+        reason = tool.wait(poll_keys, key_list=['9'])
+        tool.terminate()
+        restore_window(win)
+"""
+
+import os
+import subprocess
+import time
+
+from session_log import get_logger
+
+log = get_logger('external_tool')
+
+
+def hide_window(win):
+    """Minimise the PsychoPy window (pyglet) if the backend supports it."""
+    handle = getattr(win, 'winHandle', None)
+    if hasattr(handle, 'minimize'):
+        handle.minimize()
+
+
+def restore_window(win):
+    """Bring the PsychoPy window back to the front and maximise it."""
+    handle = getattr(win, 'winHandle', None)
+    if hasattr(handle, 'activate'):
+        handle.activate()
+    if hasattr(handle, 'maximize'):
+        handle.maximize()
+
+
+class ExternalTool:
+    """One external program launched for an experiment phase.
+
+    Args:
+        candidates: Executable paths; the first that exists is used.
+        name: Label used in console messages.
+        args: Extra command-line arguments.
+    """
+
+    def __init__(self, candidates, name='tool', args=()):
+        self.name = name
+        self.path = next((p for p in candidates if p and os.path.exists(p)), None)
+        self.args = list(args)
+        self.proc = None
+        self.stats = {}
+        self._t_launch = None
+
+    @property
+    def available(self):
+        return self.path is not None
+
+    def running(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def launch(self):
+        """Start the tool; returns False if it is missing or fails to start."""
+        if self.path is None:
+            return False
+        try:
+            self.proc = subprocess.Popen([self.path] + self.args)
+        except Exception as e:
+            log.warning(f"Failed to launch {self.name}: {e}")
+            return False
+        self._t_launch = time.perf_counter()
+        log.info(f"Launched {self.name} (pid {self.proc.pid})")
+        return True
+
+    def wait(self, poll_keys, key_list=('9',), abort_keys=('escape',), poll_interval=0.05,
+             sleep=time.sleep):
+        """Idle until a key in `key_list`/`abort_keys` or the tool's exit.
+
+        Args:
+            poll_keys: Callable returning the names of keys pressed since
+                the last call (must work without window flips).
+            key_list: Keys that end the phase normally.
+            abort_keys: Keys that end it with reason 'abort'.
+            poll_interval: Sleep between polls in seconds.
+            sleep: Sleep function (e.g. core.wait without CPU hogging).
+
+        Returns:
+            'key', 'abort' or 'exit'.
+        """
+        t0 = time.perf_counter()
+        cpu0 = time.process_time()
+        polls = 0
+        reason = None
+        while reason is None:
+            keys = poll_keys()
+            polls += 1
+            if any(k in abort_keys for k in keys):
+                reason = 'abort'
+            elif any(k in key_list for k in keys):
+                reason = 'key'
+            elif self.proc is not None and self.proc.poll() is not None:
+                reason = 'exit'
+            else:
+                sleep(poll_interval)
+
+        wall = time.perf_counter() - t0
+        cpu = time.process_time() - cpu0
+        self.stats = {
+            'reason': reason,
+            'wait_sec': round(wall, 3),
+            'cpu_sec': round(cpu, 3),
+            'cpu_percent': round(100.0 * cpu / wall, 1) if wall > 0 else 0.0,
+            'polls': polls,
+            'exit_code': self.proc.poll() if self.proc is not None else None,
+        }
+        log.info(f"  {self.name} phase ended ({reason}) after {wall:.1f} s; "
+                 f"experiment CPU {cpu:.2f} s ({self.stats['cpu_percent']:.1f}%)")
+        return reason
+
+    def terminate(self, timeout=2.0):
+        """Stop the tool (and its children on Windows) if it still runs."""
+        if self.proc is None:
+            return
+        if self.proc.poll() is None:
+            if os.name == 'nt':
+                subprocess.call(['taskkill', '/F', '/T', '/PID', str(self.proc.pid)])
+            else:
+                self.proc.terminate()
+            try:
+                self.proc.wait(timeout)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+        self.stats['lifetime_sec'] = round(time.perf_counter() - self._t_launch, 3)
+        self.stats['exit_code'] = self.proc.poll()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Data-driven routine engine for the tutorial experiment.
+-------------------------------------------------------
+Builder writes one frame loop per routine (see tutorial_lastrun.py), each
+repeating status bookkeeping, two `getFutureFlipTime` calls and a `hasattr`
+scan over every component on every frame. Here a routine is described
+declaratively and compiled once into sorted start/stop schedules, so the
+single frame loop only advances two cursors, draws the active stimuli and
+polls the keyboard once.
+
+Example:
+    start = Routine('Start', [
+        Component('start_text', stim=text_stim),
+        Component('key_resp', keys=['0']),
+    ], trigger=9999)
+    result = engine.run(start)
+"""
+
+import time
+
+from psychopy import core
+
+
+class Component:
+    """One routine component.
+
+    Args:
+        name: Component name (used for data columns).
+        stim: Visual stimulus with a draw() method.
+        sound: Sound object with play() (and optionally stop()).
+        keys: Key list; a key component ends the routine on a response.
+        start: Onset in seconds from routine start.
+        stop: Offset in seconds from routine start (None = until routine ends).
+        trigger: Trigger code sent on the flip where the component starts.
+        text: Text assigned to `stim` when the routine begins.
+    """
+
+    __slots__ = ('name', 'stim', 'sound', 'keys', 'start', 'stop', 'trigger', 'text')
+
+    def __init__(self, name, stim=None, sound=None, keys=None, start=0.0, stop=None,
+                 trigger=None, text=None):
+        self.name = name
+        self.stim = stim
+        self.sound = sound
+        self.keys = list(keys) if keys else None
+        self.start = float(start)
+        self.stop = None if stop is None else float(stop)
+        self.trigger = trigger
+        self.text = text
+
+
+class Routine:
+    """Declarative routine: components plus routine-level trigger/duration.
+
+    The component schedule is compiled once here rather than on every frame.
+    """
+
+    def __init__(self, name, components, trigger=None, max_duration=None):
+        self.name = name
+        self.components = list(components)
+        self.trigger = trigger
+        self.max_duration = max_duration
+        self._compile()
+
+    def _compile(self):
+        # (time, kind, component) sorted by time; kind is decided once here
+        starts, stops = [], []
+        key_list = []
+        key_start, key_stop = None, None
+        end_time = 0.0
+        open_ended = False
+        for comp in self.components:
+            if comp.keys:
+                key_list.extend(k for k in comp.keys if k not in key_list)
+                key_start = comp.start if key_start is None else min(key_start, comp.start)
+                if comp.stop is not None:
+                    key_stop = comp.stop if key_stop is None else max(key_stop, comp.stop)
+                continue
+            if comp.stim is not None:
+                starts.append((comp.start, 'draw', comp))
+                if comp.stop is not None:
+                    stops.append((comp.stop, 'draw', comp))
+            if comp.sound is not None:
+                starts.append((comp.start, 'sound', comp))
+                if comp.stop is not None and callable(getattr(comp.sound, 'stop', None)):
+                    stops.append((comp.stop, 'sound', comp))
+            if comp.trigger is not None:
+                starts.append((comp.start, 'trigger', comp))
+            if comp.stop is None:
+                open_ended = True
+            else:
+                end_time = max(end_time, comp.stop)
+
+        starts.sort(key=lambda item: item[0])
+        stops.sort(key=lambda item: item[0])
+        self.starts = starts
+        self.stops = stops
+        self.key_list = key_list or None
+        self.key_start = key_start or 0.0
+        self.key_stop = key_stop
+        # Without a key component, the routine ends when its last timed
+        # component stops (or at max_duration).
+        if self.max_duration is not None:
+            self.end_time = float(self.max_duration)
+        elif self.key_list is None and not open_ended:
+            self.end_time = end_time
+        else:
+            self.end_time = None
+
+
+class RoutineResult:
+    """Outcome of one routine run."""
+
+    __slots__ = ('name', 'keys', 'key', 'rt', 't_start', 't_stop', 'n_frames',
+                 'forced_end', 'overhead')
+
+    def __init__(self, name):
+        self.name = name
+        self.keys = []
+        self.key = None
+        self.rt = None
+        self.t_start = None
+        self.t_stop = None
+        self.n_frames = 0
+        self.forced_end = False
+        self.overhead = 0.0
+
+    @property
+    def mean_frame_overhead(self):
+        """Mean Python time per frame spent outside win.flip() (seconds)."""
+        return self.overhead / self.n_frames if self.n_frames else 0.0
+
+
+class RoutineEngine:
+    """Runs `Routine` objects with a single frame loop.
+
+    Args:
+        win: PsychoPy window.
+        keyboard: psychopy.hardware.keyboard.Keyboard used for responses.
+        send_trigger: Callable(code) used for routine/component triggers.
+        this_exp: Optional ExperimentHandler receiving start/stop/key data.
+        on_escape: Called when 'escape' is pressed (e.g. cleanup + quit).
+        frame_tolerance: Onset tolerance as in Builder scripts.
+    """
+
+    def __init__(self, win, keyboard, send_trigger=None, this_exp=None,
+                 on_escape=None, frame_tolerance=0.001):
+        self.win = win
+        self.keyboard = keyboard
+        self.send_trigger = send_trigger
+        self.this_exp = this_exp
+        self.on_escape = on_escape
+        self.frame_tolerance = frame_tolerance
+        self.clock = core.Clock()
+        self.global_clock = core.Clock()
+
+    def run(self, routine):
+        """Run `routine` until its key response or schedule end."""
+        win = self.win
+        kb = self.keyboard
+        clock = self.clock
+        tol = self.frame_tolerance
+        starts, stops = routine.starts, routine.stops
+        n_starts, n_stops = len(starts), len(stops)
+        end_time = routine.end_time
+        key_list = routine.key_list
+        poll_keys = (key_list or []) + ['escape']
+        key_start, key_stop = routine.key_start, routine.key_stop
+        perf = time.perf_counter
+
+        for comp in routine.components:
+            if comp.text is not None and comp.stim is not None:
+                comp.stim.text = comp.text
+
+        result = RoutineResult(routine.name)
+        if routine.trigger is not None and self.send_trigger is not None:
+            self.send_trigger(routine.trigger)
+
+        # t=0 and a clean key buffer on the first flip of the routine
+        win.callOnFlip(clock.reset)
+        win.callOnFlip(kb.clock.reset)
+        win.callOnFlip(kb.clearEvents, eventType='keyboard')
+        result.t_start = self.global_clock.getTime()
+
+        active = []
+        i_start = i_stop = 0
+        first_frame = True
+        while True:
+            frame_t0 = perf()
+            t_flip = 0.0 if first_frame else win.getFutureFlipTime(clock=clock)
+
+            # Advance the precomputed schedules
+            while i_start < n_starts and t_flip >= starts[i_start][0] - tol:
+                _, kind, comp = starts[i_start]
+                i_start += 1
+                if kind == 'draw':
+                    active.append(comp.stim)
+                elif kind == 'sound':
+                    win.callOnFlip(comp.sound.play)
+                elif self.send_trigger is not None:
+                    win.callOnFlip(self.send_trigger, comp.trigger)
+            while i_stop < n_stops and t_flip >= stops[i_stop][0] - tol:
+                _, kind, comp = stops[i_stop]
+                i_stop += 1
+                if kind == 'draw':
+                    active.remove(comp.stim)
+                else:
+                    comp.sound.stop()
+
+            if end_time is not None and t_flip >= end_time - tol:
+                break
+
+            # One keyboard poll per frame covers responses and escape
+            if not first_frame:
+                keys = kb.getKeys(keyList=poll_keys, waitRelease=False)
+                if keys:
+                    names = [k.name for k in keys]
+                    if 'escape' in names:
+                        result.forced_end = True
+                        if self.on_escape is not None:
+                            self.on_escape()
+                        break
+                    if t_flip >= key_start - tol and (key_stop is None or t_flip < key_stop):
+                        result.keys = keys
+                        result.key = keys[-1].name
+                        result.rt = keys[-1].rt
+                        break
+
+            for stim in active:
+                stim.draw()
+            result.overhead += perf() - frame_t0
+            win.flip()
+            result.n_frames += 1
+            first_frame = False
+
+        result.t_stop = self.global_clock.getTime()
+        self._record(routine, result)
+        return result
+
+    def _record(self, routine, result):
+        if self.this_exp is None:
+            return
+        self.this_exp.addData(f'{routine.name}.started', result.t_start)
+        self.this_exp.addData(f'{routine.name}.stopped', result.t_stop)
+        if routine.key_list is not None:
+            self.this_exp.addData(f'{routine.name}.keys', result.key)
+            if result.key is not None:
+                self.this_exp.addData(f'{routine.name}.rt', result.rt)
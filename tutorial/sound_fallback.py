@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Low-latency fallback sound player (used when no PsychoPy backend opens).
+------------------------------------------------------------------------
+One sounddevice output stream stays open for the whole session, and
+every sound is played by its callback, so play() never pays for opening
+a device. Decoded (and, if needed, resampled) buffers are kept in an
+LRU cache keyed by path, mtime and stream rate, so setSound() on a
+recent file costs nothing. Files longer than `stream_min_sec` are
+streamed from disk through streaming_playback.StereoStream; one at
+another rate reopens the stream at that rate, which empties the cache.
+
+Timing follows the PTB backend's interface: play(when=t) starts at the
+stream-clock time t (see getStreamTime()), isFinished()/stop() are
+available, and getOnsetTime() returns the DAC time of the first sample
+of the last sound.
+"""
+
+import os
+from collections import OrderedDict
+
+import numpy as np
+import soundfile as sf
+
+try:
+    import sounddevice as sd
+except Exception:
+    sd = None
+
+from stimulus_bank import resample
+from streaming_playback import SoundFileSource, StereoStream
+
+_STOP = object()
+
+
+class SimpleSoundFallback:
+    """Fallback sound player with a persistent stream and a decode cache.
+
+    Args:
+        samplerate: Output stream rate; cached buffers are resampled to it.
+        blocksize: Frames per audio callback.
+        latency: Requested output latency passed to sounddevice.
+        cache_mb: Upper bound on the decoded-buffer cache.
+        stream_min_sec: Files longer than this are streamed, not cached.
+    """
+
+    def __init__(self, samplerate=48000, blocksize=256, latency='low', cache_mb=256,
+                 stream_min_sec=20.0):
+        self.samplerate = samplerate
+        self.blocksize = blocksize
+        self.latency = latency
+        self.cache_bytes = int(cache_mb * 1e6)
+        self.stream_min_sec = stream_min_sec
+
+        self._cache = OrderedDict()  # (path, mtime_ns, samplerate) -> (n, 2) float32
+        self._cached_bytes = 0
+        self._path = None
+        self._duration = 0.0
+        self._source = None          # array or StereoStream for the next play()
+        self._started = None         # StereoStream handed to the callback last
+
+        # Callback state; the main thread only ever swaps self._command
+        self._command = None
+        self._active = None
+        self._pos = 0
+        self._when = None
+        self._onset = None
+        self._end = None
+        self._play_called = None
+
+        self._stream = None
+        if sd is not None:
+            self._open_stream(samplerate)
+
+    # ------------------------------------------------------------------
+    # Stream
+    # ------------------------------------------------------------------
+    def _open_stream(self, samplerate):
+        if self._stream is not None:
+            self._stream.abort()
+            self._stream.close()
+        if samplerate != self.samplerate:
+            # Cached buffers were resampled for the old rate
+            self._cache.clear()
+            self._cached_bytes = 0
+        self.samplerate = samplerate
+        self._stream = sd.OutputStream(
+            samplerate=samplerate,
+            channels=2,
+            dtype='float32',
+            blocksize=self.blocksize,
+            latency=self.latency,
+            callback=self._callback,
+        )
+        self._stream.start()
+
+    @property
+    def latency_ms(self):
+        """Output latency reported by the open stream."""
+        if self._stream is None:
+            return None
+        return round(1000.0 * self._stream.latency, 2)
+
+    def getStreamTime(self):
+        """Current time on the stream clock (the time base of `when`)."""
+        return self._stream.time if self._stream is not None else None
+
+    def _callback(self, outdata, frames, time_info, status):
+        outdata[:] = 0
+        command = self._command
+        if command is not None:
+            self._command = None
+            if command is _STOP:
+                self._active = None
+            else:
+                self._active, self._when = command
+                self._pos = 0
+        source = self._active
+        if source is None:
+            return
+
+        dac_time = time_info.outputBufferDacTime
+        if not dac_time:
+            dac_time = time_info.currentTime + self._stream.latency
+
+        offset = 0
+        if self._pos == 0 and self._onset is None:
+            if self._when is not None:
+                start = int(round((self._when - dac_time) * self.samplerate))
+                if start >= frames:
+                    return
+                offset = max(0, start)
+            self._onset = dac_time + offset / self.samplerate
+
+        if isinstance(source, np.ndarray):
+            n = max(0, min(frames - offset, len(source) - self._pos))
+            outdata[offset:offset + n] = source[self._pos:self._pos + n]
+            self._pos += n
+            done = self._pos >= len(source)
+        else:
+            n = source.read_into(outdata[offset:])
+            self._pos += n
+            done = source.drained
+        if done:
+            self._end = dac_time + (offset + n) / self.samplerate
+            self._active = None
+
+    # ------------------------------------------------------------------
+    # Decode cache
+    # ------------------------------------------------------------------
+    def _decode(self, path):
+        audio, sr = sf.read(path, dtype='float32', always_2d=True)
+        if audio.shape[1] == 1:
+            audio = np.repeat(audio, 2, axis=1)
+        elif audio.shape[1] > 2:
+            audio = audio[:, :2]
+        if sr != self.samplerate:
+            audio = np.stack([resample(audio[:, ch], sr, self.samplerate) for ch in range(2)], axis=1)
+        return np.ascontiguousarray(audio, dtype=np.float32)
+
+    def _cached(self, path):
+        key = (path, os.stat(path).st_mtime_ns, self.samplerate)
+        audio = self._cache.get(key)
+        if audio is not None:
+            self._cache.move_to_end(key)
+            return audio
+        audio = self._decode(path)
+        self._cache[key] = audio
+        self._cached_bytes += audio.nbytes
+        while self._cached_bytes > self.cache_bytes and len(self._cache) > 1:
+            _, evicted = self._cache.popitem(last=False)
+            self._cached_bytes -= evicted.nbytes
+        return audio
+
+    # ------------------------------------------------------------------
+    # PsychoPy-like interface
+    # ------------------------------------------------------------------
+    def setSound(self, path):
+        """Prepare `path` for the next play(); cached files cost nothing."""
+        if isinstance(self._source, StereoStream):
+            self._source.close()
+        self._path = path
+        info = sf.info(path)
+        self._duration = info.duration
+        if info.duration > self.stream_min_sec:
+            # Long file: only open it; blocks are read during playback
+            self._source = StereoStream(SoundFileSource(path)).prime()
+        else:
+            self._source = self._cached(path)
+
+    def preload(self, paths):
+        """Decode `paths` into the cache ahead of time."""
+        for path in paths:
+            if sf.info(path).duration <= self.stream_min_sec:
+                self._cached(path)
+
+    def play(self, when=None):
+        """Start the prepared sound now or at stream-clock time `when`."""
+        if self._stream is None or self._source is None:
+            return
+        source = self._source
+        if self._started is not None:
+            self._started.close()
+            self._started = None
+        if isinstance(source, StereoStream):
+            if source.samplerate != self.samplerate:
+                self._open_stream(source.samplerate)
+            source.start()
+            self._started = source
+            # A stream is consumed by one play; prepare it again with setSound
+            self._source = None
+        self._onset = None
+        self._end = None
+        self._play_called = self._stream.time
+        self._command = (source, when)
+
+    def stop(self):
+        self._command = _STOP
+        self._end = self.getStreamTime()
+
+    def isFinished(self):
+        """True once the last sample of the current sound has left the DAC."""
+        if self._command is not None or self._active is not None:
+            return False
+        return self._end is None or self.getStreamTime() >= self._end
+
+    def getOnsetTime(self):
+        """Stream-clock DAC time of the first sample of the last sound."""
+        return self._onset
+
+    def getOnsetDelay(self):
+        """Seconds from the last play() call to its first sample at the DAC."""
+        if self._onset is None or self._play_called is None:
+            return None
+        return self._onset - self._play_called
+
+    def getDuration(self):
+        return self._duration
+
+    def close(self):
+        if self._started is not None:
+            self._started.close()
+            self._started = None
+        if self._stream is not None:
+            self._stream.abort()
+            self._stream.close()
+            self._stream = None
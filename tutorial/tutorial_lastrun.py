@@ -37,6 +37,19 @@ import sys  # to get file system encoding
 import psychopy.iohub as io
 from psychopy.hardware import keyboard
 
+# Shared helpers from ../experiments; without them the script keeps its own code paths
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'experiments'))
+try:
+    from audio_triggers import SampleTriggerScheduler, ScheduledSound
+    from synapse_client import TriggerPulser
+    from trigger_log import TRIGGER_LOG
+except ImportError:
+    SampleTriggerScheduler = ScheduledSound = TriggerPulser = TRIGGER_LOG = None
+try:
+    from session_log import SESSION_LOG, get_logger
+except ImportError:
+    SESSION_LOG = None
+
 # --- Setup global variables (available in all functions) ---
 # create a device manager to handle hardware (keyboards, mice, mirophones, speakers, etc.)
 deviceManager = hardware.DeviceManager()
@@ -438,17 +451,66 @@ def run(expInfo, thisExp, win, globalClock=None, thisSession=None):
     from datetime import datetime
     import time
     
+    # Trigger messages go through the queued session log (experiments/session_log.py)
+    # instead of synchronous console prints; EXPERIMENT_LOG_LEVEL=DEBUG shows each trial
+    if SESSION_LOG is not None:
+        exp_log = get_logger('tutorial_lastrun')
+        SESSION_LOG.start(thisExp.dataFileName + '_log.jsonl')
+    else:
+        import logging as std_logging
+        std_logging.basicConfig(level=std_logging.INFO, format='%(message)s')
+        exp_log = std_logging.getLogger('tutorial_lastrun')
+    
     print("=========== Setting Configuration ===========") 
     # Attempt TDT Synapse connection
     try:
-        syn = tdt.SynapseAPI()
+        # Drop-in SynapseAPI over one kept-alive connection (experiments/synapse_client.py)
+        try:
+            from synapse_client import SynapseClient
+            syn = SynapseClient()
+        except ImportError:
+            syn = tdt.SynapseAPI()
         print("1. TDT Synapse connection successful")
         tdt_connected = True
     except Exception as e:
         print(f"TDT Synapse connection failed: {e}")
         # Abort experiment if TDT connection fails
+        closeSessionLogs()
         core.quit()
     
+    # Every trigger is pulsed by one TriggerPulser and recorded in
+    # <data file>_triggers.bin (experiments/trigger_log.py)
+    pulser = None
+    if TriggerPulser is not None:
+        pulser = TriggerPulser(syn, 'TTL2Int1', mode='software')
+        TRIGGER_LOG.start(thisExp.dataFileName + '_triggers.bin', clocks={'psychopy': core.getTime})
+    
+    def send_trigger(code, wait_fn=core.wait):
+        # Pulse a trigger code on TTL2Int1 (pass wait_fn=time.sleep off the main thread)
+        if pulser is None:
+            syn.setParameterValue('TTL2Int1', 'IntegerValue', int(code))
+            syn.setParameterValue('TTL2Int1', 'ManualTrigger', 1)
+            wait_fn(0.01)
+            syn.setParameterValue('TTL2Int1', 'ManualTrigger', 0)
+            return
+        requested = sent = time.perf_counter()
+        try:
+            sent = time.perf_counter()
+            acked = pulser.send(code, wait_fn)
+        except Exception:
+            TRIGGER_LOG.log(code, requested, sent, None)
+            raise
+        TRIGGER_LOG.log(code, requested, sent, acked)
+    
+    # Stimulus triggers fire when sample 0 reaches the DAC (experiments/audio_triggers.py)
+    scheduler = None
+    if SampleTriggerScheduler is not None:
+        try:
+            scheduler = SampleTriggerScheduler(lambda code: send_trigger(code, wait_fn=time.sleep))
+            print("Trigger mode: scheduled (aligned to audio DAC time)")
+        except Exception as e:
+            print(f"Scheduled triggers unavailable ({e}); sending them before playback")
+    
     # Initialize global variables
     experiment_start_time = None
     tank_dir = None
@@ -503,6 +565,9 @@ def run(expInfo, thisExp, win, globalClock=None, thisSession=None):
         speaker='erp_stimuli',    name='erp_stimuli'
     )
     erp_stimuli.setVolume(1.0)
+    if scheduler is not None:
+        # Played on the scheduler's stream, which fires the trigger with sample 0
+        erp_stimuli = ScheduledSound(scheduler, name='erp_stimuli')
     erp_text_rest = visual.TextStim(win=win, name='erp_text_rest',
         text='.',
         font='Arial',
@@ -550,6 +615,8 @@ def run(expInfo, thisExp, win, globalClock=None, thisSession=None):
         speaker='main_stimuli',    name='main_stimuli'
     )
     main_stimuli.setVolume(1.0)
+    if scheduler is not None:
+        main_stimuli = ScheduledSound(scheduler, name='main_stimuli')
     main_text_rest = visual.TextStim(win=win, name='main_text_rest',
         text='.',
         font='Arial',
@@ -706,6 +773,7 @@ def run(expInfo, thisExp, win, globalClock=None, thisSession=None):
         print("=========== Setting Configuration Done ===========")
     except Exception as e:
         print(f"Tank/Block setup failed: {e}")
+        closeSessionLogs()
         core.quit()
         
     start_text.setText("Tutorial start.\n\n- Setting up experiment successful.\n- Connecting TDT and configuring settings successful.\n\n(If you are willing to proceed, please press '0'.)\n\n(If you press '0', psychopy window will be minimized and impedance checker would appear.)")
@@ -838,17 +906,13 @@ def run(expInfo, thisExp, win, globalClock=None, thisSession=None):
         
         # Record initial trigger to mark experiment start
         EXP_START = 9999
-        syn.setParameterValue('TTL2Int1', 'IntegerValue', EXP_START)
-        syn.setParameterValue('TTL2Int1', 'ManualTrigger', 1)
-        core.wait(0.01)
-        syn.setParameterValue('TTL2Int1', 'ManualTrigger', 0)
-        print("=============================================") 
-        print(f"Experiment start trigger {EXP_START} sent")
-        print("=============================================") 
+        send_trigger(EXP_START)
+        exp_log.info(f"Experiment start trigger {EXP_START} sent")
         
         core.wait(1)
     except Exception as e:
         print(f"Failed to switch to Record mode: {e}")
+        closeSessionLogs()
         core.quit()
     # check responses
     if key_resp.keys in ['', [], None]:  # No response was made
@@ -876,13 +940,8 @@ def run(expInfo, thisExp, win, globalClock=None, thisSession=None):
     GELLING_END = 9001
     
     # Send Gelling start trigger
-    syn.setParameterValue('TTL2Int1', 'IntegerValue', GELLING_START)
-    syn.setParameterValue('TTL2Int1', 'ManualTrigger', 1)
-    core.wait(0.01)
-    syn.setParameterValue('TTL2Int1', 'ManualTrigger', 0)
-    print("=============================================") 
-    print(f"Gelling started - Trigger {GELLING_START} sent")
-    print("=============================================") 
+    send_trigger(GELLING_START)
+    exp_log.info(f"Gelling started - Trigger {GELLING_START} sent")
     
     # Launch impedance checker
     import subprocess
@@ -1021,13 +1080,8 @@ def run(expInfo, thisExp, win, globalClock=None, thisSession=None):
     print("PsychoPy window activated")
     
     # Send Gelling end trigger
-    syn.setParameterValue('TTL2Int1', 'IntegerValue', int(GELLING_END))
-    syn.setParameterValue('TTL2Int1', 'ManualTrigger', 1)
-    core.wait(0.01)
-    syn.setParameterValue('TTL2Int1', 'ManualTrigger', 0)
-    print("=============================================") 
-    print(f"Gelling ended - Trigger {GELLING_END} sent")
-    print("=============================================") 
+    send_trigger(GELLING_END)
+    exp_log.info(f"Gelling ended - Trigger {GELLING_END} sent")
     
     # Ensure impedance checker is fully closed
     try:
@@ -1179,13 +1233,8 @@ def run(expInfo, thisExp, win, globalClock=None, thisSession=None):
     # Run 'Begin Routine' code from erp_start_code
     # Send ERP block start trigger
     ERP_START = 8000
-    syn.setParameterValue('TTL2Int1', 'IntegerValue', int(ERP_START))
-    syn.setParameterValue('TTL2Int1', 'ManualTrigger', 1)
-    core.wait(0.01)
-    syn.setParameterValue('TTL2Int1', 'ManualTrigger', 0)
-    print("=============================================") 
-    print(f"ERP Block started - Trigger {ERP_START} sent")
-    print("=============================================")
+    send_trigger(ERP_START)
+    exp_log.info(f"ERP Block started - Trigger {ERP_START} sent")
     # create starting attributes for erp_start_key
     erp_start_key.keys = []
     erp_start_key.rt = []
@@ -1361,15 +1410,16 @@ def run(expInfo, thisExp, win, globalClock=None, thisSession=None):
         # Run 'Begin Routine' code from erp_code
         # Get trigger ID from CSV
         trigger_id = int(erp_trials.thisTrial['trigger_id'])  # from CSV trigger_id column
+        if TRIGGER_LOG is not None:
+            TRIGGER_LOG.trial = len(thisExp.entries) + 1  # data file row of this trial
         
         # Send trigger at stimulus onset (sync with sound start)
-        syn.setParameterValue('TTL2Int1', 'IntegerValue', trigger_id)
-        syn.setParameterValue('TTL2Int1', 'ManualTrigger', 1)
-        core.wait(0.01)
-        syn.setParameterValue('TTL2Int1', 'ManualTrigger', 0)
-        print("=============================================")
-        print(f"ERP Trial {index}: Trigger {trigger_id} sent, ISI = {isi:.3f}s")
-        print("=============================================")
+        if scheduler is not None:
+            erp_stimuli.trigger = trigger_id  # fired when sample 0 reaches the DAC
+            exp_log.debug("ERP Trial %s: Trigger %s scheduled, ISI = %.3fs", index, trigger_id, isi)
+        else:
+            send_trigger(trigger_id)
+            exp_log.debug("ERP Trial %s: Trigger %s sent, ISI = %.3fs", index, trigger_id, isi)
         erp_stimuli.setSound(fname, hamming=True)
         erp_stimuli.setVolume(1.0, log=False)
         erp_stimuli.seek(0)
@@ -1553,6 +1603,8 @@ def run(expInfo, thisExp, win, globalClock=None, thisSession=None):
         thisExp.nextEntry()
         
     # completed 1.0 repeats of 'erp_trials'
+    if TRIGGER_LOG is not None:
+        TRIGGER_LOG.trial = 0
     
     if thisSession is not None:
         # if running in a Session with a Liaison client, send data up to now
@@ -1691,13 +1743,10 @@ def run(expInfo, thisExp, win, globalClock=None, thisSession=None):
     # Run 'End Routine' code from erp_end_code
     # Send ERP block end trigger
     ERP_END = 8999
-    syn.setParameterValue('TTL2Int1', 'IntegerValue', ERP_END)
-    syn.setParameterValue('TTL2Int1', 'ManualTrigger', 1)
-    core.wait(0.01)
-    syn.setParameterValue('TTL2Int1', 'ManualTrigger', 0)
-    print("=============================================") 
-    print(f"ERP Block ended - Trigger {ERP_END} sent")
-    print("=============================================") 
+    send_trigger(ERP_END)
+    exp_log.info(f"ERP Block ended - Trigger {ERP_END} sent")
+    if scheduler is not None:
+        scheduler.print_report('ERP triggers')
     
             
     core.wait(2)
@@ -1724,13 +1773,8 @@ def run(expInfo, thisExp, win, globalClock=None, thisSession=None):
     # Run 'Begin Routine' code from main_start_code
     # Send Main block start trigger
     MAIN_START = 0
-    syn.setParameterValue('TTL2Int1', 'IntegerValue', MAIN_START)
-    syn.setParameterValue('TTL2Int1', 'ManualTrigger', 1)
-    core.wait(0.01)
-    syn.setParameterValue('TTL2Int1', 'ManualTrigger', 0)
-    print("=============================================")
-    print(f"Main Block started - Trigger {MAIN_START} sent")
-    print("=============================================")
+    send_trigger(MAIN_START)
+    exp_log.info(f"Main Block started - Trigger {MAIN_START} sent")
     
     # create starting attributes for main_start_key
     main_start_key.keys = []
@@ -1907,13 +1951,14 @@ def run(expInfo, thisExp, win, globalClock=None, thisSession=None):
         # Run 'Begin Routine' code from main_code
         # Get trigger ID from CSV
         trigger_id = int(main_trials.thisTrial['trigger_id'])  # from CSV trigger_id column
-        syn.setParameterValue('TTL2Int1', 'IntegerValue', trigger_id)
-        syn.setParameterValue('TTL2Int1', 'ManualTrigger', 1)
-        core.wait(0.01)
-        syn.setParameterValue('TTL2Int1', 'ManualTrigger', 0)
-        print("=============================================")
-        print(f"Main Trial {index}: {fname}, Trigger {trigger_id} sent")
-        print("=============================================")
+        if TRIGGER_LOG is not None:
+            TRIGGER_LOG.trial = len(thisExp.entries) + 1  # data file row of this trial
+        if scheduler is not None:
+            main_stimuli.trigger = trigger_id  # fired when sample 0 reaches the DAC
+            exp_log.debug("Main Trial %s: %s, Trigger %s scheduled", index, fname, trigger_id)
+        else:
+            send_trigger(trigger_id)
+            exp_log.debug("Main Trial %s: %s, Trigger %s sent", index, fname, trigger_id)
         main_stimuli.setSound(fname, hamming=True)
         main_stimuli.setVolume(1.0, log=False)
         main_stimuli.seek(0)
@@ -2099,13 +2144,8 @@ def run(expInfo, thisExp, win, globalClock=None, thisSession=None):
         # update component parameters for each repeat
         # Run 'Begin Routine' code from quiz_code
         quiz_trigger = trigger_id + 1000
-        syn.setParameterValue('TTL2Int1', 'IntegerValue', quiz_trigger)
-        syn.setParameterValue('TTL2Int1', 'ManualTrigger', 1)
-        core.wait(0.01)
-        syn.setParameterValue('TTL2Int1', 'ManualTrigger', 0)
-        print("=============================================")
-        print(f"Main Trial {index}: {fname}, Quiz Trigger {quiz_trigger} sent")
-        print("=============================================")
+        send_trigger(quiz_trigger)
+        exp_log.debug("Main Trial %s: %s, Quiz Trigger %s sent", index, fname, quiz_trigger)
         quiz_text.setText(quiz_content)
         # create starting attributes for quiz_key
         quiz_key.keys = []
@@ -2240,21 +2280,11 @@ def run(expInfo, thisExp, win, globalClock=None, thisSession=None):
         # Send trigger once there is an input on keyboard
         if quiz_key.keys:
             if quiz_key.corr:
-                syn.setParameterValue('TTL2Int1', 'IntegerValue', quiz_correct)
-                syn.setParameterValue('TTL2Int1', 'ManualTrigger', 1)
-                core.wait(0.01)
-                syn.setParameterValue('TTL2Int1', 'ManualTrigger', 0)
-                print("=============================================")
-                print(f"Quiz correct : Trigger {quiz_correct} sent")
-                print("=============================================")
+                send_trigger(quiz_correct)
+                exp_log.debug("Quiz correct : Trigger %s sent", quiz_correct)
             else:
-                syn.setParameterValue('TTL2Int1', 'IntegerValue', quiz_wrong)
-                syn.setParameterValue('TTL2Int1', 'ManualTrigger', 1)
-                core.wait(0.01)
-                syn.setParameterValue('TTL2Int1', 'ManualTrigger', 0)
-                print("=============================================")
-                print(f"Quiz wrong : Trigger {quiz_wrong} sent")
-                print("=============================================")
+                send_trigger(quiz_wrong)
+                exp_log.debug("Quiz wrong : Trigger %s sent", quiz_wrong)
         
         # check responses
         if quiz_key.keys in ['', [], None]:  # No response was made
@@ -2425,6 +2455,8 @@ def run(expInfo, thisExp, win, globalClock=None, thisSession=None):
         thisExp.nextEntry()
         
     # completed 1.0 repeats of 'main_trials'
+    if TRIGGER_LOG is not None:
+        TRIGGER_LOG.trial = 0
     
     if thisSession is not None:
         # if running in a Session with a Liaison client, send data up to now
@@ -2563,13 +2595,8 @@ def run(expInfo, thisExp, win, globalClock=None, thisSession=None):
     # Run 'End Routine' code from main_end_code
     # Send Main block end trigger
     MAIN_END = 1999
-    syn.setParameterValue('TTL2Int1', 'IntegerValue', MAIN_END)
-    syn.setParameterValue('TTL2Int1', 'ManualTrigger', 1)
-    core.wait(0.01)
-    syn.setParameterValue('TTL2Int1', 'ManualTrigger', 0)
-    print("=============================================")
-    print(f"Main Block ended - Trigger {MAIN_END} sent")
-    print("=============================================")
+    send_trigger(MAIN_END)
+    exp_log.info(f"Main Block ended - Trigger {MAIN_END} sent")
     
     # Final backup save after MAIN block
     backup_filename = filename + '_MAIN_backup.csv'
@@ -2602,13 +2629,8 @@ def run(expInfo, thisExp, win, globalClock=None, thisSession=None):
     # Run 'Begin Routine' code from finish_code
     # Send experiment end trigger
     EXP_END = 9998
-    syn.setParameterValue('TTL2Int1', 'IntegerValue', EXP_END)
-    syn.setParameterValue('TTL2Int1', 'ManualTrigger', 1)
-    core.wait(0.01)
-    syn.setParameterValue('TTL2Int1', 'ManualTrigger', 0)
-    print("=============================================")
-    print(f"Experiment end trigger {EXP_END} sent")
-    print("=============================================")
+    send_trigger(EXP_END)
+    exp_log.info(f"Experiment end trigger {EXP_END} sent")
     
     syn.setParameterValue('PZ5(1)', 'CheckSubAmp', 1)
     
@@ -2834,6 +2856,9 @@ def run(expInfo, thisExp, win, globalClock=None, thisSession=None):
         print(f"Error during final cleanup: {e}")
     
     # Close PsychoPy window and quit
+    if scheduler is not None:
+        scheduler.close()
+    closeSessionLogs()
     win.close()
     core.quit()
     
@@ -2857,6 +2882,20 @@ def saveData(thisExp):
     thisExp.saveAsPickle(filename)
 
 
+def closeSessionLogs():
+    """
+    Write out and close the session-wide logs of ../experiments.
+    
+    Called before core.quit(), which can end the process without running
+    atexit hooks.
+    """
+    if TRIGGER_LOG is not None:
+        TRIGGER_LOG.close()
+    # last, so the messages of the closes above reach the file too
+    if SESSION_LOG is not None:
+        SESSION_LOG.close()
+
+
 def endExperiment(thisExp, win=None):
     """
     End this experiment, performing final shut down operations.
@@ -2903,6 +2942,7 @@ def quit(thisExp, win=None, thisSession=None):
         win.flip()
         win.close()
     logging.flush()
+    closeSessionLogs()
     if thisSession is not None:
         thisSession.stop()
     # terminate Python process
@@ -8,18 +8,30 @@ This script runs a tutorial experiment involving TDT integration, Audio playback
 Structure:
 1. TDTManager: Handles connection to TDT Synapse and sending triggers.
 2. TutorialExperiment: Manages the PsychoPy window, stimuli, and experiment flow.
+3. routine_engine: Declarative routines run by a single precompiled frame loop.
+
+Each session also writes <data file>_trace.json (Chrome trace format, see
+experiments/session_trace.py) with spans for every phase and trial, and
+<data file>_triggers.bin with the requested/sent/acknowledged time of every
+trigger (see experiments/trigger_log.py). Stimulus, trigger and response
+windows run as critical sections (experiments/critical_section.py): no
+garbage collection inside them, collection on rest screens instead.
+Messages go to the console and <data file>_log.jsonl through
+experiments/session_log.py, off the main thread; set
+EXPERIMENT_LOG_LEVEL=DEBUG to also see every trigger on the console.
 
 How to add a new routine:
 1. Define a new method in TutorialExperiment (e.g., `run_new_task(self)`).
 2. Inside, set up your stimuli (text, sound, etc.).
-3. Use `self.present_routine()` to show text/wait for keys.
+3. Declare its screens in `_declare_routines()` as `Routine`/`Component`
+   objects and run them with `self.run_routine(name)`, or use
+   `self.present_routine()` for a one-off text/key screen.
 4. Add `self.run_new_task()` to the `run()` method sequence.
 """
 
 import os
 import sys
 import time
-import subprocess
 from datetime import datetime
 import numpy as np
 import pandas as pd
@@ -35,9 +47,33 @@ from psychopy import prefs
 prefs.hardware['audioLib'] = ['pygame']
 prefs.hardware['audioLatencyMode'] = 3
 
-from psychopy import visual, core, event, data, gui, sound, logging
+from psychopy import visual, core, data, gui, sound, logging
 from psychopy.hardware import keyboard
 
+# Shared timing helpers live next to the sentence experiments
+_EXPERIMENTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'experiments')
+if os.path.isdir(_EXPERIMENTS_DIR) and _EXPERIMENTS_DIR not in sys.path:
+    sys.path.insert(0, os.path.normpath(_EXPERIMENTS_DIR))
+
+from audio_triggers import SampleTriggerScheduler
+from audio_backend import select_backend
+from critical_section import CRITICAL, critical
+from external_tool import ExternalTool, hide_window, restore_window
+from routine_engine import Component, Routine, RoutineEngine
+from erp_monitor import TriggerPublisher, launch_monitor
+from erp_schedule import ErpSchedule
+from session_export import export_session
+from session_log import SESSION_LOG, get_logger
+from session_trace import TRACE, span, traced
+from sound_fallback import SimpleSoundFallback
+from streaming_playback import SoundFileSource, StereoStream
+from synapse_client import SynapseClient, TriggerPulser
+from synapse_config import RecordingLifecycle, configure_synapse, print_setup_report
+from trigger_log import TRIGGER_LOG
+
+# Stimuli longer than this are streamed from disk instead of decoded up front
+STREAM_MIN_SEC = 20.0
+
 
 def _detect_resource_dir():
     """Return directory containing bundled runtime resources."""
@@ -58,129 +94,172 @@ def _detect_output_dir():
     return os.path.dirname(os.path.abspath(__file__))
 
 
+log = get_logger('tutorial')
+
 # TDT Integration
 try:
     import tdt
     TDT_AVAILABLE = True
 except ImportError:
     TDT_AVAILABLE = False
-    print("Warning: 'tdt' package not found. TDT integration disabled.")
+    log.warning("Warning: 'tdt' package not found. TDT integration disabled.")
 
 
 class TDTManager:
     """Manages TDT Synapse connection and triggers."""
-    def __init__(self, gizmo='TTL2Int1'):
+    def __init__(self, gizmo='TTL2Int1', pulse_mode='auto'):
         self.syn = None
         self.gizmo = gizmo
         self.connected = False
+        self.pulser = None
+        self.recording = None
         
         if TDT_AVAILABLE:
             try:
-                self.syn = tdt.SynapseAPI()
+                self.syn = SynapseClient()
                 self.connected = True
-                print("✓ TDT Synapse Connected")
+                self.pulser = TriggerPulser(self.syn, gizmo, pulse_mode)
+                log.info(f"✓ TDT Synapse Connected ({self.pulser.mode} trigger pulses)")
             except Exception as e:
-                print(f"⚠ TDT Connection Failed: {e}")
+                log.warning(f"⚠ TDT Connection Failed: {e}")
 
+    @traced('tdt configure', cat='tdt')
     def configure(self, user, experiment, subject, block):
-        """Configure TDT Tank, Block, and Subject."""
+        """Configure TDT Tank, Block, and Subject (only what differs)."""
         if not self.connected: return
         try:
-            if self.syn.getMode() != 0:
-                self.syn.setMode(0)  # Idle
-            
-            self.syn.setCurrentUser(user)
-            self.syn.setCurrentExperiment(experiment)
-            self.syn.createSubject(subject, f'datetime_{datetime.now().strftime("%Y%m%d")}', 'mouse')
-            self.syn.setCurrentSubject(subject)
-            self.syn.setCurrentBlock(block)
-            print(f"✓ TDT Configured: {experiment} / {subject} / {block}")
+            steps = configure_synapse(
+                self.syn, user, experiment, subject, block,
+                subject_desc=f'datetime_{datetime.now().strftime("%Y%m%d")}', subject_icon='mouse'
+            )
+            print_setup_report(steps)
+            log.info(f"✓ TDT Configured: {experiment} / {subject} / {block}")
         except Exception as e:
-            print(f"⚠ TDT Configuration Error: {e}")
+            log.warning(f"⚠ TDT Configuration Error: {e}")
 
-    def start_recording(self):
+    def start_recording(self, on_confirmed=None):
+        """Request Record mode without blocking; `on_confirmed` runs once the rig reports it."""
         if self.connected:
-            self.syn.setMode(3)  # Record
-            print("✓ TDT Recording Started")
+            self.recording = RecordingLifecycle(self.syn)
+            self.recording.arm(on_confirmed)
+            log.info("✓ TDT Record mode requested")
+
+    def wait_recording(self, timeout=30.0):
+        """Block until Synapse reports Record (True when TDT is not used)."""
+        if self.recording is None:
+            return True
+        return self.recording.wait(timeout)
 
     def stop_recording(self):
         if self.connected:
-            self.syn.setMode(0)  # Idle
-            print("✓ TDT Recording Stopped")
+            if self.recording is not None:
+                self.recording.stop()  # also cancels a pending switch
+                self.recording = None
+            else:
+                self.syn.setMode(0)  # Idle
+            log.info("✓ TDT Recording Stopped")
+            self.syn.print_stats()
 
-    def send_trigger(self, val):
-        """Send a pulse trigger."""
+    def send_trigger(self, val, wait_fn=None):
+        """Send a pulse trigger (pass wait_fn=time.sleep off the main thread)."""
         if not self.connected: return
+        requested = sent = time.perf_counter()
         try:
-            self.syn.setParameterValue(self.gizmo, 'IntegerValue', int(val))
-            self.syn.setParameterValue(self.gizmo, 'ManualTrigger', 1)
-            core.wait(0.01)
-            self.syn.setParameterValue(self.gizmo, 'ManualTrigger', 0)
-            print(f"  -> Trigger Sent: {val}")
+            with span('trigger send', cat='tdt', code=int(val), pulse=self.pulser.mode):
+                sent = time.perf_counter()
+                acked = self.pulser.send(val, wait_fn or core.wait)
+            TRIGGER_LOG.log(val, requested, sent, acked)
+            log.debug("  -> Trigger Sent: %s", val)
         except Exception as e:
-            print(f"⚠ Trigger Error: {e}")
-
-
-class SimpleSoundFallback:
-    """Fallback sound player when PsychoPy sound backends are unavailable."""
-    def __init__(self):
-        self._path = None
-        self._duration = 0.0
-        self._audio = None
-        self._sr = None
-
-    def setSound(self, path):
-        self._path = path
-        self._audio, self._sr = sf.read(path, dtype='float32')
-        if self._audio.ndim > 1 and self._audio.shape[1] == 1:
-            self._audio = self._audio[:, 0]
-        self._duration = len(self._audio) / float(self._sr)
-
-    def play(self):
-        if sd is not None and self._audio is not None and self._sr is not None:
-            sd.play(self._audio, self._sr, blocking=False)
-
-    def getDuration(self):
-        return self._duration
+            TRIGGER_LOG.log(val, requested, sent, None)
+            log.warning("⚠ Trigger Error (%s): %s", val, e)
 
 
 class TutorialExperiment:
-    """Main experiment class handling window, stimuli, and flow."""
+    """Main experiment class handling window, stimuli, and flow.
+
+    Args:
+        trigger_mode: 'scheduled' (stimulus triggers at the DAC time of
+            sample 0) or 'immediate'.
+        pulse_mode: 'auto', 'hardware' or 'software' trigger pulses.
+        erp_monitor: Arguments for `erp_monitor.py monitor` (e.g.
+            ['--source', 'live', '--store', 'EEG1']) to launch it for the
+            ERP block; None leaves starting a monitor to the operator.
+        gc_mode: Garbage collection in critical windows: 'disable',
+            'freeze' or 'off' (measure only).
+        cpu: Core to pin the main thread to (None = any core).
+    """
     
-    def __init__(self):
+    def __init__(self, trigger_mode='scheduled', pulse_mode='auto', erp_monitor=None,
+                 gc_mode='disable', cpu=None):
         # 1. Setup Window
-        self.win = visual.Window(
-            size=[1920, 1080], fullscr=True, screen=0,
-            winType='pyglet', allowGUI=False,
-            color=[0, 0, 0], units='height'
-        )
+        with span('window init'):
+            self.win = visual.Window(
+                size=[1920, 1080], fullscr=True, screen=0,
+                winType='pyglet', allowGUI=False,
+                color=[0, 0, 0], units='height'
+            )
         self.win.mouseVisible = False
         
         # 2. Setup Input
         self.keyboard = keyboard.Keyboard()
         
         # 3. Setup Audio
-        # PsychoPy 2025+ selects backend via sound.Sound.backend
-        self.sound = None
-        for backend_name in ['ptb', 'pygame', 'pysound']:
-            try:
-                sound.Sound.backend = backend_name
-                self.sound = sound.Sound('A', secs=-1, stereo=True)
-                print(f"✓ Audio backend selected: {backend_name}")
-                break
-            except Exception:
-                continue
+        # PsychoPy 2025+ selects backend via sound.Sound.backend; the winner
+        # is cached per machine so later launches skip the other probes
+        with span('audio backend'):
+            self.sound, self.audio_backend = select_backend(
+                sound, cache_path=os.path.join(_detect_output_dir(), 'audio_backend.json')
+            )
+        latency = self.audio_backend['latency_ms']
+        latency_text = f", output latency {latency:.1f} ms" if latency is not None else ""
+        source = "cached" if self.audio_backend['cached'] else "probed"
         if self.sound is None:
-            print("⚠ No PsychoPy sound backend available. Using fallback audio player.")
-            self.sound = SimpleSoundFallback()
+            self.sound = SimpleSoundFallback(stream_min_sec=STREAM_MIN_SEC)
+            latency = self.sound.latency_ms
+            latency_text = f", output latency {latency:.1f} ms" if latency is not None else ""
+            log.warning(f"⚠ No PsychoPy sound backend available. Using fallback audio player "
+                        f"({source} in {self.audio_backend['probe_ms']:.0f} ms{latency_text}).")
+        else:
+            log.info(f"✓ Audio backend selected: {self.audio_backend['backend']} "
+                     f"({source} in {self.audio_backend['probe_ms']:.0f} ms{latency_text})")
         
         # 4. Setup TDT
-        self.tdt = TDTManager()
+        self.tdt = TDTManager(pulse_mode=pulse_mode)
+        
+        # 'scheduled': stimulus triggers fire when sample 0 reaches the DAC
+        self.trigger_mode = trigger_mode
+        self.trigger_scheduler = None
+        if trigger_mode == 'scheduled' and self.tdt.connected and sd is not None:
+            try:
+                self.trigger_scheduler = SampleTriggerScheduler(
+                    lambda code: self.tdt.send_trigger(code, wait_fn=time.sleep)
+                )
+                log.info("✓ Trigger mode: scheduled (aligned to audio DAC time)")
+            except Exception as e:
+                log.warning(f"⚠ Scheduled trigger mode unavailable: {e}")
         
         # 5. Common Stimuli (Reuse these)
         self.text_stim = visual.TextStim(self.win, text='', height=0.05, color='white')
         
-        # 6. Data Handler
+        # 6. Routine engine (compiled routines are cached per screen)
+        self.engine = RoutineEngine(
+            self.win, self.keyboard,
+            send_trigger=self.tdt.send_trigger,
+            on_escape=self._abort
+        )
+        self._routines = {}
+        self.routines = self._declare_routines()
+        
+        # ERP-block triggers are published to localhost for erp_monitor.py
+        self.erp_monitor = erp_monitor
+        self.monitor_process = None
+        
+        # Critical sections (GC held off, priority, core) start with the session
+        self.gc_mode = gc_mode
+        self.cpu = cpu
+        
+        # 7. Data Handler
         self.exp_info = {'participant': '999999', 'session': '001'}
         self.this_exp = None
         
@@ -217,6 +296,7 @@ class TutorialExperiment:
             text = text[:-2]
         return text.replace('num_', '')
 
+    @traced('dialog')
     def show_dialog(self):
         """Show participant info dialog."""
         dlg = gui.DlgFromDict(dictionary=self.exp_info, title='Tutorial Experiment')
@@ -236,6 +316,98 @@ class TutorialExperiment:
             dataFileName=filename,
             savePickle=True, saveWideText=True
         )
+        TRIGGER_LOG.start(f"{filename}_triggers.bin", clocks={'psychopy': core.getTime})
+        SESSION_LOG.start(f"{filename}_log.jsonl")
+        CRITICAL.start(gc_mode=self.gc_mode, cpu=self.cpu)
+
+    def _text(self, name, text=''):
+        return visual.TextStim(self.win, name=name, text=text, height=0.05, color='white')
+
+    def _declare_routines(self):
+        """The routines of the tutorial Builder flow (see tutorial_lastrun.py).
+
+        Compiled once here; the stimulus and quiz routines get their text
+        or duration per trial. The ERP trials are not a routine: their
+        onsets run on one block clock (see run_erp_block).
+        """
+        def key(name, keys, start=0.0):
+            return Component(name, keys=keys, start=start)
+
+        key_0 = ['0']
+        routines = [
+            Routine('Start', [
+                Component('start_text', stim=self._text('start_text')),
+                key('key_resp', key_0),
+            ]),
+            Routine('Gelling', [
+                Component('gelling_text', stim=self._text(
+                    'gelling_text',
+                    "(If gelling is finished and you are willing to proceed, please press '9'.)")),
+                key('gelling_key', ['9']),
+            ]),
+            Routine('Gelling_end', [
+                Component('gelling_end_text', stim=self._text(
+                    'gelling_end_text', "It takes about 20 seconds to stabilize EEG signals..."),
+                    stop=20.0),
+            ]),
+            Routine('ERP_start', [
+                Component('erp_start_text', stim=self._text(
+                    'erp_start_text', "ERP session starts.\nPress '0' to continue.")),
+                key('erp_start_key', key_0),
+            ], trigger=8000),
+            Routine('ERP_end', [
+                Component('erp_end_text', stim=self._text(
+                    'erp_end_text', "ERP session finished.\nPress '0'.")),
+                key('erp_end_key', key_0),
+            ], trigger=8999),
+            Routine('Main_start', [
+                Component('main_start_text', stim=self._text(
+                    'main_start_text', "Main session starts.\nPress '0'.")),
+                key('main_start_key', key_0),
+            ], trigger=0),
+            Routine('Main', [
+                Component('main_text', stim=self._text('main_text', '+')),
+            ]),
+            Routine('quiz', [
+                Component('quiz_text', stim=self._text('quiz_text')),
+                key('quiz_key', ['1', '2', '3', '4', 'num_1', 'num_2', 'num_3', 'num_4']),
+            ]),
+            Routine('rest', [
+                Component('rest_text', stim=self._text('rest_text', "Rest.\nPress '0' to continue.")),
+                key('rest_key', key_0),
+            ]),
+            Routine('Main_end', [
+                Component('main_end_text', stim=self._text(
+                    'main_end_text', "Main session finished.\nPress '0'.")),
+                key('main_end_key', key_0),
+            ], trigger=1999),
+            # EXP_END goes out on the flip that shows the second text
+            Routine('Finish', [
+                Component('finish_text_1', stim=self._text(
+                    'finish_text_1', "Please wait... Wrapping up."), stop=10.0),
+                Component('finish_text_2', stim=self._text(
+                    'finish_text_2', "Experiment Completed.\nPress '0' to exit."),
+                    start=10.0, trigger=9998),
+                key('finish_key', key_0, start=10.0),
+            ]),
+        ]
+        return {routine.name: routine for routine in routines}
+
+    def run_routine(self, name, text=None, duration=None):
+        """Run the declared routine `name` and return its RoutineResult.
+
+        Args:
+            text: Text of the routine's first component for this run.
+            duration: Run for this long instead of the routine's own end.
+        """
+        routine = self.routines[name]
+        if text is not None:
+            routine.components[0].text = text
+        if duration is not None:
+            routine = Routine(name, routine.components, trigger=routine.trigger,
+                              max_duration=duration)
+        with span('response' if routine.key_list else 'routine', routine=name):
+            return self.engine.run(routine)
 
     def present_routine(self, text=None, duration=None, key_list=None, trigger=None):
         """
@@ -244,42 +416,70 @@ class TutorialExperiment:
         - Sends trigger at start (optional)
         - Waits for duration OR key press
         """
-        # Setup
-        if text:
-            self.text_stim.text = text
-        
-        # Send Trigger
-        if trigger is not None:
-            self.tdt.send_trigger(trigger)
-            
-        # Clear events
-        self.keyboard.clearEvents()
-        timer = core.Clock()
-        keys = []
-        
-        # Loop
-        while True:
-            # Draw
+        with span('response' if key_list else 'routine', text=(text or '')[:40]):
+            return self._present_routine(text, duration, key_list, trigger)
+
+    def _present_routine(self, text, duration, key_list, trigger):
+        key = (text, duration, tuple(key_list) if key_list else None, trigger)
+        routine = self._routines.get(key)
+        if routine is None:
+            components = []
             if text:
-                self.text_stim.draw()
-            self.win.flip()
-            
-            # Check Time
-            if duration and timer.getTime() >= duration:
-                break
-                
-            # Check Keys
+                components.append(Component('text', stim=self.text_stim, text=text))
             if key_list:
-                keys = self.keyboard.getKeys(keyList=key_list, waitRelease=False)
-                if keys:
-                    break
-            
-            # Escape check
-            if 'escape' in event.getKeys():
-                self.cleanup()
-                core.quit()
-                
-        return keys
+                components.append(Component('key_resp', keys=key_list))
+            routine = Routine('routine', components, trigger=trigger, max_duration=duration)
+            self._routines[key] = routine
+        
+        return self.engine.run(routine).keys
+
+    def _poll_keys(self):
+        """Key names pressed since the last poll, without flipping the window."""
+        handle = getattr(self.win, 'winHandle', None)
+        if hasattr(handle, 'dispatch_events'):
+            handle.dispatch_events()
+        return [k.name for k in self.keyboard.getKeys(keyList=['9', 'escape'], waitRelease=False)]
+
+    def _abort(self):
+        """Escape handler: save, close and quit."""
+        self.cleanup()
+        core.quit()
+
+    def prepare_stimulus(self, sound_path, trigger):
+        """Load a stimulus ahead of its onset.
+
+        Returns (start, duration); calling start() begins playback with its
+        onset trigger. In scheduled mode the trigger is bound to the first
+        sample of the buffer; otherwise it is sent right before playback.
+        """
+        if self.trigger_scheduler is not None:
+            with span('stimulus load', path=os.path.basename(sound_path)):
+                if sf.info(sound_path).duration > STREAM_MIN_SEC:
+                    audio = StereoStream(SoundFileSource(sound_path)).prime()
+                    sr = audio.samplerate
+                else:
+                    audio, sr = sf.read(sound_path, dtype='float32')
+            scheduler = self.trigger_scheduler
+
+            def start():
+                with span('playback start'):
+                    scheduler.play(audio, triggers=[(0, trigger)], samplerate=sr)
+            return start, len(audio) / float(sr)
+
+        with span('stimulus load', path=os.path.basename(sound_path)):
+            self.sound.setSound(sound_path)
+
+        def start():
+            self.tdt.send_trigger(trigger)
+            with span('playback start'):
+                self.sound.play()
+        return start, self.sound.getDuration()
+
+    def play_stimulus(self, sound_path, trigger):
+        """Start a stimulus with its onset trigger and return its duration."""
+        start, duration = self.prepare_stimulus(sound_path, trigger)
+        start()
+        return duration
 
     def run_start(self):
         """Start Routine."""
@@ -288,98 +488,135 @@ class TutorialExperiment:
         block_name = f"{self.exp_info['participant']}_{clean_datetime}"
         
         self.tdt.configure("Tutorial", "Tutorial", self.exp_info['participant'], block_name)
-        self.tdt.start_recording()
-        self.tdt.send_trigger(9999)  # EXP_START
+        # Record mode comes up behind the start screen; EXP_START goes out
+        # from the worker as soon as Synapse confirms it
+        self.tdt.start_recording(
+            on_confirmed=lambda: self.tdt.send_trigger(9999, wait_fn=time.sleep)  # EXP_START
+        )
         
         msg = ("Tutorial start.\n\n"
                "- Setting up experiment successful.\n"
                "- Connecting TDT and configuring settings successful.\n\n"
                "(If you are willing to proceed, please press '0'.)")
-        self.present_routine(text=msg, key_list=['0'])
+        self.run_routine('Start', text=msg)
 
     def run_gelling(self):
         """Gelling Routine with external app launch."""
+        if not self.tdt.wait_recording():
+            self.present_routine(text="TDT did not confirm recording.\nThe experiment will end.",
+                                 duration=3.0)
+            self._abort()
         self.tdt.send_trigger(9000)  # GELLING_START
         
-        msg = "(If gelling is finished and you are willing to proceed, please press '9'.)"
-        
         # Launch Impedance Checker
         # Prefer bundled tool path; fallback to legacy absolute path.
         imp_candidates = [
             os.path.join(self.resource_dir, 'tools', 'check_realtime_imp.exe'),
             "C:/Users/KIST/Desktop/임피던스체커 패키지/check_realtime_imp.exe",
         ]
-        imp_path = next((p for p in imp_candidates if os.path.exists(p)), None)
-        proc = None
-        if imp_path is not None:
-            if hasattr(self.win, 'winHandle') and hasattr(self.win.winHandle, 'minimize'):
-                self.win.winHandle.minimize()
-            try:
-                proc = subprocess.Popen([imp_path])
-                print("Launched Impedance Checker")
-            except Exception as e:
-                print(f"Failed to launch checker: {e}")
-        
-        # Wait for key
-        self.present_routine(text=msg, key_list=['9'])
-        
-        # Cleanup
-        if proc:
-            if os.name == 'nt':
-                subprocess.call(['taskkill', '/F', '/T', '/PID', str(proc.pid)])
-            else:
-                proc.terminate()
-        if hasattr(self.win, 'winHandle') and hasattr(self.win.winHandle, 'activate'):
-            self.win.winHandle.activate()
-        if hasattr(self.win, 'winHandle') and hasattr(self.win.winHandle, 'maximize'):
-            self.win.winHandle.maximize()
+        checker = ExternalTool(imp_candidates, name='Impedance Checker')
+        if checker.launch():
+            # The checker owns the screen: no flips until '9' or the checker exits
+            hide_window(self.win)
+            with span('external tool', tool=checker.name):
+                reason = checker.wait(self._poll_keys, key_list=['9'],
+                                      sleep=lambda secs: core.wait(secs, hogCPUperiod=0))
+                checker.terminate()
+            TRACE.instant('external tool stats', cat='tool', **checker.stats)
+            restore_window(self.win)
+            if reason == 'abort':
+                self._abort()
+        else:
+            # Wait for key
+            self.run_routine('Gelling')
         
         self.tdt.send_trigger(9001)  # GELLING_END
         
         # Gelling End Message (20s wait)
-        msg_wait = "It takes about 20 seconds to stabilize EEG signals..."
-        self.present_routine(text=msg_wait, duration=20.0)
+        self.run_routine('Gelling_end')
 
     def run_erp_block(self):
-        """ERP Block Loop."""
-        self.present_routine(text="ERP session starts.\nPress '0' to continue.", key_list=['0'], trigger=8000)
+        """ERP Block Loop (non-slip: onsets are scheduled on one block clock)."""
+        CRITICAL.idle()
+        self.run_routine('ERP_start')
         
         # Load Conditions
         cond_file = os.path.join(self.resource_dir, 'erp_stimuli', 'erp_stimuli.csv')
         if not os.path.exists(cond_file):
-            print(f"Error: {cond_file} not found.")
+            log.error(f"Error: {cond_file} not found.")
             return
             
         trials = data.importConditions(cond_file)
+        paths = [self._resolve_stim_path(t['fname'], cond_file) for t in trials]
+        isis = [float(t['isi']) if 'isi' in t else 1.0 for t in trials]
+        durations = [sf.info(p).duration for p in paths]
+        if isinstance(self.sound, SimpleSoundFallback):
+            with span('stimulus load', paths=len(paths)):
+                self.sound.preload(paths)
+        schedule = ErpSchedule(durations, isis, frame_period=self.win.monitorFramePeriod or 1.0 / 60.0)
         
-        for trial in trials:
-            # 1. Trigger & Sound
+        # The online monitor gets each stimulus code with its DAC time
+        if self.erp_monitor is not None and self.monitor_process is None:
+            self.monitor_process = launch_monitor(self.erp_monitor)
+        publisher = TriggerPublisher(codes={int(t['trigger_id']) for t in trials})
+        TRIGGER_LOG.listeners.append(publisher)
+        
+        # Block clock starts on the first flip; every onset is absolute on it
+        t0 = self.win.flip()
+        for i, trial in enumerate(trials):
             trig_id = int(trial['trigger_id'])
-            sound_file = trial['fname']
-            isi = float(trial['isi']) if 'isi' in trial else 1.0
-            sound_path = self._resolve_stim_path(sound_file, cond_file)
-            
-            self.tdt.send_trigger(trig_id)
-            
-            # Play sound
-            self.sound.setSound(sound_path)
-            self.sound.play()
-            
-            # Show fixation during sound
-            self.present_routine(text='+', duration=self.sound.getDuration())
-            
-            # ISI
-            self.present_routine(text='.', duration=isi)
-            
-            # Save data
-            self.this_exp.addData('trigger_id', trig_id)
-            self.this_exp.nextEntry()
-            
-        self.present_routine(text="ERP session finished.\nPress '0'.", key_list=['0'], trigger=8999)
+            # Trigger log rows join the data file on its row number
+            TRIGGER_LOG.trial = len(self.this_exp.entries) + 1
+            with span('trial', block='erp', trigger=trig_id):
+                # Load during the ISI, start playback (and trigger) on the onset flip
+                start, _ = self.prepare_stimulus(paths[i], trig_id)
+                with critical('erp stimulus'):
+                    self._show_until(t0, schedule.onsets[i], '.')
+                    self.text_stim.text = '+'
+                    self.text_stim.draw()
+                    self.win.callOnFlip(start)
+                    schedule.record(i, self.win.flip() - t0)
+                    
+                    # Show fixation during sound
+                    self._show_until(t0, schedule.offsets[i], '+')
+                # Young objects only: the ISI is short
+                CRITICAL.idle(generation=0)
+                
+                # Save data
+                onset, achieved, error = schedule.rows()[i][1:]
+                self.this_exp.addData('trigger_id', trig_id)
+                self.this_exp.addData('onset_scheduled', onset)
+                self.this_exp.addData('onset_achieved', achieved)
+                self.this_exp.addData('onset_error_ms', error * 1000.0)
+                if isinstance(self.sound, SimpleSoundFallback) and self.trigger_scheduler is None:
+                    delay = self.sound.getOnsetDelay()
+                    if delay is not None:
+                        self.this_exp.addData('audio_onset_delay_ms', delay * 1000.0)
+                self.this_exp.nextEntry()
+        
+        # Final ISI
+        self._show_until(t0, schedule.end, '.')
+        TRIGGER_LOG.trial = 0
+        TRIGGER_LOG.listeners.remove(publisher)
+        publisher.close()
+        schedule.print_report()
+        if self.trigger_scheduler is not None:
+            self.trigger_scheduler.print_report('ERP triggers')
+        self.run_routine('ERP_end')
+
+    def _show_until(self, t0, t_end, text):
+        """Flip `text` until the flip that would land at or after t0 + t_end."""
+        self.text_stim.text = text
+        target = t0 + t_end - self.engine.frame_tolerance
+        while self.win.getFutureFlipTime(clock=None) < target:
+            self.text_stim.draw()
+            self.win.flip()
+            if self.keyboard.getKeys(keyList=['escape'], waitRelease=False):
+                self._abort()
 
     def run_main_block(self):
         """Main Block Loop with Quiz."""
-        self.present_routine(text="Main session starts.\nPress '0'.", key_list=['0'], trigger=0)
+        self.run_routine('Main_start')
         
         cond_file = os.path.join(self.resource_dir, 'main_stimuli', 'main_stimuli.csv')
         if not os.path.exists(cond_file):
@@ -388,26 +625,33 @@ class TutorialExperiment:
         trials = data.importConditions(cond_file)
         
         for trial in trials:
-            trig_id = int(trial['trigger_id'])
-            sound_file = trial['fname']
-            ans = self._normalize_answer(trial['ans'])
-            quiz_content = trial['quiz_content']
-            sound_path = self._resolve_stim_path(sound_file, cond_file)
-            
-            # 1. Stimulus
-            self.tdt.send_trigger(trig_id)
-            self.sound.setSound(sound_path)
-            self.sound.play()
-            self.present_routine(text='+', duration=self.sound.getDuration())
-            
-            # 2. Quiz
+            TRIGGER_LOG.trial = len(self.this_exp.entries) + 1
+            with span('trial', block='main', trigger=int(trial['trigger_id'])):
+                self._run_main_trial(trial, cond_file)
+        TRIGGER_LOG.trial = 0
+        
+        self.run_routine('Main_end')
+
+    def _run_main_trial(self, trial, cond_file):
+        """One main-block trial: stimulus, quiz, feedback trigger and rest."""
+        trig_id = int(trial['trigger_id'])
+        sound_file = trial['fname']
+        ans = self._normalize_answer(trial['ans'])
+        quiz_content = trial['quiz_content']
+        sound_path = self._resolve_stim_path(sound_file, cond_file)
+        
+        # 1. Stimulus
+        start, duration = self.prepare_stimulus(sound_path, trig_id)
+        with critical('playback'):
+            start()
+            self.run_routine('Main', duration=duration)
+        
+        # 2. Quiz
+        with critical('response'):
             quiz_trig = trig_id + 1000
             self.tdt.send_trigger(quiz_trig)
             
-            keys = self.present_routine(
-                text=quiz_content,
-                key_list=['1', '2', '3', '4', 'num_1', 'num_2', 'num_3', 'num_4']
-            )
+            keys = self.run_routine('quiz', text=quiz_content).keys
             
             # Check Answer
             resp = self._normalize_numeric_key(keys[0].name) if keys else None
@@ -416,32 +660,42 @@ class TutorialExperiment:
             # Feedback Trigger
             fb_trig = 2001 if corr else 2002
             self.tdt.send_trigger(fb_trig)
-            
-            # 3. Rest
-            self.present_routine(text="Rest.\nPress '0' to continue.", key_list=['0'])
-            
-            # Save
-            self.this_exp.addData('main_trigger', trig_id)
-            self.this_exp.addData('response', resp)
-            self.this_exp.addData('correct', corr)
-            self.this_exp.nextEntry()
-            
-        self.present_routine(text="Main session finished.\nPress '0'.", key_list=['0'], trigger=1999)
+        
+        # 3. Rest (the collector runs here, not in the windows above)
+        CRITICAL.idle()
+        self.run_routine('rest')
+        
+        # Save
+        self.this_exp.addData('main_trigger', trig_id)
+        self.this_exp.addData('response', resp)
+        self.this_exp.addData('correct', corr)
+        self.this_exp.nextEntry()
 
     def run_finish(self):
-        """Finish Routine."""
-        self.present_routine(text="Please wait... Wrapping up.", duration=10.0)
-        
-        self.tdt.send_trigger(9998) # EXP_END
+        """Finish Routine (EXP_END is sent by the routine at 10 s)."""
+        self.run_routine('Finish')
         self.tdt.stop_recording()
-        
-        self.present_routine(text="Experiment Completed.\nPress '0' to exit.", key_list=['0'])
         self.cleanup()
 
     def cleanup(self):
         """Close window and save."""
+        if self.trigger_scheduler is not None:
+            self.trigger_scheduler.close()
+        TRIGGER_LOG.close()
+        CRITICAL.close()
+        if self.monitor_process is not None:
+            self.monitor_process.terminate()
+        if isinstance(self.sound, SimpleSoundFallback):
+            self.sound.close()
         if self.this_exp:
-            self.this_exp.close()
+            with span('save'):
+                self.this_exp.close()
+            csv_path = f"{self.this_exp.dataFileName}.csv"
+            if os.path.exists(csv_path):
+                with span('export'):
+                    export_session(csv_path, kind='tutorial')
+            TRACE.save(f"{self.this_exp.dataFileName}_trace.json")
+        SESSION_LOG.close()
         self.win.close()
         core.quit()
 